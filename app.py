@@ -1,43 +1,1109 @@
 from dotenv import load_dotenv
-import requests
 import os
-from collections import Counter
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping
 import time
 import random
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from spotipy.oauth2 import SpotifyOAuth
-from mido import MidiFile, MidiTrack, Message
-from bs4 import BeautifulSoup
-from pytube import YouTube
-import time
+import io
+import argparse
+import atexit
+import functools
+import json
+import bisect
+import itertools
+import hashlib
+import math
+import re
+import shutil
+import struct
+import subprocess
+import sqlite3
+import threading
+import sys
+import asyncio
+import cProfile
+import pstats
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a heavy third-party module that imports it on first attribute access.
+
+    Each attribute is looked up in the real module once and then kept on the
+    stand-in, so later accesses cost no more than on the module itself.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attribute)
+        setattr(self, attribute, value)
+        return value
+
+    def __repr__(self):
+        return f'<LazyModule {self._name!r}>'
+
+
+class LazySingleton:
+    """
+    Getter of a process-wide object, created by the decorated factory on first call.
+
+    Concurrent first calls wait on a lock, so the factory runs once. The
+    object is kept in `instance`, where tests can replace it.
+    """
+
+    def __init__(self, create):
+        functools.update_wrapper(self, create)
+        self._create = create
+        self._lock = threading.Lock()
+        self.instance = None
+
+    def __call__(self):
+        if self.instance is None:
+            with self._lock:
+                if self.instance is None:
+                    self.instance = self._create()
+        return self.instance
+
+
+# The heavy dependencies are only imported once a feature uses them, so importing app stays fast;
+# the Spotify clients are likewise created on first use
+DEFERRED_MODULES = ('requests', 'numpy', 'aiohttp', 'spotipy', 'mido', 'pytube')
+requests = LazyModule('requests')
+np = LazyModule('numpy')
+aiohttp = LazyModule('aiohttp')
+web = LazyModule('aiohttp.web')
+spotipy = LazyModule('spotipy')
+mido = LazyModule('mido')
+pytube = LazyModule('pytube')
 
 
 load_dotenv()
 
 # Spotify API credentials
-CLIENT_ID = os.environ['SPOTIFY_CLIENT_ID']
-CLIENT_SECRET = os.environ['SPOTIFY_CLIENT_SECRET']
+def get_credentials():
+    """
+    Read the Spotify API credentials from the environment.
+
+    They are only read once a client needs them, so offline use works without them.
+
+    Returns:
+        tuple: (client ID, client secret).
+
+    Raises:
+        KeyError: If SPOTIFY_CLIENT_ID or SPOTIFY_CLIENT_SECRET is not set.
+    """
+    return os.environ['SPOTIFY_CLIENT_ID'], os.environ['SPOTIFY_CLIENT_SECRET']
+
+
+def preload_modules():
+    """Import every deferred dependency now, e.g. before timing stages or serving requests."""
+    for name in DEFERRED_MODULES:
+        importlib.import_module(name)
+
+
+#instrumentation
+# Upper bounds, in seconds, of the latency histogram buckets; slower samples fall in a final overflow bucket
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TRACE_MAX_EVENTS = 100000  # Trace events kept per run; the oldest are dropped first
+SAMPLING_INTERVAL = 0.005  # Seconds between stack samples of the sampling profiler
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histogram of latencies.
+
+    Memory does not grow with the number of samples, and percentiles are
+    estimated as the upper bound of the bucket they fall in.
+    """
+
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def percentile(self, q):
+        """Estimate the q-th percentile (0-100) in seconds."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 6),
+            'mean_seconds': round(self.total / self.count, 6) if self.count else 0.0,
+            'p50_seconds': round(self.percentile(50), 6),
+            'p90_seconds': round(self.percentile(90), 6),
+            'p99_seconds': round(self.percentile(99), 6),
+            'max_seconds': round(self.max, 6),
+            'buckets': {
+                **{f'<={bound:g}s': count for bound, count in zip(LATENCY_BUCKETS, self.buckets)},
+                f'>{LATENCY_BUCKETS[-1]:g}s': self.buckets[-1],
+            },
+        }
+
+
+class CallStats:
+    """Counts, latencies and bytes received of the outbound calls to one endpoint."""
+
+    __slots__ = ('latency', 'statuses', 'errors', 'cache_hits', 'bytes_received')
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.cache_hits = 0
+        self.bytes_received = 0
+
+    def to_dict(self):
+        return {
+            'calls': self.latency.count,
+            'cache_hits': self.cache_hits,
+            'bytes_received': self.bytes_received,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'latency': self.latency.to_dict(),
+        }
+
+
+class Instrumentation:
+    """
+    Per-run record of outbound calls and pipeline stages.
+
+    Every HTTP attempt (token, playlist tracks, artists, audio features,
+    recommendations, YouTube) is recorded per endpoint with its latency,
+    status and size, and every pipeline stage with its duration. Each call
+    and stage also becomes an event of a trace that write_trace() exports
+    in the Trace Event Format, viewable in chrome://tracing or Perfetto.
+    It is thread-safe, so batch workers and the async client's loop share it.
+    """
+
+    def __init__(self, max_events=TRACE_MAX_EVENTS):
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far and start a new run."""
+        with self._lock:
+            self.started_at = time.time()
+            self._origin = time.perf_counter()
+            self.calls = {}
+            self.stages = {}
+            self.events = deque(maxlen=self.max_events)
+
+    def _event(self, category, name, start, seconds, **args):
+        self.events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self._origin) * 1e6),
+            'dur': round(seconds * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+    def record_call(self, endpoint, start, seconds, status=None, bytes_received=0, error=None):
+        """
+        Record one outbound HTTP attempt.
+
+        Args:
+            endpoint (str): The endpoint name, see endpoint_for().
+            start (float): time.perf_counter() when the attempt started.
+            seconds (float): How long it took.
+            status (int): The response's status code, if one arrived.
+            bytes_received (int): Size of the response body.
+            error (str): Name of the exception that ended the attempt, if any.
+        """
+        with self._lock:
+            stats = self.calls.get(endpoint)
+            if stats is None:
+                stats = self.calls[endpoint] = CallStats()
+            stats.latency.add(seconds)
+            stats.bytes_received += bytes_received
+            if status is not None:
+                stats.statuses[status] += 1
+            if error is not None:
+                stats.errors[error] += 1
+            self._event('call', endpoint, start, seconds, status=status, bytes=bytes_received, error=error)
+
+    def record_cache_hit(self, endpoint):
+        """Record a request answered by the response cache without touching the network."""
+        with self._lock:
+            stats = self.calls.get(endpoint)
+            if stats is None:
+                stats = self.calls[endpoint] = CallStats()
+            stats.cache_hits += 1
+
+    @contextmanager
+    def call(self, endpoint):
+        """
+        Time an outbound call made outside the Spotify clients, such as a YouTube download.
+
+        Yields a dict; set its 'status' and 'bytes' entries to record them.
+        """
+        outcome = {}
+        start = time.perf_counter()
+        try:
+            yield outcome
+        except Exception as e:
+            self.record_call(endpoint, start, time.perf_counter() - start, error=type(e).__name__)
+            raise
+        self.record_call(endpoint, start, time.perf_counter() - start, outcome.get('status'), outcome.get('bytes', 0))
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage; also usable as a function decorator."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                histogram = self.stages.get(name)
+                if histogram is None:
+                    histogram = self.stages[name] = LatencyHistogram()
+                histogram.add(seconds)
+                self._event('stage', name, start, seconds)
+
+    def report(self):
+        """
+        Summarize the run.
+
+        Returns:
+            dict: Run timing, per-endpoint call statistics and per-stage durations.
+        """
+        with self._lock:
+            return {
+                'started_at': datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                'elapsed_seconds': round(time.perf_counter() - self._origin, 6),
+                'calls': {endpoint: stats.to_dict() for endpoint, stats in sorted(self.calls.items())},
+                'stages': {name: histogram.to_dict() for name, histogram in sorted(self.stages.items())},
+            }
+
+    def write_trace(self, path):
+        """Write the run's summary and trace events to a JSON file."""
+        report = self.report()
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'summary': report, 'traceEvents': events, 'displayTimeUnit': 'ms'}, f, indent=1)
+
+
+instrumentation = Instrumentation()
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that samples the stacks of every thread from a daemon thread.
+
+    Unlike cProfile it does not slow down the code it measures, so it can stay
+    on for long runs. Each function is counted once per sample in which it is
+    on a stack (inclusive) and when it is the innermost frame (exclusive).
+    """
+
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.inclusive = Counter()
+        self.exclusive = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                self.samples += 1
+                self.exclusive[self._label(frame)] += 1
+                on_stack = set()
+                while frame is not None:
+                    on_stack.add(self._label(frame))
+                    frame = frame.f_back
+                self.inclusive.update(on_stack)
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def format(self, limit=30):
+        """Format the hottest functions as a table."""
+        lines = [f'{self.samples} samples every {self.interval * 1000:g} ms', f"{'inclusive':>10} {'exclusive':>10}  function"]
+        for label, count in self.inclusive.most_common(limit):
+            lines.append(f'{count / max(self.samples, 1):>10.1%} {self.exclusive[label] / max(self.samples, 1):>10.1%}  {label}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profiling(kind=None, output=None):
+    """
+    Profile the enclosed code.
+
+    Args:
+        kind (str): 'cprofile', 'sampling', or None to not profile.
+        output (str): File for the results: pstats data for cProfile, a text table for
+            sampling. They are printed to stderr when no file is given.
+    """
+    if kind is None:
+        yield
+        return
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if output:
+                profiler.dump_stats(output)
+            else:
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+    elif kind == 'sampling':
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            if output:
+                with open(output, 'w', encoding='utf-8') as f:
+                    f.write(profiler.format() + '\n')
+            else:
+                print(profiler.format(), file=sys.stderr)
+    else:
+        raise ValueError(f"Unknown profiler: {kind}")
+
+
+# Request scheduling
+RATE_LIMIT = float(os.environ.get('SPOTIFY_RATE_LIMIT', 10))  # Requests per second across all endpoints
+RATE_BURST = int(os.environ.get('SPOTIFY_RATE_BURST', 20))
+
+# (requests per second, burst) of endpoints that get a budget of their own
+ENDPOINT_BUDGETS = {
+    'token': (1, 2),
+    'recommendations': (3, 5),
+}
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5  # Seconds; doubled on every retry
+BACKOFF_MAX = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket pacer that hands out reservations instead of blocking.
+
+    Each reservation takes one token, even when the bucket is empty, and
+    returns how long the caller has to wait before its token becomes valid.
+    Callers sleep outside the lock, so the same bucket paces threads and
+    asyncio tasks.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+def endpoint_for(url):
+    """Name the endpoint of a Spotify URL, e.g. 'audio-features', 'playlists' or 'token'."""
+    parts = urlsplit(url).path.strip('/').split('/')
+    if parts[:2] == ['api', 'token']:
+        return 'token'
+    if parts[0] == 'v1' and len(parts) > 1:
+        return parts[1]
+    return parts[0]
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header, in seconds or as an HTTP date, to seconds from now."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """
+    Central pacing and retry policy for every outbound Spotify request.
+
+    Requests draw from a global token bucket and, for endpoints listed in
+    budgets, from a bucket of their own. Failed requests are retried with
+    jittered exponential backoff, except that a Retry-After header is always
+    honored exactly. It also holds back every other request until that time,
+    because Spotify's rate limit applies to the whole app.
+    """
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, budgets=None, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._bucket = TokenBucket(rate, burst)
+        budgets = ENDPOINT_BUDGETS if budgets is None else budgets
+        self._endpoint_buckets = {endpoint: TokenBucket(*budget) for endpoint, budget in budgets.items()}
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self, endpoint):
+        """Reserve a slot for a request and return the seconds to wait before sending it."""
+        wait = self._bucket.reserve()
+        if endpoint in self._endpoint_buckets:
+            wait = max(wait, self._endpoint_buckets[endpoint].reserve())
+        with self._lock:
+            blocked_until = self._blocked_until
+        return max(wait, blocked_until - time.monotonic())
+
+    def retry_delay(self, attempt, retry_after=None):
+        """
+        Decide whether to retry a failed attempt.
+
+        Args:
+            attempt (int): Zero-based number of the attempt that failed.
+            retry_after (str): The response's Retry-After header, if any.
+
+        Returns:
+            float: Seconds to wait before retrying, or None to give up.
+        """
+        if attempt + 1 >= self.max_attempts:
+            return None
+        wait = parse_retry_after(retry_after)
+        if wait is not None:
+            # Concurrent 429s may arrive together; the latest Retry-After must win
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + wait)
+            return wait
+        # Full jitter keeps clients that failed together from retrying together
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _should_retry(self, response, attempt):
+        if response.status_code not in RETRY_STATUSES:
+            return None
+        return self.retry_delay(attempt, response.headers.get('Retry-After'))
+
+    def send(self, endpoint, send):
+        """
+        Run a blocking request under the scheduler's pacing and retry policy.
+
+        Args:
+            endpoint (str): The endpoint name, see endpoint_for().
+            send (callable): Sends the request and returns a requests.Response.
+
+        Returns:
+            requests.Response: The first successful response, or the last failed one.
+        """
+        for attempt in itertools.count():
+            wait = self.delay(endpoint)
+            if wait > 0:
+                time.sleep(wait)
+            start = time.perf_counter()
+            try:
+                response = send()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                instrumentation.record_call(endpoint, start, time.perf_counter() - start, error=type(e).__name__)
+                wait = self.retry_delay(attempt)
+                if wait is None:
+                    raise
+            else:
+                instrumentation.record_call(
+                    endpoint, start, time.perf_counter() - start, response.status_code, len(response.content),
+                )
+                wait = self._should_retry(response, attempt)
+                if wait is None:
+                    return response
+            time.sleep(wait)
+
+    async def send_async(self, endpoint, send):
+        """Coroutine version of send(), where send is a coroutine function."""
+        for attempt in itertools.count():
+            wait = self.delay(endpoint)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            start = time.perf_counter()
+            try:
+                response = await send()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                instrumentation.record_call(endpoint, start, time.perf_counter() - start, error=type(e).__name__)
+                wait = self.retry_delay(attempt)
+                if wait is None:
+                    raise
+            else:
+                instrumentation.record_call(
+                    endpoint, start, time.perf_counter() - start, response.status_code, len(response.content),
+                )
+                wait = self._should_retry(response, attempt)
+                if wait is None:
+                    return response
+            await asyncio.sleep(wait)
+
+
+request_scheduler = RequestScheduler()
+
+
+# Persistent HTTP response cache
+CACHE_PATH = os.environ.get('SPOTIFY_CACHE_PATH', '.spotify_cache.sqlite')
+CACHE_MAX_BYTES = int(os.environ.get('SPOTIFY_CACHE_MAX_BYTES', 100 * 1024 * 1024))
+
+DAY = 24 * 60 * 60
+
+# Time to live of cached responses, by API path prefix. Endpoints not listed here are never cached.
+CACHE_TTLS = [
+    ('/v1/audio-features', 30 * DAY),  # Audio features of a track never change
+    ('/v1/artists', 7 * DAY),
+    ('/v1/recommendations', DAY),
+    ('/v1/playlists', 10 * 60),  # Playlists change, but support ETag revalidation
+]
+
+
+class CachedEntry:
+    """A response body stored in the cache."""
+
+    def __init__(self, body, etag, stored_at):
+        self.body = body
+        self.etag = etag
+        self.stored_at = stored_at
+
+
+class ResponseCache:
+    """
+    On-disk SQLite cache of Spotify API response bodies.
+
+    Entries are keyed by URL with canonically ordered query parameters, expire
+    after the TTL of their endpoint and keep the response's ETag so expired
+    entries can be revalidated with If-None-Match. Once the stored bodies grow
+    past max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT, '
+            'stored_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def ttl_for(url):
+        """Return the TTL in seconds for a URL, or None if its responses are not cached."""
+        path = urlsplit(url).path
+        for prefix, ttl in CACHE_TTLS:
+            if path.startswith(prefix):
+                return ttl
+        return None
+
+    @staticmethod
+    def key_for(url, params=None):
+        """Build a cache key from a URL and its query parameters, independent of their order."""
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query)
+        if params:
+            query.extend((name, str(value)) for name, value in params.items() if value is not None)
+        return f'{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(sorted(query))}'
+
+    def lookup(self, key):
+        """Return the entry stored under key, or None, marking it as recently used."""
+        with self._lock:
+            row = self._conn.execute('SELECT body, etag, stored_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+        return CachedEntry(*row)
+
+    def store(self, key, body, etag=None):
+        """Store a response body, evicting least recently used entries if the cache is full."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._size -= row[0]
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, body, etag, stored_at, accessed_at, size) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, body, etag, now, now, len(body)),
+            )
+            self._size += len(body)
+            self._evict()
+            self._conn.commit()
+
+    def revalidated(self, key):
+        """Restart the TTL of an entry the server confirmed is unchanged."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+            self._conn.commit()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            rows = self._conn.execute('SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+
+
+def _build_response(url, status_code, reason, headers, body):
+    """Build a requests.Response from a body that was not received through requests."""
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response.url = url
+    response.encoding = 'utf-8'
+    response.headers.update(headers)
+    response._content = body
+    return response
+
+
+def _cached_response(url, body):
+    """Build a requests.Response that serves a cached body."""
+    response = _build_response(url, 200, 'OK', {'Content-Type': 'application/json'}, body)
+    response.from_cache = True
+    return response
+
+
+class CachingAdapter:
+    """
+    requests transport adapter that answers cacheable Spotify GET requests from a ResponseCache.
+
+    Fresh entries are served without touching the network. Expired entries with
+    an ETag are revalidated with If-None-Match, and a 304 reply serves the stored
+    body. Requests that do reach the network are paced and retried by the
+    scheduler. Token requests and the spotipy client go through a session with
+    this adapter mounted, see cached_session().
+    """
+
+    def __init__(self, cache, scheduler=None):
+        self.cache = cache
+        self.scheduler = scheduler
+        self._transport = requests.adapters.HTTPAdapter()
+
+    def _send(self, request, **kwargs):
+        send = functools.partial(self._transport.send, request, **kwargs)
+        if self.scheduler is None:
+            return send()
+        return self.scheduler.send(endpoint_for(request.url), send)
+
+    @staticmethod
+    def _cached(request, body):
+        response = _cached_response(request.url, body)
+        response.request = request
+        return response
+
+    def send(self, request, **kwargs):
+        url = request.url
+        ttl = self.cache.ttl_for(url) if request.method == 'GET' else None
+        if ttl is None:
+            return self._send(request, **kwargs)
+
+        key = self.cache.key_for(url)
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            if time.time() - entry.stored_at < ttl:
+                instrumentation.record_cache_hit(endpoint_for(url))
+                return self._cached(request, entry.body)
+            if entry.etag:
+                request.headers['If-None-Match'] = entry.etag
+
+        response = self._send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key)
+            return self._cached(request, entry.body)
+        if response.status_code == 200:
+            self.cache.store(key, response.content, response.headers.get('ETag'))
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+def cached_session(cache, scheduler=None):
+    """Return a requests.Session whose HTTP(S) traffic goes through a CachingAdapter."""
+    session = requests.Session()
+    adapter = CachingAdapter(cache, scheduler)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+@LazySingleton
+def get_response_cache():
+    """Return the process-wide ResponseCache, opening its database on first use."""
+    return ResponseCache()
+
+
+@LazySingleton
+def get_session():
+    """Return the process-wide cached requests.Session, creating it on first use."""
+    return cached_session(get_response_cache(), request_scheduler)
 
 #get token
+TOKEN_URL = os.environ.get('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+TOKEN_REFRESH_MARGIN = 60  # Refresh this many seconds before the token expires
+
+
+class TokenProvider:
+    """
+    Cache a client-credentials access token and refresh it shortly before it expires.
+
+    Only one refresh runs at a time: callers that arrive while a refresh is in
+    flight wait for it and reuse its token instead of requesting their own.
+    The provider also implements the `get_access_token` method spotipy expects
+    from an auth manager, so the spotipy client shares the same token.
+    """
+
+    def __init__(self, client_id, client_secret, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    def _is_fresh(self):
+        return self._token is not None and time.monotonic() < self._expires_at - self.refresh_margin
+
+    def _refresh(self):
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+        data = {
+            'grant_type': 'client_credentials',
+        }
+        response = get_session().post(TOKEN_URL, headers=headers, data=data, auth=(self.client_id, self.client_secret))
+        response.raise_for_status()  # Raise an error for bad responses
+        response_json = response.json()
+        self._token = response_json['access_token']
+        self._expires_at = time.monotonic() + response_json.get('expires_in', 3600)
+
+    def get_token(self):
+        """
+        Return a valid access token, refreshing it if it is missing or about to expire.
+
+        Returns:
+            str: The access token.
+        """
+        if self._is_fresh():
+            return self._token
+        with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if not self._is_fresh():
+                self._refresh()
+            return self._token
+
+    def invalidate(self, token=None):
+        """
+        Drop the cached token so the next call fetches a new one.
+
+        Args:
+            token (str): The token the API rejected. If given, the cached token is only dropped
+                while it is still this one, so callers rejected at the same time refresh once.
+        """
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def get_access_token(self, as_dict=False, check_cache=True):
+        """spotipy auth manager interface."""
+        return self.get_token()
+
+
+@LazySingleton
+def get_token_provider():
+    """Return the process-wide TokenProvider, reading the credentials on first use."""
+    return TokenProvider(*get_credentials())
+
+
 def get_access_token():
     """
     Get an access token from the Spotify API.
 
+    The token is cached and shared by every caller until shortly before it expires.
+
     Returns:
         str: The access token.
     """
-    url = 'https://accounts.spotify.com/api/token'
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-    }
-    data = {
-        'grant_type': 'client_credentials',
-    }
-    response = requests.post(url, headers=headers, data=data, auth=(CLIENT_ID, CLIENT_SECRET))
-    response.raise_for_status()  # Raise an error for bad responses
-    response_json = response.json()
-    return response_json['access_token']
+    return get_token_provider().get_token()
+
+
+#async spotify client
+API_BASE_URL = os.environ.get('SPOTIFY_API_BASE_URL', 'https://api.spotify.com/v1')
+MAX_CONCURRENCY = int(os.environ.get('SPOTIFY_MAX_CONCURRENCY', 8))  # Requests in flight at once
+
+
+class AsyncSpotifyClient:
+    """
+    asyncio client for the Spotify endpoints the app uses.
+
+    All requests share one aiohttp session whose connector keeps a pool of
+    keep-alive connections, and a semaphore bounds how many are in flight.
+    Cacheable GETs go through the same ResponseCache as cached_session(), requests
+    are paced by the same RequestScheduler, and tokens come from the shared
+    TokenProvider. A 401 reply drops the rejected token and the request is
+    retried once with a new one; an explicit token passed by the caller is
+    not used again once it has been rejected, so callers still holding it
+    do not pay a 401 on every request. HTTP and connection errors are
+    raised as requests exceptions so callers handle both clients alike.
+    """
+
+    def __init__(self, tokens, cache=None, max_concurrency=MAX_CONCURRENCY, api_base=API_BASE_URL, scheduler=None):
+        self.tokens = tokens
+        self.cache = cache
+        self.scheduler = scheduler
+        self.max_concurrency = max_concurrency
+        self.api_base = api_base
+        self._session = None
+        self._semaphore = None
+        self._rejected_tokens = set()  # Explicit tokens the API answered 401 to
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _ensure_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, raise_for_status=False)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _token(self, access_token=None):
+        if access_token and access_token not in self._rejected_tokens:
+            return access_token
+        # The provider only blocks on the network when the token needs a refresh
+        return await asyncio.to_thread(self.tokens.get_token)
+
+    async def get_json(self, url, params=None, access_token=None):
+        """
+        GET a Spotify API URL and decode its JSON body.
+
+        Args:
+            url (str): Absolute URL, or a path relative to the API base such as '/artists'.
+            params (dict): Query parameters.
+            access_token (str): Token to use instead of the shared provider's.
+
+        Returns:
+            dict: The decoded response.
+        """
+        if url.startswith('/'):
+            url = self.api_base + url
+        params = {name: str(value) for name, value in (params or {}).items() if value is not None}
+        session = self._ensure_session()
+        token = await self._token(access_token)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        ttl = self.cache.ttl_for(url) if self.cache is not None else None
+        key = entry = None
+        if ttl is not None:
+            key = self.cache.key_for(url, params)
+            entry = self.cache.lookup(key)
+            if entry is not None:
+                if time.time() - entry.stored_at < ttl:
+                    instrumentation.record_cache_hit(endpoint_for(url))
+                    return json.loads(entry.body)
+                if entry.etag:
+                    headers['If-None-Match'] = entry.etag
+
+        async def send():
+            try:
+                async with self._semaphore:
+                    async with session.get(url, params=params, headers=headers) as response:
+                        body = await response.read()
+                        return _build_response(str(response.url), response.status, response.reason, response.headers, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise requests.exceptions.ConnectionError(str(e)) from e
+
+        async def dispatch():
+            if self.scheduler is None:
+                return await send()
+            return await self.scheduler.send_async(endpoint_for(url), send)
+
+        response = await dispatch()
+        if response.status_code == 401:
+            # The token was revoked or expired early: replace it and try once more
+            if token == access_token:
+                self._rejected_tokens.add(token)
+            self.tokens.invalidate(token)
+            headers['Authorization'] = f'Bearer {await self._token()}'
+            response = await dispatch()
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key)
+            return json.loads(entry.body)
+        response.raise_for_status()
+        if key is not None:
+            self.cache.store(key, response.content, response.headers.get('ETag'))
+        return response.json()
+
+    async def _get_batched(self, path, ids, batch_size, field, access_token=None):
+        """Fetch a multi-ID endpoint in concurrent batches and concatenate the results."""
+        batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+        responses = await asyncio.gather(*(
+            self.get_json(path, {'ids': ','.join(batch)}, access_token) for batch in batches
+        ))
+        return [item for response in responses for item in response[field]]
+
+    async def playlist_page(self, playlist_id, offset=0, access_token=None):
+        """Fetch one page of a playlist's tracks."""
+        params = {'limit': PLAYLIST_PAGE_SIZE, 'offset': offset}
+        return await self.get_json(f'/playlists/{playlist_id}/tracks', params, access_token)
+
+    async def artists(self, artist_ids, access_token=None):
+        """Fetch artist objects, ARTISTS_BATCH_SIZE per request."""
+        return await self._get_batched('/artists', artist_ids, ARTISTS_BATCH_SIZE, 'artists', access_token)
+
+    async def audio_features(self, track_ids, access_token=None):
+        """Fetch audio features, AUDIO_FEATURES_BATCH_SIZE per request."""
+        return await self._get_batched(
+            '/audio-features', track_ids, AUDIO_FEATURES_BATCH_SIZE, 'audio_features', access_token,
+        )
+
+    async def recommendations(self, access_token=None, **params):
+        """Fetch recommendations; list parameters such as seed_genres are comma-joined."""
+        params = {name: ','.join(value) if isinstance(value, (list, tuple)) else value for name, value in params.items()}
+        return await self.get_json('/recommendations', params, access_token)
+
+
+class SpotifyClient:
+    """
+    Blocking facade over AsyncSpotifyClient for synchronous code such as gather_data().
+
+    The async client runs on a private event loop in a daemon thread; each
+    method submits a coroutine to it and waits for the result.
+    """
+
+    def __init__(self, tokens, cache=None, max_concurrency=MAX_CONCURRENCY, api_base=API_BASE_URL, scheduler=None):
+        self.max_concurrency = max_concurrency
+        self._client = AsyncSpotifyClient(tokens, cache, max_concurrency, api_base, scheduler)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='spotify-client', daemon=True)
+        self._thread.start()
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _run(self, coroutine):
+        return self._submit(coroutine).result()
+
+    def get_json(self, url, params=None, access_token=None):
+        return self._run(self._client.get_json(url, params, access_token))
+
+    def artists(self, artist_ids, access_token=None):
+        return self._run(self._client.artists(artist_ids, access_token))
+
+    def audio_features(self, track_ids, access_token=None):
+        return self._run(self._client.audio_features(track_ids, access_token))
+
+    def recommendations(self, access_token=None, **params):
+        return self._run(self._client.recommendations(access_token, **params))
+
+    def playlist_page(self, playlist_id, offset=0, access_token=None):
+        return self._run(self._client.playlist_page(playlist_id, offset, access_token))
+
+    def iter_playlist_pages(self, playlist_id, access_token=None, first_page=None, skip=()):
+        """
+        Yield (offset, page) for every page of a playlist's tracks in order.
+
+        Once the first page reveals the total, up to max_concurrency following
+        pages are requested ahead of the consumer. Pages whose offsets are in
+        skip are not requested and are yielded as None.
+        """
+        if first_page is None:
+            first_page = self.playlist_page(playlist_id, 0, access_token)
+        yield 0, first_page
+        pending = deque()
+        for offset in range(PLAYLIST_PAGE_SIZE, first_page['total'], PLAYLIST_PAGE_SIZE):
+            future = None if offset in skip else self._submit(self._client.playlist_page(playlist_id, offset, access_token))
+            pending.append((offset, future))
+            if len(pending) >= self.max_concurrency:
+                offset, future = pending.popleft()
+                yield offset, future and future.result()
+        while pending:
+            offset, future = pending.popleft()
+            yield offset, future and future.result()
+
+    def close(self):
+        self._run(self._client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+@LazySingleton
+def get_spotify_client():
+    """Return the process-wide SpotifyClient, creating it on first use."""
+    client = SpotifyClient(get_token_provider(), get_response_cache(), scheduler=request_scheduler)
+    atexit.register(client.close)
+    return client
+
 
 def get_standard_key(key):
     """Convert keys to standard sharp notation."""
@@ -51,31 +1117,136 @@ def get_standard_key(key):
     return key_mapping.get(key, key)
 
 
-def chord_to_midi(key, chord_name):
+def chord_to_midi(key, chord_name, mode='Major'):
     """Convert chord name to a list of MIDI note numbers."""
-    return CHORD_DICT[key].get(chord_name, [])
+    return list(chord_notes(key, chord_name, mode))
 
 
-def generate_midi_file(key, progression, filename="generated_song.mid"):
-    mid = MidiFile()
-    track = MidiTrack()
-    mid.tracks.append(track)
+#midi rendering
+TICKS_PER_BEAT = 480
+CHORD_TICKS = 480  # Each chord lasts one beat
+DEFAULT_TEMPO = 120
+MAX_MIDI_TEMPO = 0xFFFFFF  # Largest microseconds per beat a set_tempo message holds, about 3.6 BPM
 
-    for chord in progression:
-        key_standard = get_standard_key(key)  # Convert the key to standard notation
-        midi_notes = chord_to_midi(key_standard, chord)  # Use the standardized key to get MIDI notes
-        for note in midi_notes:
-            track.append(Message('note_on', note=note, velocity=64, time=0))
-        # Let the chord play for 480 ticks (a whole note in our case)
+
+def midi_tempo(tempo):
+    """
+    Convert a tempo in BPM to the microseconds per beat of a set_tempo message.
+
+    Spotify reports a tempo of 0 for some tracks, so tempos that are not
+    positive fall back to DEFAULT_TEMPO, and tempos too slow for the message
+    are clamped to the slowest it can hold.
+    """
+    if not tempo > 0:
+        tempo = DEFAULT_TEMPO
+    return min(mido.bpm2tempo(tempo), MAX_MIDI_TEMPO)
+
+
+def render_track(progression_notes, tempo=DEFAULT_TEMPO, time_signature=4, name=None):
+    """
+    Build a MIDI track from a progression already resolved to MIDI notes.
+
+    The track starts with tempo and time signature meta messages, so the
+    sampled tempo and meter travel with the file.
+
+    Args:
+        progression_notes (list): MIDI notes of each chord, e.g. from resolve_progression().
+        tempo (float): Tempo in beats per minute.
+        time_signature (int): Beats per bar, over a quarter note.
+        name (str): Optional track name.
+
+    Returns:
+        MidiTrack: The track.
+    """
+    track = mido.MidiTrack()
+    if name:
+        track.append(mido.MetaMessage('track_name', name=name, time=0))
+    track.append(mido.MetaMessage('set_tempo', tempo=midi_tempo(tempo), time=0))
+    track.append(mido.MetaMessage('time_signature', numerator=time_signature, denominator=4, time=0))
+    for midi_notes in progression_notes:
         for note in midi_notes:
-            track.append(Message('note_off', note=note, velocity=64, time=480))
+            track.append(mido.Message('note_on', note=note, velocity=64, time=0))
+        # The first note_off carries the chord's duration, the rest end at the same tick
+        for index, note in enumerate(midi_notes):
+            track.append(mido.Message('note_off', note=note, velocity=64, time=CHORD_TICKS if index == 0 else 0))
+    return track
+
+
+def _midi_bytes(mid):
+    buffer = io.BytesIO()
+    mid.save(file=buffer)
+    return buffer.getvalue()
+
+
+def render_midi(progression_notes, tempo=DEFAULT_TEMPO, time_signature=4):
+    """Render one song to the bytes of a single-track MIDI file, without touching the disk."""
+    mid = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    mid.tracks.append(render_track(progression_notes, tempo, time_signature))
+    return _midi_bytes(mid)
+
+
+def render_midi_multitrack(songs):
+    """
+    Render several songs to the bytes of one MIDI file.
+
+    The file is type 2, so every song is an independent sequence that keeps
+    its own tempo and time signature.
+
+    Args:
+        songs (list): Dictionaries with 'notes', 'tempo', 'time_signature' and optionally 'name'.
+
+    Returns:
+        bytes: The MIDI file.
+    """
+    mid = mido.MidiFile(type=2, ticks_per_beat=TICKS_PER_BEAT)
+    for song in songs:
+        mid.tracks.append(render_track(song['notes'], song['tempo'], song['time_signature'], song.get('name')))
+    return _midi_bytes(mid)
+
+
+@instrumentation.stage('midi_render')
+def write_midi_files(songs, output_dir='.', combined_filename=None):
+    """
+    Render and write every song in one pass.
+
+    Args:
+        songs (list): Dictionaries with 'notes', 'tempo', 'time_signature' and, unless
+            combined_filename is given, the 'filename' to write each song to.
+        output_dir (str): Directory the files are written to.
+        combined_filename (str): Write all songs to this one multi-track file instead.
+
+    Returns:
+        list: The paths written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if combined_filename:
+        outputs = [(combined_filename, render_midi_multitrack(songs))]
+    else:
+        outputs = [(song['filename'], render_midi(song['notes'], song['tempo'], song['time_signature'])) for song in songs]
+    paths = []
+    for filename, data in outputs:
+        path = os.path.join(output_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
 
-    mid.save(filename)
+def generate_midi_file(key, progression, filename="generated_song.mid", mode='Major', tempo=DEFAULT_TEMPO,
+                       time_signature=4):
+    """Render a progression in a key and write it to a MIDI file."""
+    with open(filename, 'wb') as f:
+        f.write(render_midi(resolve_progression(key, progression, mode), tempo, time_signature))
 
 
 
-client_credentials_manager = SpotifyClientCredentials(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+@LazySingleton
+def get_spotify():
+    """Return the process-wide spotipy client, importing spotipy on first use."""
+    spotify = spotipy.Spotify(auth_manager=get_token_provider(), requests_session=get_session())
+    spotify.prefix = API_BASE_URL + '/'
+    return spotify
+
 
 #parse spotify link
 def parse_spotify_link(link):
@@ -87,6 +1258,84 @@ def parse_spotify_link(link):
         raise ValueError("Invalid Spotify link")
 
 #fetch artist genre
+ARTISTS_BATCH_SIZE = 50  # Maximum number of IDs accepted by /v1/artists
+# Entries the in-memory genre and audio feature memos keep; older ones are fetched again, usually from the response cache
+ARTIST_GENRE_CACHE_SIZE = int(os.environ.get('ARTIST_GENRE_CACHE_SIZE', '10000'))
+AUDIO_FEATURES_CACHE_SIZE = int(os.environ.get('AUDIO_FEATURES_CACHE_SIZE', '10000'))
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that keeps at most max_entries items.
+
+    Reads and writes mark an entry as recently used, and the least recently
+    used entries are dropped once the cache is full, so a long-running
+    process that loads many playlists holds a bounded number of entries.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get_many(self, keys):
+        """Return the cached entries of keys as a dict, leaving out the ones not cached."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def update(self, entries):
+        with self._lock:
+            for key, value in entries.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Genres by artist ID, the most recently used ARTIST_GENRE_CACHE_SIZE of them
+artist_genre_cache = LRUCache(ARTIST_GENRE_CACHE_SIZE)
+
+
+def fetch_artist_genres(access_token, artist_ids):
+    """
+    Fetch the genres of several artists from the Spotify API.
+
+    No request is made when every artist is in the genre cache; otherwise the
+    deduplicated IDs are fetched through the multi-artist endpoint in batches.
+
+    Args:
+        access_token (str): The access token.
+        artist_ids (list): The artists' IDs, possibly with duplicates.
+
+    Returns:
+        dict: A mapping of artist ID to the list of genres associated with the artist.
+    """
+    unique_ids = list(dict.fromkeys(artist_ids))
+    genres_by_artist = artist_genre_cache.get_many(unique_ids)
+    # Request the whole batch, not just the evicted IDs, so its URL matches the response cache's entry
+    missing = unique_ids if len(genres_by_artist) < len(unique_ids) else []
+    artists = get_spotify_client().artists(missing, access_token)
+    fetched = {artist_id: artist['genres'] if artist else [] for artist_id, artist in zip(missing, artists)}
+    artist_genre_cache.update(fetched)
+    genres_by_artist.update(fetched)
+    return {artist_id: genres_by_artist[artist_id] for artist_id in artist_ids}
+
+
 def fetch_artist_genre(access_token, artist_id):
     """
     Fetch the genre of an artist from the Spotify API.
@@ -98,68 +1347,489 @@ def fetch_artist_genre(access_token, artist_id):
     Returns:
         list: A list of genres associated with the artist.
     """
-    url = f'https://api.spotify.com/v1/artists/{artist_id}'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    response_json = response.json()
-    return response_json['genres']
+    return fetch_artist_genres(access_token, [artist_id])[artist_id]
 
 #fetch songs
-def fetch_songs(access_token):
+PLAYLIST_PAGE_SIZE = 100  # Maximum page size of /v1/playlists/{id}/tracks
+AUDIO_FEATURES_BATCH_SIZE = 100  # Maximum number of IDs accepted by /v1/audio-features
+
+
+def normalize_track(track, position):
+    """Convert a playlist track object to the song dictionary used throughout the app."""
+    return {
+        'id': track['id'],
+        'name': track['name'],
+        'artist': track['artists'][0]['name'],
+        'artist_id': track['artists'][0]['id'],
+        'album': track['album']['name'],
+        'release_date': track['album']['release_date'],
+        'popularity': track['popularity'],
+        'duration_ms': track['duration_ms'],
+        'position': position,
+    }
+
+
+def fetch_audio_features(access_token, track_ids):
     """
-    Fetch the songs from the Spotify API.
+    Fetch the audio features of tracks, AUDIO_FEATURES_BATCH_SIZE per request.
 
     Args:
         access_token (str): The access token.
+        track_ids (list): The tracks' IDs.
 
     Returns:
-        list: A list of dictionaries containing the song data.
+        list: The audio features of each track, or None for tracks without features.
+    """
+    return get_spotify_client().audio_features(track_ids, access_token)
+
+
+# The audio features the pipeline reads; the rest of each payload is dropped before it is memoized
+AUDIO_FEATURE_FIELDS = ('tempo', 'energy', 'danceability', 'valence', 'loudness', 'key', 'mode', 'time_signature', 'duration_ms')
+# Audio features by track ID, the most recently used AUDIO_FEATURES_CACHE_SIZE of them
+audio_features_cache = LRUCache(AUDIO_FEATURES_CACHE_SIZE)
+
+
+def get_audio_features(track_ids):
+    """
+    Get the audio features of any number of tracks, memoized per track ID.
+
+    Unless every track was seen recently, the tracks are fetched in batches of
+    AUDIO_FEATURES_BATCH_SIZE.
+    Only the AUDIO_FEATURE_FIELDS of each track are kept.
+
+    Args:
+        track_ids (list): The tracks' IDs.
+
+    Returns:
+        dict: A mapping of track ID to its audio features, or None for tracks without features.
     """
-    url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?limit=50'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
+    unique_ids = list(dict.fromkeys(track_ids))
+    features_by_id = audio_features_cache.get_many(unique_ids)
+    # Request the whole batch, not just the evicted IDs, so its URL matches the response cache's entry
+    missing = unique_ids if len(features_by_id) < len(unique_ids) else []
+    fetched = {
+        track_id: {name: features[name] for name in AUDIO_FEATURE_FIELDS if name in features} if features else None
+        for track_id, features in zip(missing, fetch_audio_features(get_access_token(), missing))
     }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    response_json = response.json()
-    global songs
-    songs = []
-    global track_ids
-    track_ids = []
-    for i, item in enumerate(response_json['items']):
-        if i <= 50:
-            track = item['track']
-            track_ids.append(track['id'])
-            song = {
-                'id': track['id'],
-                'name': track['name'],
-                'artist': track['artists'][0]['name'],
-                'album': track['album']['name'],
-                'release_date': track['album']['release_date'],
-                'popularity': track['popularity'],
-                'duration_ms': track['duration_ms'],
-                'position': i + 1,
-            }
-            artist_id = track['artists'][0]['id']
-            song_genre = fetch_artist_genre(access_token, artist_id)
-            song['genre'] = song_genre
-            songs.append(song)
-            i+=1
+    audio_features_cache.update(fetched)
+    features_by_id.update(fetched)
+    return {track_id: features_by_id[track_id] for track_id in track_ids}
+
+
+#checkpoints
+CHECKPOINT_DIR = os.environ.get('SPOTIFY_CHECKPOINT_DIR', '.checkpoints')
+
+
+class PlaylistCheckpoint:
+    """
+    On-disk record of the playlist pages, artist batches and feature batches a run has finished.
+
+    Records are appended to a JSON Lines file as each unit of work completes,
+    so an interrupted or failed run of a large playlist resumes where it
+    stopped. A truncated last line, left by a crash mid-write, is cut off
+    when the checkpoint is loaded, so later records start on a line of their own.
+    """
+
+    def __init__(self, playlist_id, directory=CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f'{playlist_id}.jsonl')
+        self.total = None
+        self.pages = {}  # Normalized songs by page offset
+        self.genres = {}  # Genres by artist ID
+        self.features = {}  # Audio features by track ID
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid_bytes = 0
+        with open(self.path, 'r+b') as f:
+            for line in f:
+                # A line without its newline was cut short, even if what was written parses
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                if 'total' in record:
+                    self.total = record['total']
+                elif 'page' in record:
+                    self.pages[record['page']] = record['songs']
+                elif 'genres' in record:
+                    self.genres.update(record['genres'])
+                elif 'features' in record:
+                    self.features.update(record['features'])
+            f.truncate(valid_bytes)
+
+    def _append(self, record, mode='a'):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, mode, encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def start(self, total):
+        """Begin or resume a run; a playlist whose size changed starts over."""
+        if self.total != total:
+            self.total = total
+            self.pages.clear()
+            self.genres.clear()
+            self.features.clear()
+            self._append({'total': total}, mode='w')
+
+    def page_done(self, offset, songs):
+        self.pages[offset] = songs
+        self._append({'page': offset, 'songs': songs})
+
+    def artists_done(self, genres_by_artist):
+        self.genres.update(genres_by_artist)
+        self._append({'genres': genres_by_artist})
+
+    def features_done(self, features_by_id):
+        self.features.update(features_by_id)
+        self._append({'features': features_by_id})
+
+    def discard(self):
+        """Delete the checkpoint once its run has completed."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _complete_songs(access_token, batch, checkpoint=None):
+    """Attach genres and audio features to a batch of normalized songs, reusing what the checkpoint holds."""
+    artist_ids = [song['artist_id'] for song in batch]
+    track_ids = [song['id'] for song in batch]
+    if checkpoint is None:
+        genres_by_artist = fetch_artist_genres(access_token, artist_ids)
+        features_by_id = get_audio_features(track_ids)
+    else:
+        genres_by_artist = {artist_id: checkpoint.genres[artist_id] for artist_id in artist_ids if artist_id in checkpoint.genres}
+        missing = [artist_id for artist_id in artist_ids if artist_id not in genres_by_artist]
+        if missing:
+            fetched = fetch_artist_genres(access_token, missing)
+            checkpoint.artists_done(fetched)
+            genres_by_artist.update(fetched)
+        features_by_id = {track_id: checkpoint.features[track_id] for track_id in track_ids if track_id in checkpoint.features}
+        missing = [track_id for track_id in track_ids if track_id not in features_by_id]
+        if missing:
+            fetched = get_audio_features(missing)
+            checkpoint.features_done(fetched)
+            features_by_id.update(fetched)
+    for song in batch:
+        song['genre'] = genres_by_artist[song['artist_id']]
+        features = features_by_id[song['id']]
+        if features:
+            song.update(features)
+    return batch
+
+
+def iter_playlist_tracks(access_token, playlist_id, checkpoint=None):
+    """
+    Stream every track of a playlist, page by page.
+
+    Tracks are yielded with their genres and audio features as soon as a batch
+    of AUDIO_FEATURES_BATCH_SIZE tracks has been read, so only one batch is held
+    in memory and callers can start aggregating before the last page arrives.
+
+    With a checkpoint, pages, artists and audio features it already holds are
+    not requested again, and newly finished work is recorded in it.
+
+    Args:
+        access_token (str): The access token.
+        playlist_id (str): The playlist's ID.
+        checkpoint (PlaylistCheckpoint): Optional progress record to resume from.
+
+    Yields:
+        dict: The song data, in playlist order.
+    """
+    client = get_spotify_client()
+    first_page = client.playlist_page(playlist_id, 0, access_token)
+    skip = ()
+    if checkpoint is not None:
+        checkpoint.start(first_page['total'])
+        skip = set(checkpoint.pages)
+
+    pending = []
+    position = 0
+    for offset, page in client.iter_playlist_pages(playlist_id, access_token, first_page, skip):
+        if page is None:
+            page_songs = [dict(song) for song in checkpoint.pages[offset]]
         else:
-            break
+            page_songs = []
+            for item in page['items']:
+                track = item['track']
+                # Local files and removed tracks have no Spotify ID to look up
+                if not track or not track['id']:
+                    continue
+                page_songs.append(normalize_track(track, position + len(page_songs) + 1))
+            if checkpoint is not None and offset not in checkpoint.pages:
+                checkpoint.page_done(offset, [dict(song) for song in page_songs])
+        if page_songs:
+            position = page_songs[-1]['position']
+        for song in page_songs:
+            pending.append(song)
+            if len(pending) == AUDIO_FEATURES_BATCH_SIZE:
+                yield from _complete_songs(access_token, pending, checkpoint)
+                pending = []
+    if pending:
+        yield from _complete_songs(access_token, pending, checkpoint)
+
+
+def fetch_songs(access_token, playlist_id):
+    """
+    Fetch the songs from the Spotify API.
+
+    Args:
+        access_token (str): The access token.
+        playlist_id (str): The playlist's ID.
+
+    Returns:
+        list: A list of dictionaries containing the song data.
+    """
+    return list(iter_playlist_tracks(access_token, playlist_id))
+
+#track store
+# The only song fields the pipeline reads; everything else in the API's payloads is dropped
+TRACK_TEXT_FIELDS = ('id', 'name', 'artist')
+TRACK_FLOAT_FIELDS = ('tempo', 'energy', 'danceability', 'valence', 'loudness')
+TRACK_INT_FIELDS = {'key': 'int8', 'mode': 'int8', 'time_signature': 'int8', 'duration_ms': 'int32', 'position': 'int32'}
+TRACK_STORE_CAPACITY = 1024  # Rows allocated up front; the arrays double whenever they fill up
+
+
+class TrackRow(Mapping):
+    """
+    Read-only dict-like view of one track in a TrackStore.
+
+    Missing values (NaN floats and -1 integers) behave like absent keys, so
+    code written for song dictionaries, such as song.get('key', 0), works
+    unchanged.
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, name):
+        return self._store.value(self._index, name)
+
+    def __iter__(self):
+        return (name for name in self._store.fields if name in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
 
-    # Get audio features of the tracks in bulk
-    audio_features_url = f'https://api.spotify.com/v1/audio-features'
-    audio_features_response = requests.get(audio_features_url, headers=headers, params={'ids': ','.join(track_ids)})
-    audio_features_response.raise_for_status()
-    audio_features_list = audio_features_response.json()['audio_features']
-    for song, features in zip(songs, audio_features_list):
-        song.update(features)
+    def __repr__(self):
+        return f'TrackRow({dict(self)!r})'
+
+
+class TrackStore:
+    """
+    Columnar storage of a playlist's tracks.
+
+    Numeric features live in one NumPy array per field, text fields in plain
+    lists, and genres as codes into a table of interned genre names, so a
+    track costs a few dozen bytes instead of a dictionary of boxed objects.
+    Only the fields the pipeline reads are kept. column() returns views of
+    the arrays and slicing a store returns a store that shares them, so
+    scoring and aggregation read the data without copying it. Indexing
+    returns TrackRow views for code that expects song dictionaries.
+    """
+
+    def __init__(self, capacity=TRACK_STORE_CAPACITY):
+        self._size = 0
+        self._text = {name: [] for name in TRACK_TEXT_FIELDS}
+        self._floats = {name: np.full(capacity, np.nan) for name in TRACK_FLOAT_FIELDS}
+        self._ints = {name: np.full(capacity, -1, dtype=dtype) for name, dtype in TRACK_INT_FIELDS.items()}
+        self.genre_names = []
+        self._genre_ids = {}
+        # Genres of track i are genre_codes[genre_offsets[i]:genre_offsets[i + 1]]
+        self._genre_codes = np.empty(capacity, dtype=np.int32)
+        self._genre_offsets = np.zeros(capacity + 1, dtype=np.int64)
+
+    @classmethod
+    def from_songs(cls, songs):
+        """Build a store from song dictionaries."""
+        store = cls()
+        for song in songs:
+            store.append(song)
+        return store
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Build a store from whole columns, e.g. the arrays of a saved profile.
+
+        Args:
+            columns (dict): Arrays or lists by field name, all of the same length. Missing
+                fields are filled with missing values.
+
+        Returns:
+            TrackStore: A store of those tracks, without genres.
+        """
+        size = len(next(iter(columns.values()))) if columns else 0
+        store = cls(capacity=size)
+        store._size = size
+        for name in TRACK_TEXT_FIELDS:
+            store._text[name] = list(columns.get(name, [''] * size))
+        for name in TRACK_FLOAT_FIELDS:
+            if name in columns:
+                store._floats[name] = np.asarray(columns[name], dtype=float)
+        for name, dtype in TRACK_INT_FIELDS.items():
+            if name in columns:
+                store._ints[name] = np.asarray(columns[name], dtype=dtype)
+        return store
+
+    @property
+    def fields(self):
+        return TRACK_TEXT_FIELDS + TRACK_FLOAT_FIELDS + tuple(TRACK_INT_FIELDS) + ('genre',)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return (TrackRow(self, index) for index in range(self._size))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(index)
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('track index out of range')
+        return TrackRow(self, index)
+
+    def _slice(self, index):
+        start, stop, step = index.indices(self._size)
+        if step != 1:
+            raise ValueError("TrackStore only supports contiguous slices")
+        stop = max(start, stop)
+        view = object.__new__(TrackStore)
+        view._size = stop - start
+        view._text = {name: values[start:stop] for name, values in self._text.items()}
+        view._floats = {name: values[start:stop] for name, values in self._floats.items()}
+        view._ints = {name: values[start:stop] for name, values in self._ints.items()}
+        view.genre_names = self.genre_names
+        view._genre_ids = self._genre_ids
+        # Offsets stay absolute, so the view keeps reading the parent's codes
+        view._genre_codes = self._genre_codes
+        view._genre_offsets = self._genre_offsets[start:stop + 1]
+        return view
+
+    def _grow(self, size, genre_count):
+        capacity = len(self._genre_offsets) - 1
+        if size > capacity:
+            capacity = max(size, capacity * 2, TRACK_STORE_CAPACITY)
+            for columns, fill in ((self._floats, np.nan), (self._ints, -1)):
+                for name, values in columns.items():
+                    grown = np.full(capacity, fill, dtype=values.dtype)
+                    grown[:self._size] = values[:self._size]
+                    columns[name] = grown
+            offsets = np.zeros(capacity + 1, dtype=np.int64)
+            offsets[:self._size + 1] = self._genre_offsets[:self._size + 1]
+            self._genre_offsets = offsets
+        if genre_count > len(self._genre_codes):
+            codes = np.empty(max(genre_count, len(self._genre_codes) * 2), dtype=np.int32)
+            codes[:self._genre_offsets[self._size]] = self._genre_codes[:self._genre_offsets[self._size]]
+            self._genre_codes = codes
+
+    def genre_id(self, genre):
+        """Return the code of a genre name, adding it to the table if it is new."""
+        code = self._genre_ids.get(genre)
+        if code is None:
+            code = self._genre_ids[genre] = len(self.genre_names)
+            self.genre_names.append(genre)
+        return code
+
+    def append(self, song):
+        """Add a song dictionary, keeping only the fields in the store's columns."""
+        genres = song.get('genre') or ()
+        start = int(self._genre_offsets[self._size])
+        self._grow(self._size + 1, start + len(genres))
+        index = self._size
+        for name, values in self._text.items():
+            values.append(song.get(name, ''))
+        for name, values in self._floats.items():
+            value = song.get(name)
+            if value is not None:
+                values[index] = value
+        for name, values in self._ints.items():
+            value = song.get(name)
+            if value is not None:
+                values[index] = value
+        for offset, genre in enumerate(genres):
+            self._genre_codes[start + offset] = self.genre_id(genre)
+        self._genre_offsets[index + 1] = start + len(genres)
+        self._size += 1
+
+    def column(self, name):
+        """
+        Return a whole field.
+
+        Numeric fields are returned as views of the store's arrays, with NaN or -1
+        where a value is missing; text fields as lists.
+        """
+        if name in self._floats:
+            return self._floats[name][:self._size]
+        if name in self._ints:
+            return self._ints[name][:self._size]
+        if name in self._text:
+            return self._text[name]
+        raise KeyError(name)
+
+    def genre_codes(self):
+        """Return the genre codes of all tracks, in track order, as a view of the store's array."""
+        return self._genre_codes[self._genre_offsets[0]:self._genre_offsets[self._size]]
+
+    def genres(self, index):
+        """Return the genre names of one track."""
+        start, stop = self._genre_offsets[index], self._genre_offsets[index + 1]
+        return [self.genre_names[code] for code in self._genre_codes[start:stop]]
+
+    def value(self, index, name):
+        """Return one field of one track as a Python value, raising KeyError if it is missing."""
+        if name in self._text:
+            return self._text[name][index]
+        if name in self._floats:
+            value = float(self._floats[name][index])
+            if value != value:  # NaN
+                raise KeyError(name)
+            return value
+        if name in self._ints:
+            value = int(self._ints[name][index])
+            if value == -1:
+                raise KeyError(name)
+            return value
+        if name == 'genre':
+            return self.genres(index)
+        raise KeyError(name)
+
+
+#playlist snapshot
+class PlaylistSnapshot:
+    """
+    The tracks of a playlist, fetched once per run with their genres and audio features merged in.
+
+    Every generation and the scoring step read from the snapshot instead of
+    going back to the API for the same playlist. The tracks are held in a
+    TrackStore; song dictionaries passed in are converted to one.
+    """
+
+    def __init__(self, playlist_id, songs):
+        self.playlist_id = playlist_id
+        self.songs = songs if isinstance(songs, TrackStore) else TrackStore.from_songs(songs)
+        self.fetched_at = time.time()
+
+    @property
+    def track_ids(self):
+        return self.songs.column('id')
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs)
 
-    return songs
 
 #calculate difference
 def calculate_difference(song, generated_song):
@@ -171,33 +1841,600 @@ def calculate_difference(song, generated_song):
     return total_diff
 
 
+
+#scoring engine
+# Continuous audio features the scoring engine can compare
+SCORING_FEATURES = ['tempo', 'energy', 'danceability', 'valence', 'loudness']
+# Weight of each feature when none are given; 'key', 'mode' and 'time_signature' can be weighted as well
+DEFAULT_SCORING_WEIGHTS = {'tempo': 1.0, 'energy': 1.0}
+SCORING_CHUNK_SIZE = 256  # Generated songs scored per block, bounding memory to chunk x tracks
+
+
+class ScoringEngine:
+    """
+    Vectorized nearest-neighbour scoring of generated songs against a playlist.
+
+    The playlist's continuous audio features are held as a z-score normalized
+    matrix, so weights compare features on the same scale. Keys are compared
+    by their distance around the circle of fifths, and modes and time
+    signatures by whether they match. Features missing from a generated song
+    do not contribute to its distances.
+    """
+
+    def __init__(self, songs):
+        if isinstance(songs, PlaylistSnapshot):
+            songs = songs.songs
+        # The playlist is read column by column from its TrackStore
+        self.songs = songs if isinstance(songs, TrackStore) else TrackStore.from_songs(songs)
+        matrix = np.empty((len(self.songs), len(SCORING_FEATURES)))
+        for column, name in enumerate(SCORING_FEATURES):
+            matrix[:, column] = self.songs.column(name) if name in TRACK_FLOAT_FIELDS else np.nan
+        # NaN-aware mean and standard deviation; columns absent from every song keep mean 0 and scale 1
+        present = ~np.isnan(matrix)
+        counts = np.maximum(present.sum(axis=0), 1)
+        self.mean = np.where(present, matrix, 0.0).sum(axis=0) / counts
+        centered = np.where(present, matrix - self.mean, 0.0)
+        self.scale = np.sqrt((centered ** 2).sum(axis=0) / counts)
+        self.scale[self.scale == 0] = 1.0
+        self.matrix = (matrix - self.mean) / self.scale
+        keys = self.songs.column('key').astype(int)
+        self.fifths = (np.where(keys < 0, 0, keys) * 7) % 12
+        self.modes = self.songs.column('mode').astype(int)
+        self.time_signatures = self.songs.column('time_signature').astype(int)
+
+    def score(self, generated_songs, weights=None):
+        """
+        Compute the weighted distance between every generated song and every playlist track.
+
+        Args:
+            generated_songs (list): Dictionaries of target parameters, e.g. tempo and energy.
+            weights (dict): Weight per feature name, defaults to DEFAULT_SCORING_WEIGHTS.
+
+        Returns:
+            numpy.ndarray: A (generated songs x tracks) matrix of distances.
+        """
+        weights = DEFAULT_SCORING_WEIGHTS if weights is None else weights
+        distances = np.zeros((len(generated_songs), len(self.songs)))
+        for column, name in enumerate(SCORING_FEATURES):
+            weight = weights.get(name)
+            if not weight:
+                continue
+            targets = np.array([song.get(name, np.nan) for song in generated_songs], dtype=float)
+            targets = (targets - self.mean[column]) / self.scale[column]
+            diff = np.abs(targets[:, None] - self.matrix[None, :, column])
+            distances += weight * np.nan_to_num(diff)
+
+        if weights.get('key'):
+            targets = np.array([(song.get('key', 0) * 7) % 12 for song in generated_songs])
+            steps = np.abs(targets[:, None] - self.fifths[None, :])
+            has_key = np.array(['key' in song for song in generated_songs])
+            distances += weights['key'] * has_key[:, None] * np.minimum(steps, 12 - steps) / 6
+        for name, values in (('mode', self.modes), ('time_signature', self.time_signatures)):
+            if weights.get(name):
+                targets = np.array([song.get(name, np.nan) for song in generated_songs], dtype=float)
+                mismatch = (targets[:, None] != values[None, :]) & ~np.isnan(targets)[:, None]
+                distances += weights[name] * mismatch
+        return distances
+
+    @instrumentation.stage('scoring')
+    def top_k(self, generated_songs, k=3, weights=None):
+        """
+        Find the k closest playlist tracks for each generated song.
+
+        Args:
+            generated_songs (list): Dictionaries of target parameters.
+            k (int): Number of matches per generated song.
+            weights (dict): Weight per feature name, defaults to DEFAULT_SCORING_WEIGHTS.
+
+        Returns:
+            tuple: (indices, distances) arrays of shape (generated songs x k), closest first.
+                Indices refer to the engine's `songs`.
+        """
+        k = min(k, len(self.songs))
+        indices = np.empty((len(generated_songs), k), dtype=int)
+        distances = np.empty((len(generated_songs), k))
+        if k == 0:
+            return indices, distances
+        for start in range(0, len(generated_songs), SCORING_CHUNK_SIZE):
+            chunk = self.score(generated_songs[start:start + SCORING_CHUNK_SIZE], weights)
+            nearest = np.argpartition(chunk, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(chunk, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1)
+            indices[start:start + len(chunk)] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:start + len(chunk)] = np.take_along_axis(nearest_distances, order, axis=1)
+        return indices, distances
+
+
+#drum references
+YOUTUBE_SEARCH_URL = os.environ.get('YOUTUBE_SEARCH_URL', 'https://www.youtube.com/results')
+DRUM_CACHE_DIR = os.environ.get('DRUM_CACHE_DIR', '.drum_cache')
+DRUM_DOWNLOAD_WORKERS = int(os.environ.get('DRUM_DOWNLOAD_WORKERS', 4))  # Downloads in flight at once
+DRUM_DOWNLOAD_ATTEMPTS = 3  # Attempts per download; each resumes from the bytes already on disk
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = 30  # Seconds without data before a download attempt fails
+# Video IDs in search result pages, as watch links or in the embedded initial data
+VIDEO_ID_PATTERN = re.compile(r'(?:/watch\?v=|"videoId":")([A-Za-z0-9_-]{11})')
+
+
+def resolve_youtube_stream(video_id):
+    """
+    Find the audio-only stream of a YouTube video.
+
+    Returns:
+        tuple: (stream URL, file extension such as '.webm').
+    """
+    stream = pytube.YouTube(f'https://www.youtube.com/watch?v={video_id}').streams.get_audio_only()
+    return stream.url, f'.{stream.subtype}'
+
+
+class DrumDownloader:
+    """
+    Concurrent downloader of drum reference audio with a content-addressed cache.
+
+    Queries are resolved to YouTube video IDs and fetched on a bounded thread
+    pool. A video is only downloaded once, even when several songs resolve to
+    it at the same time. Downloads stream to a partial file in chunks, and an
+    interrupted download resumes with an HTTP Range request. Finished files
+    are stored under the SHA-256 of their content, and a small file per video
+    ID points at them, so identical audio is stored once:
+
+        <cache_dir>/objects/<sha256[:2]>/<sha256><ext>
+        <cache_dir>/videos/<video ID>
+        <cache_dir>/partial/<video ID>.part
+    """
+
+    def __init__(self, cache_dir=DRUM_CACHE_DIR, workers=DRUM_DOWNLOAD_WORKERS, search_url=YOUTUBE_SEARCH_URL,
+                 resolve_stream=resolve_youtube_stream, session=None):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.search_url = search_url
+        self.resolve_stream = resolve_stream
+        self.session = session or requests.Session()
+        self._lock = threading.Lock()
+        self._video_ids = {}  # Query -> video ID, or None when the search found nothing
+        self._downloads = {}  # Video ID -> Future of its path, shared by every caller that wants it
+
+    def _path(self, *parts):
+        return os.path.join(self.cache_dir, *parts)
+
+    def search(self, query):
+        """Return the ID of the first video a YouTube search finds, or None."""
+        with self._lock:
+            if query in self._video_ids:
+                return self._video_ids[query]
+        with instrumentation.call('youtube') as outcome:
+            response = self.session.get(self.search_url, params={'search_query': query}, timeout=DOWNLOAD_TIMEOUT)
+            outcome.update(status=response.status_code, bytes=len(response.content))
+        response.raise_for_status()
+        match = VIDEO_ID_PATTERN.search(response.text)
+        video_id = match.group(1) if match else None
+        with self._lock:
+            self._video_ids[query] = video_id
+        return video_id
+
+    def cached_path(self, video_id):
+        """Return the cached file of a video, or None if it has not been downloaded."""
+        try:
+            with open(self._path('videos', video_id), encoding='utf-8') as f:
+                path = self._path(f.read().strip())
+        except FileNotFoundError:
+            return None
+        return path if os.path.exists(path) else None
+
+    def fetch(self, video_id):
+        """
+        Download a video's audio unless it is cached.
+
+        Concurrent calls for the same video wait for one download.
+
+        Returns:
+            str: Path of the audio file.
+        """
+        with self._lock:
+            future = self._downloads.get(video_id)
+            owner = future is None
+            if owner:
+                future = self._downloads[video_id] = Future()
+        if owner:
+            try:
+                future.set_result(self.cached_path(video_id) or self._download(video_id))
+            except Exception as e:
+                future.set_exception(e)
+                with self._lock:
+                    del self._downloads[video_id]  # Let a later call try again
+        return future.result()
+
+    def _download(self, video_id):
+        url, extension = self.resolve_stream(video_id)
+        os.makedirs(self._path('partial'), exist_ok=True)
+        partial = self._path('partial', f'{video_id}.part')
+        for attempt in range(DRUM_DOWNLOAD_ATTEMPTS):
+            try:
+                digest = self._stream_to(url, partial)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if attempt + 1 == DRUM_DOWNLOAD_ATTEMPTS:
+                    raise
+        name = os.path.join('objects', digest[:2], digest + extension)
+        os.makedirs(os.path.dirname(self._path(name)), exist_ok=True)
+        if os.path.exists(self._path(name)):
+            os.remove(partial)  # The same audio is already stored under another video ID
+        else:
+            os.replace(partial, self._path(name))
+        os.makedirs(self._path('videos'), exist_ok=True)
+        reference = self._path('videos', f'{video_id}.tmp')
+        with open(reference, 'w', encoding='utf-8') as f:
+            f.write(name)
+        os.replace(reference, self._path('videos', video_id))
+        return self._path(name)
+
+    def _stream_to(self, url, partial):
+        """Download url into partial, resuming from its current size, and return the content's SHA-256."""
+        digest = hashlib.sha256()
+        offset = 0
+        if os.path.exists(partial):
+            with open(partial, 'rb') as f:
+                for chunk in iter(functools.partial(f.read, DOWNLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    offset += len(chunk)
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with instrumentation.call('youtube-download') as outcome:
+            with self.session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                outcome['status'] = response.status_code
+                if response.status_code == 416:
+                    return digest.hexdigest()  # The partial file already holds everything
+                response.raise_for_status()
+                resumed = response.status_code == 206 and response.headers.get('Content-Range', '').startswith(f'bytes {offset}-')
+                if not resumed:
+                    digest = hashlib.sha256()  # The server sent the whole file; start over
+                received = 0
+                with open(partial, 'ab' if resumed else 'wb') as f:
+                    try:
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            received += len(chunk)
+                    finally:
+                        outcome['bytes'] = received
+        return digest.hexdigest()
+
+    def fetch_query(self, query):
+        """Search for a query and download the first result; returns its path, or None if nothing was found."""
+        video_id = self.search(query)
+        return self.fetch(video_id) if video_id else None
+
+    @instrumentation.stage('drum_audio')
+    def download_all(self, queries):
+        """
+        Resolve and download the references of many queries in parallel.
+
+        Args:
+            queries (list): Search queries, e.g. one per generated song.
+
+        Returns:
+            dict: Path of the audio file per query, or None where nothing was found or the download failed.
+        """
+        unique = list(dict.fromkeys(queries))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {query: executor.submit(self.fetch_query, query) for query in unique}
+        paths = {}
+        for query, future in futures.items():
+            try:
+                paths[query] = future.result()
+            except Exception as e:
+                print(f"Could not download a drum reference for '{query}': {e}")
+                paths[query] = None
+        return paths
+
+
+def drum_query(song):
+    """Build the search query for a generated song's drum reference."""
+    genre = f"{song['genre']} " if song.get('genre') else ''
+    return f"{genre}drum loop {round(song['tempo'])} bpm {song['time_signature']}/4"
+
+
+@LazySingleton
+def get_drum_downloader():
+    """Return the process-wide DrumDownloader, creating it on first use."""
+    return DrumDownloader()
+
+
 def get_drum_audio(query):
-    
-    
-    base_url = "https://www.youtube.com/results?search_query="
-    search_url = base_url + query.replace(" ", "+")
-    
-    response = requests.get(search_url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    # Find all video links from the search results
-    videos = soup.find_all("a", href=True, class_="yt-uix-tile-link")
-    
-    # Return the first video URL
-    if videos:
-        video_url = "https://www.youtube.com" + videos[0]["href"]
-        yt = YouTube(video_url)
+    """
+    Download the audio of the first YouTube result for a query into the drum cache.
+
+    Returns:
+        str: Path of the audio file, or None if the search found nothing.
+    """
+    return get_drum_downloader().fetch_query(query)
+
+
+#drum analysis
+DRUM_ANALYSIS_DIR = os.environ.get('DRUM_ANALYSIS_DIR', os.path.join(DRUM_CACHE_DIR, 'analysis'))
+ANALYSIS_VERSION = 1  # Bump to invalidate cached analyses when the algorithm changes
+ANALYSIS_SAMPLE_RATE = 22050  # Compressed audio is decoded to mono 16-bit PCM at this rate
+ONSET_FRAME_SIZE = 1024  # Samples per analysis frame
+ONSET_HOP = 512  # Samples between frames
+ANALYSIS_BLOCK_FRAMES = 256  # Frames read from the memory map and transformed at once
+MIN_BPM = 60
+MAX_BPM = 200
+TEMPO_PRIOR_BPM = 120  # Tempo estimates are biased towards this, in octaves, to settle half/double ambiguity
+TEMPO_PRIOR_WIDTH = 1.0
+OCTAVE_ERROR_PENALTY = 0.25  # Ranking cost of a reference at half or double the target tempo
+METER_MISMATCH_PENALTY = 0.5  # Ranking cost of a reference in another time signature
+CONTENT_HASH_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def _wav_layout(path):
+    """
+    Locate the samples of a 16-bit PCM WAV file.
+
+    Returns:
+        tuple: (data offset, data size, channels, sample rate), or None if the file is not 16-bit PCM WAV.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            return None
+        audio_format = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+            if chunk_id == b'fmt ':
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', f.read(16))
+                f.seek(chunk_size - 16 + chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                if audio_format != 1 or bits != 16:
+                    return None
+                return f.tell(), chunk_size, channels, sample_rate
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+
+
+def decoded_pcm(path):
+    """
+    Memory-map the decoded samples of an audio file.
+
+    16-bit PCM WAV files are mapped in place. Anything else is decoded once with
+    ffmpeg to mono PCM next to the file, and that copy is mapped.
+
+    Returns:
+        tuple: (samples, sample rate), where samples is a read-only (frames x channels)
+            int16 memory map, so only the parts being read are loaded.
+    """
+    layout = _wav_layout(path)
+    if layout is not None:
+        offset, size, channels, sample_rate = layout
+        size = min(size, os.path.getsize(path) - offset)
+        shape = (size // (2 * channels), channels)
+    else:
+        pcm_path = os.path.splitext(path)[0] + '.pcm'
+        if not os.path.exists(pcm_path):
+            ffmpeg = shutil.which('ffmpeg')
+            if ffmpeg is None:
+                raise RuntimeError(f"ffmpeg is needed to decode {path}")
+            partial = pcm_path + '.part'
+            subprocess.run(
+                [ffmpeg, '-v', 'error', '-y', '-i', path, '-f', 's16le', '-ac', '1', '-ar', str(ANALYSIS_SAMPLE_RATE), partial],
+                check=True,
+            )
+            os.replace(partial, pcm_path)
+        path, offset, sample_rate = pcm_path, 0, ANALYSIS_SAMPLE_RATE
+        shape = (os.path.getsize(pcm_path) // 2, 1)
+    if shape[0] == 0:
+        return np.zeros((0, shape[1]), dtype='<i2'), sample_rate
+    return np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=shape), sample_rate
+
+
+def onset_envelope(samples):
+    """
+    Compute the spectral-flux onset envelope of PCM samples, one value per hop.
+
+    Frames are transformed ANALYSIS_BLOCK_FRAMES at a time, so memory use does
+    not depend on the length of the audio.
+
+    Args:
+        samples (numpy.ndarray): (frames x channels) int16 samples, e.g. from decoded_pcm().
+
+    Returns:
+        numpy.ndarray: The onset strength of every frame.
+    """
+    n_frames = 1 + (len(samples) - ONSET_FRAME_SIZE) // ONSET_HOP if len(samples) >= ONSET_FRAME_SIZE else 0
+    envelope = np.zeros(n_frames)
+    window = np.hanning(ONSET_FRAME_SIZE).astype(np.float32)
+    previous = None
+    for first in range(0, n_frames, ANALYSIS_BLOCK_FRAMES):
+        last = min(n_frames, first + ANALYSIS_BLOCK_FRAMES)
+        block = samples[first * ONSET_HOP:(last - 1) * ONSET_HOP + ONSET_FRAME_SIZE]
+        mono = block.mean(axis=1, dtype=np.float32) / 32768
+        frames = np.lib.stride_tricks.sliding_window_view(mono, ONSET_FRAME_SIZE)[::ONSET_HOP]
+        spectrum = np.log1p(100 * np.abs(np.fft.rfft(frames * window, axis=1)))
+        if previous is None:
+            previous = spectrum[0]
+        flux = np.diff(spectrum, axis=0, prepend=previous[None, :])
+        envelope[first:last] = np.maximum(flux, 0).sum(axis=1)
+        previous = spectrum[-1]
+    return envelope
+
+
+def estimate_tempo(envelope, frame_rate):
+    """
+    Estimate the tempo and meter of an onset envelope from its autocorrelation.
+
+    Args:
+        envelope (numpy.ndarray): Onset strengths, see onset_envelope().
+        frame_rate (float): Envelope values per second.
+
+    Returns:
+        tuple: (tempo in BPM, time signature 3 or 4), or (None, None) if no beat was found.
+    """
+    centered = envelope - envelope.mean() if len(envelope) else envelope
+    min_lag = max(1, int(frame_rate * 60 / MAX_BPM))
+    max_lag = int(frame_rate * 60 / MIN_BPM) + 1
+    if len(envelope) <= max_lag or not centered.any():
+        return None, None
+    size = 1 << (2 * len(envelope) - 1).bit_length()
+    spectrum = np.fft.rfft(centered, size)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(envelope)]
+    lags = np.arange(min_lag, max_lag + 1)
+    prior = np.exp(-0.5 * (np.log2(60 * frame_rate / lags / TEMPO_PRIOR_BPM) / TEMPO_PRIOR_WIDTH) ** 2)
+    best = int(lags[np.argmax(autocorrelation[lags] * prior)])
+    # The peak at a multiple of the beat pins the beat length down more precisely
+    multiple = next((m for m in (8, 4, 2, 1) if (m + 1) * best < len(autocorrelation)), 1)
+    low, high = multiple * best - multiple, multiple * best + multiple + 1
+    peak = low + int(np.argmax(autocorrelation[low:high]))
+    # Parabolic interpolation refines the peak to a fraction of a frame
+    before, center, after = autocorrelation[peak - 1:peak + 2]
+    curvature = before - 2 * center + after
+    lag = (peak + (0.5 * (before - after) / curvature if curvature < 0 else 0.0)) / multiple
+    return 60 * frame_rate / lag, estimate_meter(envelope, lag)
+
+
+def estimate_meter(envelope, lag):
+    """
+    Choose 3 or 4 beats per bar from the accent pattern of the beats.
+
+    The onset strength is read at every beat, and the beats are grouped in bars
+    of 3 and of 4; the grouping in which one bar position stands out most is
+    taken to put the accented downbeats together.
+    """
+    # Strongest onset within two frames of each position, so rounding the beat grid does not miss onsets
+    peaks = np.max([np.roll(envelope, shift) for shift in range(-2, 3)], axis=0)
+    offsets = np.arange(0, len(envelope) - 2, lag)
+    # The beat phase that collects the most onset strength
+    phase = max(range(int(lag)), key=lambda start: peaks[np.round(start + offsets).astype(int).clip(0, len(peaks) - 1)].sum())
+    positions = np.round(phase + offsets).astype(int)
+    strengths = peaks[positions[positions < len(peaks)]]
+    contrast = {}
+    for beats in (3, 4):
+        bars = len(strengths) // beats
+        if bars < 2:
+            continue
+        means = strengths[:bars * beats].reshape(bars, beats).mean(axis=0)
+        spread = means.max() - means.min()
+        contrast[beats] = spread / (means.mean() or 1)
+    return 3 if contrast.get(3, 0) > contrast.get(4, 0) else 4
+
+
+def tempo_distance(reference_tempo, target_tempo):
+    """Distance in octaves between two tempos; half and double tempo count as close, with a penalty."""
+    return min(
+        abs(math.log2(reference_tempo * factor / target_tempo)) + (OCTAVE_ERROR_PENALTY if factor != 1 else 0)
+        for factor in (0.5, 1, 2)
+    )
+
+
+class DrumAnalyzer:
+    """
+    Tempo and meter analysis of downloaded drum references, cached per file.
+
+    Results are keyed by the SHA-256 of the file's content, which files in the
+    DrumDownloader cache carry in their names, and stored as small JSON files,
+    so each file is analyzed once. Files are analyzed in parallel; NumPy's
+    transforms release the GIL.
+    """
+
+    def __init__(self, cache_dir=DRUM_ANALYSIS_DIR, workers=DRUM_DOWNLOAD_WORKERS):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if CONTENT_HASH_PATTERN.fullmatch(name):
+            return name
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(functools.partial(f.read, DOWNLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def analyze(self, path):
+        """
+        Analyze one audio file.
+
+        Returns:
+            dict: 'tempo' (BPM or None), 'time_signature' (3, 4 or None) and 'duration' in seconds.
+        """
+        key = self.content_hash(path)
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        cache_path = os.path.join(self.cache_dir, f'{key}.json')
         try:
-            stream_audio = yt.streams.get_audio_only()
-            stream_audio.download(filename= '{video_title}.wav')        
-        except Exception as e:
-            print(f"An error occurred: {e}")
+            with open(cache_path, encoding='utf-8') as f:
+                result = json.load(f)
+            if result.get('version') != ANALYSIS_VERSION:
+                result = None
+        except (FileNotFoundError, ValueError):
+            result = None
+        if result is None:
+            samples, sample_rate = decoded_pcm(path)
+            tempo, time_signature = estimate_tempo(onset_envelope(samples), sample_rate / ONSET_HOP)
+            result = {
+                'version': ANALYSIS_VERSION,
+                'tempo': tempo,
+                'time_signature': time_signature,
+                'duration': len(samples) / sample_rate,
+            }
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(cache_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(result, f)
+            os.replace(cache_path + '.tmp', cache_path)
+        with self._lock:
+            self._results[key] = result
+        return result
+
+    @instrumentation.stage('drum_analysis')
+    def analyze_all(self, paths):
+        """
+        Analyze many files in parallel.
+
+        Returns:
+            dict: The analysis of every path, or None where it failed.
+        """
+        unique = list(dict.fromkeys(paths))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {path: executor.submit(self.analyze, path) for path in unique}
+        analyses = {}
+        for path, future in futures.items():
+            try:
+                analyses[path] = future.result()
+            except Exception as e:
+                print(f"Could not analyze {path}: {e}")
+                analyses[path] = None
+        return analyses
+
+
+def rank_drum_references(analyses, target_tempo, target_time_signature):
+    """
+    Rank analyzed drum references for a song, without any API calls.
 
-            
-    
-    return None
+    Args:
+        analyses (dict): Analysis per path, see DrumAnalyzer.analyze_all().
+        target_tempo (float): The song's tempo.
+        target_time_signature (int): The song's time signature.
+
+    Returns:
+        list: (path, analysis) pairs with a tempo estimate, best match first.
+    """
+    def cost(item):
+        analysis = item[1]
+        meter_cost = METER_MISMATCH_PENALTY if analysis['time_signature'] != target_time_signature else 0
+        return tempo_distance(analysis['tempo'], target_tempo) + meter_cost
+
+    return sorted(((path, analysis) for path, analysis in analyses.items() if analysis and analysis['tempo']), key=cost)
 
 
+@LazySingleton
+def get_drum_analyzer():
+    """Return the process-wide DrumAnalyzer, creating it on first use."""
+    return DrumAnalyzer()
 
 
 #dictionaries
@@ -289,479 +2526,1362 @@ minor_weights = [
 ]
 
 
-CHORD_DICT = {
-    'Ab': {
-        'I': [68, 72, 75],
-        'ii': [70, 73, 77],
-        'iii': [72, 75, 79],
-        'IV': [73, 77, 80],
-        'V': [75, 79, 82],
-        'vi': [77, 80, 84],
-        'vii°': [79, 82, 85],
-        'ii7': [70, 73, 77, 80],
-        'V7': [75, 79, 82, 85],
-        'I7': [68, 72, 75, 78],
-        'bVII': [67, 70, 73],
-        'bIII': [71, 75, 78],
-        'bVI': [65, 68, 72],
-        'i': [68, 71, 75],
-        'iv': [73, 76, 80],
-        'v': [75, 78, 82],
-        'VII': [77, 80, 83],
-        'VI': [76, 80, 83],
-        'III': [72, 75, 79]
-    },
-
-        'A': {
-        'I': [69, 73, 76],
-        'ii': [71, 74, 78],
-        'iii': [73, 76, 80],
-        'IV': [74, 78, 81],
-        'V': [76, 80, 83],
-        'vi': [78, 81, 85],
-        'vii°': [80, 83, 86],
-        'ii7': [71, 74, 78, 81],
-        'V7': [76, 80, 83, 86],
-        'I7': [69, 73, 76, 79],
-        'bVII': [68, 71, 74],
-        'bIII': [72, 76, 79],
-        'bVI': [66, 69, 73],
-        'i': [69, 72, 76],
-        'iv': [74, 77, 81],
-        'v': [76, 79, 83],
-        'VII': [78, 81, 84],
-        'VI': [77, 81, 84],
-        'III': [73, 76, 80]
-    },
-    'Bb': {
-        'I': [70, 74, 77],
-        'ii': [72, 75, 79],
-        'iii': [74, 77, 81],
-        'IV': [75, 79, 82],
-        'V': [77, 81, 84],
-        'vi': [79, 82, 86],
-        'vii°': [81, 84, 87],
-        'ii7': [72, 75, 79, 82],
-        'V7': [77, 81, 84, 87],
-        'I7': [70, 74, 77, 80],
-        'bVII': [69, 72, 75],
-        'bIII': [73, 77, 80],
-        'bVI': [67, 70, 74],
-        'i': [70, 73, 77],
-        'iv': [75, 78, 82],
-        'v': [77, 80, 84],
-        'VII': [79, 82, 85],
-        'VI': [78, 82, 85],
-        'III': [74, 77, 81]
-    },
-
-    'B': {
-        'I': [71, 75, 78],
-        'ii': [73, 76, 80],
-        'iii': [75, 78, 82],
-        'IV': [76, 80, 83],
-        'V': [78, 82, 85],
-        'vi': [80, 83, 87],
-        'vii°': [82, 85, 88],
-        'ii7': [73, 76, 80, 83],
-        'V7': [78, 82, 85, 88],
-        'I7': [71, 75, 78, 81],
-        'bVII': [70, 73, 76],
-        'bIII': [74, 78, 81],
-        'bVI': [68, 71, 75],
-        'i': [71, 74, 78],
-        'iv': [76, 79, 83],
-        'v': [78, 81, 85],
-        'VII': [80, 83, 86],
-        'VI': [79, 83, 86],
-        'III': [75, 78, 82]
-    },
-
-    'C': {
-        'I': [60, 64, 67],
-        'ii': [62, 65, 69],
-        'iii': [64, 67, 71],
-        'IV': [65, 69, 72],
-        'V': [67, 71, 74],
-        'vi': [69, 72, 76],
-        'vii°': [71, 74, 77],
-        'ii7': [62, 65, 69, 72],
-        'V7': [67, 71, 74, 77],
-        'I7': [60, 64, 67, 70],
-        'bVII': [59, 62, 65],
-        'bIII': [63, 67, 70],
-        'bVI': [57, 60, 64],
-        'i': [60, 63, 67],
-        'iv': [65, 68, 72],
-        'v': [67, 70, 74],
-        'VII': [69, 72, 75],
-        'VI': [68, 72, 75],
-        'III': [64, 67, 71]
-    },
-
-    'C#': {
-            'I': [61, 65, 68],
-            'ii': [63, 66, 70],
-            'iii': [65, 68, 72],
-            'IV': [66, 70, 73],
-            'V': [68, 72, 75],
-            'vi': [70, 73, 77],
-            'vii°': [72, 75, 78],
-            'ii7': [63, 66, 70, 73],
-            'V7': [68, 72, 75, 78],
-            'I7': [61, 65, 68, 71],
-            'bVII': [60, 63, 66],
-            'bIII': [64, 68, 71],
-            'bVI': [58, 61, 65],
-            'i': [61, 64, 68],
-            'iv': [66, 69, 73],
-            'v': [68, 71, 75],
-            'VII': [70, 73, 76],
-            'VI': [69, 73, 76],
-            'III': [65, 68, 72]
-        },
-    'D': {
-        'I': [62, 66, 69],
-        'ii': [64, 67, 71],
-        'iii': [66, 69, 73],
-        'IV': [67, 71, 74],
-        'V': [69, 73, 76],
-        'vi': [71, 74, 78],
-        'vii°': [73, 76, 79],
-        'ii7': [64, 67, 71, 74],
-        'V7': [69, 73, 76, 79],
-        'I7': [62, 66, 69, 72],
-        'bVII': [61, 64, 67],
-        'bIII': [65, 69, 72],
-        'bVI': [59, 62, 66],
-        'i': [62, 65, 69],
-        'iv': [67, 70, 74],
-        'v': [69, 72, 76],
-        'VII': [71, 74, 77],
-        'VI': [70, 74, 77],
-        'III': [66, 69, 73]
-    },
-    'Eb': {
-        'I': [63, 67, 70],
-        'ii': [65, 68, 72],
-        'iii': [67, 70, 74],
-        'IV': [68, 72, 75],
-        'V': [70, 74, 77],
-        'vi': [72, 75, 79],
-        'vii°': [74, 77, 80],
-        'ii7': [65, 68, 72, 75],
-        'V7': [70, 74, 77, 80],
-        'I7': [63, 67, 70, 73],
-        'bVII': [62, 65, 68],
-        'bIII': [66, 70, 73],
-        'bVI': [60, 63, 67],
-        'i': [63, 66, 70],
-        'iv': [68, 71, 75],
-        'v': [70, 73, 77],
-        'VII': [72, 75, 78],
-        'VI': [71, 75, 78],
-        'III': [67, 70, 74]
-    },
-    'E': {
-        'I': [64, 68, 71],
-        'ii': [66, 69, 73],
-        'iii': [68, 71, 75],
-        'IV': [69, 73, 76],
-        'V': [71, 75, 78],
-        'vi': [73, 76, 80],
-        'vii°': [75, 78, 81],
-        'ii7': [66, 69, 73, 76],
-        'V7': [71, 75, 78, 81],
-        'I7': [64, 68, 71, 74],
-        'bVII': [63, 66, 69],
-        'bIII': [67, 71, 74],
-        'bVI': [61, 64, 68],
-        'i': [64, 67, 71],
-        'iv': [69, 72, 76],
-        'v': [71, 74, 78],
-        'VII': [73, 76, 79],
-        'VI': [72, 76, 79],
-        'III': [68, 71, 75]
-    },    
-    'F': {
-        'I': [65, 69, 72],
-        'ii': [67, 70, 74],
-        'iii': [69, 72, 76],
-        'IV': [70, 74, 77],
-        'V': [72, 76, 79],
-        'vi': [74, 77, 81],
-        'vii°': [76, 79, 82],
-        'ii7': [67, 70, 74, 77],
-        'V7': [72, 76, 79, 82],
-        'I7': [65, 69, 72, 75],
-        'bVII': [64, 67, 70],
-        'bIII': [68, 72, 75],
-        'bVI': [62, 65, 69],
-        'i': [65, 68, 72],
-        'iv': [70, 73, 77],
-        'v': [72, 75, 79],
-        'VII': [75, 79, 82],
-        'VI': [73, 77, 80],
-        'III': [69, 72, 76]
-    },    
-
-    'F#': {
-        'I': [66, 70, 73],
-        'ii': [68, 71, 75],
-        'iii': [70, 73, 77],
-        'IV': [71, 75, 78],
-        'V': [73, 77, 80],
-        'vi': [75, 78, 82],
-        'vii°': [77, 80, 83],
-        'ii7': [68, 71, 75, 78],
-        'V7': [73, 77, 80, 83],
-        'I7': [66, 70, 73, 76],
-        'bVII': [65, 68, 71],
-        'bIII': [69, 73, 76],
-        'bVI': [63, 66, 70],
-        'i': [66, 69, 73],
-        'iv': [71, 74, 78],
-        'v': [73, 76, 80],
-        'VII': [75, 78, 81],
-        'VI': [74, 78, 81],
-        'III': [70, 73, 77]
-    },
-    
-    'G': {
-        'I': [67, 71, 74],
-        'ii': [69, 72, 76],
-        'iii': [71, 74, 78],
-        'IV': [72, 76, 79],
-        'V': [74, 78, 81],
-        'vi': [76, 79, 83],
-        'vii°': [78, 81, 84],
-        'ii7': [69, 72, 76, 79],
-        'V7': [74, 78, 81, 84],
-        'I7': [67, 71, 74, 77],
-        'bVII': [66, 69, 72],
-        'bIII': [70, 74, 77],
-        'bVI': [64, 67, 71],
-        'i': [67, 70, 74],
-        'iv': [72, 75, 79],
-        'v': [74, 77, 81],
-        'VII': [76, 79, 82],
-        'VI': [75, 79, 82],
-        'III': [71, 74, 78]
-    }
+#chord engine
+# Pitch class of every key in standard notation
+KEY_PITCH_CLASSES = {
+    'C': 0, 'C#': 1, 'D': 2, 'Eb': 3, 'E': 4, 'F': 5,
+    'F#': 6, 'G': 7, 'Ab': 8, 'A': 9, 'Bb': 10, 'B': 11,
+}
 
+MODES = ('Major', 'Minor')
 
+# Semitones above the tonic of each scale degree
+MODE_SCALES = {
+    'Major': (0, 2, 4, 5, 7, 9, 11),
+    'Minor': (0, 2, 3, 5, 7, 8, 10),  # Natural minor
+}
 
-    # Add other keys as needed
+ROMAN_NUMERALS = ('I', 'II', 'III', 'IV', 'V', 'VI', 'VII')
+
+# Semitones above the chord root
+CHORD_INTERVALS = {
+    'major': (0, 4, 7),
+    'minor': (0, 3, 7),
+    'diminished': (0, 3, 6),
+    'augmented': (0, 4, 8),
+    'dominant7': (0, 4, 7, 10),
+    'major7': (0, 4, 7, 11),
+    'minor7': (0, 3, 7, 10),
+    'half-diminished7': (0, 3, 6, 10),
+    'diminished7': (0, 3, 6, 9),
 }
 
+# Suffixes each numeral case accepts, and the chord quality they produce
+UPPER_SUFFIXES = {'': 'major', '+': 'augmented', '7': 'dominant7', 'maj7': 'major7'}
+LOWER_SUFFIXES = {'': 'minor', '7': 'minor7', '°': 'diminished', '°7': 'diminished7', 'ø7': 'half-diminished7'}
 
+# Other spellings of the diminished and half-diminished signs
+NUMERAL_ALIASES = {'˚': '°', 'o': '°', 'ø': 'ø7'}
+
+TONIC_NOTE = 60  # Chords are built upward from the tonic in the octave of middle C
+
+VOICINGS = ('close', 'open')
+
+
+def _chord_offsets(numeral, mode):
+    """Derive the semitone offsets from the tonic of a (normalized) numeral's chord tones."""
+    accidental = numeral[0] if numeral[0] in 'b#' else ''
+    rest = numeral[len(accidental):]
+    roman = rest.rstrip('°ø7+maj')
+    suffix = rest[len(roman):]
+    degree = ROMAN_NUMERALS.index(roman.upper())
+    quality = (UPPER_SUFFIXES if roman.isupper() else LOWER_SUFFIXES)[suffix]
+    # Accidentals are relative to the major scale (bVII is a whole step below the tonic in either mode)
+    if accidental == 'b':
+        root = MODE_SCALES['Major'][degree] - 1
+    elif accidental == '#':
+        root = MODE_SCALES['Major'][degree] + 1
+    else:
+        root = MODE_SCALES[mode][degree]
+    return tuple(root + interval for interval in CHORD_INTERVALS[quality])
+
+
+def _build_chord_table():
+    """Precompute the notes of every supported numeral in every key and mode."""
+    numerals = []
+    for accidental in ('', 'b', '#'):
+        for roman in ROMAN_NUMERALS:
+            numerals.extend(accidental + roman + suffix for suffix in UPPER_SUFFIXES)
+            numerals.extend(accidental + roman.lower() + suffix for suffix in LOWER_SUFFIXES)
+    numeral_ids = {numeral: index for index, numeral in enumerate(numerals)}
+    table = []
+    for mode in MODES:
+        offsets = [_chord_offsets(numeral, mode) for numeral in numerals]
+        for pitch_class in range(12):
+            table.extend(tuple(TONIC_NOTE + pitch_class + offset for offset in chord) for chord in offsets)
+    return numeral_ids, table
+
+
+# Flat table of note tuples indexed by (mode ID * 12 + pitch class) * number of numerals + numeral ID
+NUMERAL_IDS, CHORD_TABLE = _build_chord_table()
+
+
+def normalize_numeral(numeral):
+    """Rewrite alternative spellings such as 'ii˚' to the canonical form used by the chord table."""
+    for alias, canonical in NUMERAL_ALIASES.items():
+        if numeral.endswith(alias):
+            return numeral[:-len(alias)] + canonical
+        if numeral.endswith(alias + '7'):
+            return numeral[:-len(alias) - 1] + canonical + ('' if canonical.endswith('7') else '7')
+    return numeral
+
+
+def numeral_id(numeral):
+    """Return the chord table ID of a Roman numeral, raising ValueError for unknown numerals."""
+    try:
+        return NUMERAL_IDS[normalize_numeral(numeral)]
+    except KeyError:
+        raise ValueError(f"Unknown chord numeral: {numeral!r}") from None
+
+
+def key_pitch_class(key):
+    """Return the pitch class of a key name such as 'C', 'Eb' or 'C♯/D♭'."""
+    try:
+        return KEY_PITCH_CLASSES[get_standard_key(key)]
+    except KeyError:
+        raise ValueError(f"Unknown key: {key!r}") from None
+
+
+def voice_chord(notes, inversion=0, voicing='close'):
+    """
+    Rearrange a root-position chord.
+
+    Args:
+        notes (tuple): MIDI notes in root position.
+        inversion (int): Number of lowest notes moved up an octave.
+        voicing (str): 'close', or 'open' to drop the second-highest note an octave (drop 2).
+
+    Returns:
+        tuple: The voiced MIDI notes, lowest first.
+    """
+    if voicing not in VOICINGS:
+        raise ValueError(f"Unknown voicing: {voicing!r}")
+    inversion %= len(notes)
+    notes = notes[inversion:] + tuple(note + 12 for note in notes[:inversion])
+    if voicing == 'open' and len(notes) > 2:
+        notes = tuple(sorted(notes[:-2] + (notes[-2] - 12,) + notes[-1:]))
+    return notes
+
+
+def chord_notes(key, numeral, mode='Major', inversion=0, voicing='close'):
+    """
+    Look up the MIDI notes of a Roman numeral chord in a key.
+
+    Args:
+        key (str): The key, e.g. 'C', 'Eb' or 'C♯/D♭'.
+        numeral (str): Roman numeral such as 'I', 'ii7', 'bVII' or 'vii°'.
+        mode (str): 'Major' or 'Minor'; unaltered numerals follow the mode's scale.
+        inversion (int): Chord inversion.
+        voicing (str): 'close' or 'open'.
+
+    Returns:
+        tuple: The MIDI note numbers, lowest first.
+    """
+    index = (MODES.index(mode) * 12 + key_pitch_class(key)) * len(NUMERAL_IDS) + numeral_id(numeral)
+    notes = CHORD_TABLE[index]
+    if inversion or voicing != 'close':
+        notes = voice_chord(notes, inversion, voicing)
+    return notes
+
+
+def resolve_progression(key, progression, mode='Major', inversion=0, voicing='close'):
+    """Resolve every numeral of a progression to its MIDI notes up front, failing on the first unknown numeral."""
+    return [chord_notes(key, numeral, mode, inversion, voicing) for numeral in progression]
 
-#gather data from songs
-def gather_data():
-
-    no_maj = 0
-    no_min = 0
-    no_4 = 0
-    no_other = 0
-    total_bpm = 0
-    total_energy = 0
-    total_songs = 0
-    total_time = 0
-    global keys
-    global modes
-    global time_signatures
-    global bpms
-    global energies
-    global genres
-    keys = []
-    modes = []
-    time_signatures = []
-    bpms = []
-    energies = []
-    genres = []
-    times = []
-    retries = 3
-    backoff_factor = 2
 
-    for _ in range(retries):
-        try:
-            
-            print(f"Loading...")
-            access_token = get_access_token()
-            songs = fetch_songs(access_token)
-            for song in songs:
-                total_songs += 1
-                print(f"{total_songs}. {song['name']} by {song['artist']}")
 
-                key = song['key']
-                key_note = key_dict[key]
-                keys.append(key_note)
+#parameter sampling
+class FrequencySampler:
+    """
+    Draw values with probability proportional to their counts.
+
+    Only the distinct values and their cumulative counts are stored, and each
+    draw is a binary search over the cumulative counts (O(log k) for k values).
+    """
+
+    def __init__(self, counts):
+        self.values = list(counts)
+        self.cum_weights = list(itertools.accumulate(counts[value] for value in self.values))
+
+    def __len__(self):
+        return len(self.values)
+
+    def draw(self, rng=random):
+        """Draw a single value."""
+        return self.values[bisect.bisect_right(self.cum_weights, rng.random() * self.cum_weights[-1])]
+
+    def sample(self, n, rng=random):
+        """Draw n values with replacement."""
+        return rng.choices(self.values, cum_weights=self.cum_weights, k=n)
+
+    def sample_indices(self, n, rng):
+        """Draw n indices into `values` at once with a numpy.random.Generator."""
+        return np.searchsorted(np.asarray(self.cum_weights), rng.random(n) * self.cum_weights[-1], side='right')
+
+
+class ParameterSampler:
+    """
+    Sample song parameters from a playlist's frequency counts.
+
+    By default each parameter is drawn independently. With joint=True the key,
+    mode, tempo, time signature and energy are drawn together from the
+    combinations found in real tracks, so correlated values stay together.
+    """
+
+    def __init__(self, key_counts, mode_counts, bpm_counts, time_signature_counts, energy_counts, genre_counts,
+                 track_parameter_counts=None):
+        self.keys = FrequencySampler(key_counts)
+        self.modes = FrequencySampler(mode_counts)
+        self.bpms = FrequencySampler(bpm_counts)
+        self.time_signatures = FrequencySampler(time_signature_counts)
+        self.energies = FrequencySampler(energy_counts)
+        self.genres = FrequencySampler(genre_counts) if genre_counts else None
+        self.track_parameters = FrequencySampler(track_parameter_counts) if track_parameter_counts else None
+
+    @instrumentation.stage('sampling')
+    def sample(self, n=1, joint=False, rng=random):
+        """
+        Sample n parameter sets in one call.
+
+        Args:
+            n (int): Number of parameter sets.
+            joint (bool): Draw key, mode, tempo, time signature and energy from real track combinations.
+            rng (random.Random): Source of randomness, e.g. a seeded random.Random.
+
+        Returns:
+            list: Dictionaries with 'key', 'mode', 'tempo', 'time_signature', 'energy' and 'genre'.
+        """
+        if joint:
+            if self.track_parameters is None:
+                raise ValueError("Joint sampling needs the parameter combinations of real tracks.")
+            columns = list(zip(*self.track_parameters.sample(n, rng))) or [()] * 5
+        else:
+            columns = [
+                self.keys.sample(n, rng),
+                self.modes.sample(n, rng),
+                self.bpms.sample(n, rng),
+                self.time_signatures.sample(n, rng),
+                self.energies.sample(n, rng),
+            ]
+        genres = self.genres.sample(n, rng) if self.genres else [None] * n
+        names = ('key', 'mode', 'tempo', 'time_signature', 'energy')
+        return [dict(zip(names, values), genre=genre) for *values, genre in zip(*columns, genres)]
+
+
+#playlist profiles
+def _counts_in_order(values):
+    """
+    Count the distinct values of an array, or the distinct rows of a 2-D array.
+
+    Returns:
+        tuple: The distinct values and their counts, in order of first appearance, as a
+            Counter filled one value at a time would list them.
+    """
+    distinct, first, counts = np.unique(values, return_index=True, return_counts=True, axis=0 if values.ndim > 1 else None)
+    order = np.argsort(first)
+    return distinct[order].tolist(), counts[order].tolist()
+
+
+class RunningStats:
+    """
+    Online count, mean and variance of a stream of numbers.
+
+    Values are added one at a time with Welford's algorithm, and two
+    accumulators merge with Chan et al.'s parallel formula, so partial
+    statistics from different shards combine into the same result.
+    """
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Return the statistics of both streams combined."""
+        count = self.count + other.count
+        if count == 0:
+            return RunningStats()
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        return RunningStats(count, mean, m2)
+
+    @classmethod
+    def from_array(cls, values):
+        """Build the statistics of a whole array at once."""
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return cls()
+        mean = values.mean()
+        return cls(len(values), float(mean), float(((values - mean) ** 2).sum()))
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else None
+
+    def to_dict(self):
+        return {
+            'mean': self.mean if self.count else None,
+            'std': self.variance ** 0.5 if self.count else None,
+        }
+
+
+class PlaylistProfile:
+    """
+    Single-pass accumulator of a playlist's musical profile.
+
+    Each track updates running statistics for tempo, energy and duration and
+    histograms of key, mode, time signature, tempo, energy and genre, so memory
+    grows with the number of distinct values rather than the number of tracks.
+    Tempos are counted in whole BPM; energies are counted as Spotify reports
+    them, to three decimals, so the energy histogram holds at most 1001 values
+    and sampled energies are those of real tracks.
+    Profiles of different playlists or shards of one playlist merge
+    associatively with merge().
+    """
+
+    def __init__(self, playlist_ids=()):
+        self.playlist_ids = list(playlist_ids)
+        self.tempo = RunningStats()
+        self.energy = RunningStats()
+        self.duration_ms = RunningStats()
+        self.key_counts = Counter()
+        self.mode_counts = Counter()
+        self.time_signature_counts = Counter()
+        self.bpm_counts = Counter()
+        self.energy_counts = Counter()
+        self.genre_counts = Counter()
+        # (key, mode, tempo, time signature, energy) combinations of real tracks, for joint sampling
+        self.track_parameter_counts = Counter()
+
+    @property
+    def songs(self):
+        return self.tempo.count
+
+    def add(self, song):
+        """Add a song that has audio features."""
+        key_note = key_dict[song['key']]
+        mode = 'Major' if song['mode'] == 1 else 'Minor'
+        bpm = round(song['tempo'])
+        self.tempo.add(song['tempo'])
+        self.energy.add(song['energy'])
+        self.duration_ms.add(song['duration_ms'])
+        self.key_counts[key_note] += 1
+        self.mode_counts[mode] += 1
+        self.time_signature_counts[song['time_signature']] += 1
+        self.bpm_counts[bpm] += 1
+        self.energy_counts[song['energy']] += 1
+        self.genre_counts.update(song['genre'])
+        self.track_parameter_counts[(key_note, mode, bpm, song['time_signature'], song['energy'])] += 1
+
+    def add_store(self, store):
+        """
+        Add every track of a TrackStore, reading whole columns instead of one row at a time.
+
+        The store must hold only songs with audio features, as gather_data() builds
+        it. The counts, their order and the statistics are those add() gives when
+        called on each track in turn.
+        """
+        if not len(store):
+            return
+        tempo = store.column('tempo')
+        energy = store.column('energy')
+        for name, values in (('tempo', tempo), ('energy', energy), ('duration_ms', store.column('duration_ms'))):
+            setattr(self, name, getattr(self, name).merge(RunningStats.from_array(values)))
+
+        bpms = np.rint(tempo)
+        keys = store.column('key')
+        modes = store.column('mode')
+        time_signatures = store.column('time_signature')
+
+        def mode_name(mode):
+            return 'Major' if mode == 1 else 'Minor'
+
+        for counter, values, convert in (
+            (self.key_counts, keys, key_dict.__getitem__),
+            (self.mode_counts, modes, mode_name),
+            (self.time_signature_counts, time_signatures, int),
+            (self.bpm_counts, bpms, int),
+            (self.energy_counts, energy, float),
+            (self.genre_counts, store.genre_codes(), store.genre_names.__getitem__),
+        ):
+            for value, count in zip(*_counts_in_order(values)):
+                counter[convert(value)] += count
+
+        combinations = np.column_stack((keys, modes, bpms, time_signatures, energy))
+        for (key, mode, bpm, time_signature, energy), count in zip(*_counts_in_order(combinations)):
+            self.track_parameter_counts[(key_dict[int(key)], mode_name(mode), int(bpm), int(time_signature), energy)] += count
+
+    def merge(self, other):
+        """Return a new profile covering the songs of both profiles."""
+        merged = PlaylistProfile(self.playlist_ids + other.playlist_ids)
+        for name in ('tempo', 'energy', 'duration_ms'):
+            setattr(merged, name, getattr(self, name).merge(getattr(other, name)))
+        for name in ('key_counts', 'mode_counts', 'time_signature_counts', 'bpm_counts', 'energy_counts',
+                     'genre_counts', 'track_parameter_counts'):
+            setattr(merged, name, getattr(self, name) + getattr(other, name))
+        return merged
+
+    def top_genres(self, k=5):
+        return [genre for genre, count in self.genre_counts.most_common(k)]
+
+    @property
+    def most_common_genre(self):
+        top = self.top_genres(1)
+        return top[0] if top else None
+
+    def sampler(self):
+        """Build a ParameterSampler that draws from this profile's counts."""
+        return ParameterSampler(
+            self.key_counts, self.mode_counts, self.bpm_counts, self.time_signature_counts, self.energy_counts,
+            self.genre_counts, self.track_parameter_counts,
+        )
+
+    def to_dict(self):
+        """Summarize the profile as JSON-serializable data."""
+        return {
+            'playlists': self.playlist_ids,
+            'songs': self.songs,
+            'tempo': self.tempo.to_dict(),
+            'energy': self.energy.to_dict(),
+            'duration_ms': self.duration_ms.to_dict(),
+            'keys': dict(self.key_counts.most_common()),
+            'modes': dict(self.mode_counts.most_common()),
+            'time_signatures': {str(time_signature): count for time_signature, count in self.time_signature_counts.most_common()},
+            'bpms': {str(bpm): count for bpm, count in self.bpm_counts.most_common()},
+            'top_genres': self.top_genres(10),
+            'genres': dict(self.genre_counts.most_common()),
+        }
 
-                if song['mode'] == 1:
-                    mode = 'Major'                    
-                    no_maj += 1
-                else:
-                    mode = 'Minor'
-                    no_min += 1
-                
-                modes.append(mode)
 
-                mins = int((song['duration_ms'] / 60000))
-                secs = int(((song['duration_ms'] / 1000) % 60))
+#playlist runs
+class PlaylistRun:
+    """
+    Everything one playlist's run produces, kept apart from every other run.
+
+    gather_data() returns one of these per playlist, so several playlists can
+    be processed in the same process, each with its own snapshot, profile and
+    parameter sampler.
+    """
+
+    def __init__(self, playlist_id, snapshot, profile):
+        self.playlist_id = playlist_id
+        self.snapshot = snapshot
+        self.profile = profile
+        self.most_common_genre = profile.most_common_genre
+        # Sample new songs straight from the frequency counts
+        self.parameter_sampler = profile.sampler()
+        # Recommendations for all of the run's songs are answered from one pool
+        self.candidate_pool = CandidatePool(self.most_common_genre)
+
+    @property
+    def total_songs(self):
+        return self.profile.songs
+
+    def to_profile(self):
+        """Summarize the run as a JSON-serializable playlist profile."""
+        return self.profile.to_dict()
+
+
+def merge_runs(runs):
+    """Merge the profiles of several playlist runs into one profile."""
+    return functools.reduce(PlaylistProfile.merge, (run.profile for run in runs), PlaylistProfile()).to_dict()
+
+
+#profile files
+PROFILE_FORMAT_VERSION = 1
+# Histograms of PlaylistProfile saved as a values array and a counts array each
+PROFILE_HISTOGRAMS = ('key_counts', 'mode_counts', 'time_signature_counts', 'bpm_counts', 'energy_counts', 'genre_counts')
+PROFILE_STATS = ('tempo', 'energy', 'duration_ms')
+# Columns of track_parameter_counts keys, in tuple order
+TRACK_PARAMETER_COLUMNS = ('key', 'mode', 'bpm', 'time_signature', 'energy')
+# Per-track columns kept for offline scoring and for printing the closest songs
+PROFILE_TRACK_TEXT = ('id', 'name', 'artist')
+PROFILE_TRACK_INTEGERS = ('key', 'mode', 'time_signature', 'duration_ms')
+PROFILE_TRACK_FLOATS = TRACK_FLOAT_FIELDS
+
+
+def save_profile(run, path, include_tracks=True):
+    """
+    Write a playlist run's profile to a compressed .npz file for offline generation.
+
+    The file holds the histograms and running statistics of the profile and,
+    unless include_tracks is False, the scoring features of every track. It
+    contains only plain arrays, so it loads without pickle.
+
+    Args:
+        run (PlaylistRun): The run to save.
+        path (str): Destination file.
+        include_tracks (bool): Also save the tracks, so local scoring works offline.
+    """
+    profile = run.profile
+    arrays = {
+        'format_version': np.array(PROFILE_FORMAT_VERSION),
+        'playlist_id': np.array(run.playlist_id or '', dtype=str),
+        'playlist_ids': np.array(profile.playlist_ids, dtype=str),
+    }
+    for name in PROFILE_STATS:
+        stats = getattr(profile, name)
+        arrays[f'{name}_stats'] = np.array([stats.count, stats.mean, stats.m2], dtype=float)
+    for name in PROFILE_HISTOGRAMS:
+        counter = getattr(profile, name)
+        arrays[f'{name}_values'] = np.array(list(counter), dtype=str if name in ('key_counts', 'mode_counts', 'genre_counts') else float)
+        arrays[f'{name}_counts'] = np.array(list(counter.values()), dtype=np.int64)
+    combinations = list(profile.track_parameter_counts)
+    for column, name in enumerate(TRACK_PARAMETER_COLUMNS):
+        arrays[f'track_parameter_{name}'] = np.array(
+            [combination[column] for combination in combinations], dtype=str if name in ('key', 'mode') else float,
+        )
+    arrays['track_parameter_counts'] = np.array(list(profile.track_parameter_counts.values()), dtype=np.int64)
+    if include_tracks:
+        tracks = run.snapshot.songs
+        for name in PROFILE_TRACK_TEXT:
+            arrays[f'track_{name}'] = np.array(tracks.column(name), dtype=str)
+        for name in PROFILE_TRACK_INTEGERS:
+            arrays[f'track_{name}'] = tracks.column(name)
+        for name in PROFILE_TRACK_FLOATS:
+            arrays[f'track_{name}'] = tracks.column(name)
+    np.savez_compressed(path, **arrays)
+
+
+def _counter(values, counts, convert=None):
+    """Rebuild a Counter from saved values and counts, converting values back to Python types."""
+    values = values.tolist()
+    if convert is not None:
+        values = [convert(value) for value in values]
+    return Counter(dict(zip(values, counts.tolist())))
+
+
+def load_profile(path):
+    """
+    Read a profile written by save_profile().
 
-                genres.extend(song['genre'])
+    Args:
+        path (str): The .npz file.
 
+    Returns:
+        PlaylistRun: The saved run. Its snapshot is empty if the tracks were not saved.
+    """
+    with np.load(path) as data:
+        if int(data['format_version']) != PROFILE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported profile format version: {int(data['format_version'])}")
+        profile = PlaylistProfile(data['playlist_ids'].tolist())
+        for name in PROFILE_STATS:
+            count, mean, m2 = data[f'{name}_stats'].tolist()
+            setattr(profile, name, RunningStats(int(count), mean, m2))
+        # Time signatures and BPMs are integers in the API's data; energies stay floats
+        converters = {'time_signature_counts': int, 'bpm_counts': int}
+        for name in PROFILE_HISTOGRAMS:
+            setattr(profile, name, _counter(data[f'{name}_values'], data[f'{name}_counts'], converters.get(name)))
+        columns = [data[f'track_parameter_{name}'].tolist() for name in TRACK_PARAMETER_COLUMNS]
+        combinations = [
+            (key, mode, int(bpm), int(time_signature), energy)
+            for key, mode, bpm, time_signature, energy in zip(*columns)
+        ]
+        profile.track_parameter_counts = Counter(dict(zip(combinations, data['track_parameter_counts'].tolist())))
+
+        columns = {}
+        if 'track_id' in data.files:
+            columns = {name: data[f'track_{name}'].tolist() for name in PROFILE_TRACK_TEXT}
+            columns.update({name: data[f'track_{name}'] for name in PROFILE_TRACK_INTEGERS + PROFILE_TRACK_FLOATS})
+        playlist_id = str(data['playlist_id']) or None
+    return PlaylistRun(playlist_id, PlaylistSnapshot(playlist_id, TrackStore.from_columns(columns)), profile)
 
-                print(f"{round(song['tempo'])} BPM, {key_note} {mode}, {song['time_signature']}/4, Energy: {song['energy']}, length: {mins} mins {secs} secs \n")
-                
 
+#gather data from songs
+@instrumentation.stage('gather')
+def gather_data(playlist_id, verbose=True):
+    """
+    Fetch a playlist once, print each song and aggregate its parameters.
 
-                
+    A failed attempt is retried from the playlist's checkpoint, so the pages
+    and batches that already finished are not fetched again.
 
-                time_signatures.append(song['time_signature'])
-                if song['time_signature'] == 4:
-                    no_4 += 1
-                else:
-                    no_other += 1
+    Args:
+        playlist_id (str): The playlist's ID.
+        verbose (bool): Print every song as it is aggregated.
 
-                bpms.append(round(song['tempo']))
-                total_bpm += song['tempo']
-                energies.append(song['energy'])
-                total_energy += song['energy']
-                times.append(song['duration_ms'])
-                total_time += song['duration_ms']
+    Returns:
+        PlaylistRun: The playlist's snapshot, profile and parameter sampler.
+    """
+    retries = 3
+    backoff_factor = 2
+    # Pages and batches that finish are recorded here, so a retry or a later run resumes instead of restarting
+    checkpoint = PlaylistCheckpoint(playlist_id)
 
+    for _ in range(retries):
+        # Every attempt collects the tracks from scratch; pages already fetched are replayed from the checkpoint
+        tracks = TrackStore()
+
+        try:
+            if verbose:
+                print(f"Loading...")
+            access_token = get_access_token()
+            for song in iter_playlist_tracks(access_token, playlist_id, checkpoint):
+                # Tracks without audio features cannot be profiled
+                if 'tempo' not in song:
+                    continue
+                tracks.append(song)
+
+                if verbose:
+                    key_note = key_dict[song['key']]
+                    mode = 'Major' if song['mode'] == 1 else 'Minor'
+                    mins = int((song['duration_ms'] / 60000))
+                    secs = int(((song['duration_ms'] / 1000) % 60))
+                    print(f"{len(tracks)}. {song['name']} by {song['artist']}")
+                    print(f"{round(song['tempo'])} BPM, {key_note} {mode}, {song['time_signature']}/4, Energy: {song['energy']}, length: {mins} mins {secs} secs \n")
 
-                
         except requests.exceptions.RequestException as e:
             print(f"Error: {e}")
             if _ < retries - 1:  # Don't sleep on the last attempt
                 sleep_duration = backoff_factor * (_ + 1)
                 print(f"Retrying in {sleep_duration} seconds...")
                 time.sleep(sleep_duration)
+                continue
             else:
                 print("Max retries reached. Exiting.")
-                break
+                raise
+
+        # Fetching is timed by the 'gather' stage as a whole; 'aggregation' is the profile alone
+        with instrumentation.stage('aggregation'):
+            profile = PlaylistProfile([playlist_id])
+            profile.add_store(tracks)
+        checkpoint.discard()
+        return PlaylistRun(playlist_id, PlaylistSnapshot(playlist_id, tracks), profile)
+
+#recommendation pool
+POPULAR_GENRES = ['pop', 'rap', 'rock', 'country']  # Seed genres added to the playlist's most common genre
+RECOMMENDATIONS_LIMIT = 100  # Maximum number of tracks /v1/recommendations returns per call
+RECOMMENDATIONS_PER_SONG = 3
+SONG_RECOMMENDATIONS_LIMIT = 50  # Tracks requested for a single song when there is no pool
+TEMPO_TOLERANCE = 30  # BPM either side of the target tempo
+ENERGY_TOLERANCE = 1.3
+MAX_POOL_TOP_UPS = 10  # Recommendation calls a pool makes at most, however many songs it answers
+
+
+class CandidatePool:
+    """
+    Recommendation candidates of one run, indexed for local range queries.
+
+    Candidates are fetched with their audio features and kept per time
+    signature in tempo order, so each generated song is answered with a
+    bisect over the tempo range followed by the energy filter. fill() calls
+    the API once per run, before the songs are scored, for the songs the
+    pool cannot answer yet, and never twice for the same time signature and
+    tempo band; answering a song afterwards makes no requests.
+    """
 
-        average_bpm = round(total_bpm / total_songs)
-        average_energy = total_energy / total_songs
-        global key_counts
-        global mode_counts
-        key_counts = Counter(keys)
-        most_common_key = key_counts.most_common(1)
-        mode_counts = Counter(modes)
-        most_common_mode = mode_counts.most_common(1)
-        global time_signature_counts
-        global genre_counts
-        global bpm_counts
-        global energy_counts
-        time_signature_counts = Counter(time_signatures)
-        genre_counts = Counter(genres)
-        global most_common_genre
-        most_common_genre = genre_counts.most_common(1)[0][0]
-        bpm_counts = Counter(bpms)
-        energy_counts = Counter(energies)
-        total_mins = int((total_time / total_songs) / 60000)
-        total_secs = int(((total_time / total_songs) / 1000) % 60)
+    def __init__(self, seed_genre=None, max_top_ups=MAX_POOL_TOP_UPS):
+        self.seed_genres = ([seed_genre] if seed_genre else []) + POPULAR_GENRES[:4]
+        self.max_top_ups = max_top_ups
+        self.top_ups = 0
+        self._ids = set()
+        # Time signature -> sorted tempos and the (energy, tempo, track) entries in the same order
+        self._tempos = {}
+        self._entries = {}
+        self._attempted = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, tracks, features_by_id):
+        """Index tracks by their audio features; tracks already in the pool or without features are skipped."""
+        with self._lock:
+            for track in tracks:
+                features = features_by_id.get(track['id'])
+                if not features or track['id'] in self._ids:
+                    continue
+                self._ids.add(track['id'])
+                tempos = self._tempos.setdefault(features['time_signature'], [])
+                entries = self._entries.setdefault(features['time_signature'], [])
+                index = bisect.bisect_right(tempos, features['tempo'])
+                tempos.insert(index, features['tempo'])
+                entries.insert(index, (features['energy'], features['tempo'], track))
+
+    def query(self, target_tempo, target_energy, target_time_signature, k=RECOMMENDATIONS_PER_SONG):
+        """
+        Find the pooled tracks that fit a song, without calling the API.
+
+        Returns:
+            list: Up to k tracks with the song's time signature, within TEMPO_TOLERANCE BPM
+                and ENERGY_TOLERANCE energy of its targets, closest in energy first.
+        """
+        with self._lock:
+            tempos = self._tempos.get(target_time_signature, [])
+            entries = self._entries.get(target_time_signature, [])
+            low = bisect.bisect_left(tempos, target_tempo - TEMPO_TOLERANCE)
+            high = bisect.bisect_right(tempos, target_tempo + TEMPO_TOLERANCE)
+            matches = [entry for entry in entries[low:high] if abs(entry[0] - target_energy) <= ENERGY_TOLERANCE]
+        matches.sort(key=lambda entry: (abs(entry[0] - target_energy), abs(entry[1] - target_tempo)))
+        return [track for _, _, track in matches[:k]]
+
+    def top_up(self, target_tempo, target_energy, target_time_signature):
+        """
+        Fetch another batch of candidates aimed at a song's targets.
+
+        Returns:
+            bool: Whether a request was made; False once the band was tried or the budget is spent.
+        """
+        band = (target_time_signature, round(target_tempo / TEMPO_TOLERANCE))
+        with self._lock:
+            if band in self._attempted or self.top_ups >= self.max_top_ups:
+                return False
+            self._attempted.add(band)
+            self.top_ups += 1
+        recommendations = get_spotify_client().recommendations(
+            target_tempo=target_tempo, target_energy=target_energy, target_time_signature=target_time_signature,
+            seed_genres=self.seed_genres, limit=RECOMMENDATIONS_LIMIT,
+        )
+        tracks = recommendations['tracks']
+        # Fetch every candidate's features in one batch; they are indexed with the track
+        self.add(tracks, get_audio_features([track['id'] for track in tracks]))
+        return True
+
+    def fill(self, songs, k=RECOMMENDATIONS_PER_SONG):
+        """
+        Top the pool up for every song it holds too few matches for.
+
+        Args:
+            songs (list): Generated songs, with their 'tempo', 'energy' and 'time_signature'.
+            k (int): Matches each song needs.
+
+        Returns:
+            int: Recommendation requests made.
+        """
+        requests_made = 0
+        for song in songs:
+            targets = (song['tempo'], song['energy'], song['time_signature'])
+            if len(self.query(*targets, k)) < k and self.top_up(*targets):
+                requests_made += 1
+        return requests_made
+
+
+@instrumentation.stage('recommendations')
+def get_recommendations(target_tempo, target_energy, target_time_signature, seed_genre, pool=None):
+    """
+    Find Spotify tracks that suit a generated song as drum references.
 
-        
+    Args:
+        target_tempo (float): The song's tempo.
+        target_energy (float): The song's energy.
+        target_time_signature (int): The song's time signature.
+        seed_genre (str): Genre to seed recommendations with, besides POPULAR_GENRES.
+        pool (CandidatePool): The run's candidate pool, filled before the songs are scored. Without
+            one, recommendations are requested for this song alone.
 
-        # Generate a list of all parameters with their frequencies
-        global all_keys
-        global all_modes
-        global all_time_signatures
-        global all_bpms
-        global all_energies
-        global all_genres
-
-        all_keys = [key for key, count in key_counts.items() for _ in range(count)]
-        all_modes = [mode for mode, count in mode_counts.items() for _ in range(count)]
-        all_time_signatures = [time_signature for time_signature, count in time_signature_counts.items() for _ in range(count)]
-        all_bpms = [bpm for bpm, count in bpm_counts.items() for _ in range(count)]
-        all_energies = [energy for energy, count in energy_counts.items() for _ in range(count)]
-        all_genres = [genre for genre, count in genre_counts.items() for _ in range(count)]
-        most_common_genre = genre_counts.most_common(1)[0][0]
-        break
-
-def get_recommendations(target_tempo, target_energy, target_time_signature):
-    
-    popular_genres = ['pop', 'rap', 'rock', 'country']  # Adjust this list based on your preference
-    seed_genres = [most_common_genre] + popular_genres[:4]  # Take the first 4 genres from the popular_genres list
-    
-    
-    # Get a set of recommendations from Spotify using the seed genres
-    recommendations = sp.recommendations(target_tempo=target_tempo, target_energy=target_energy, seed_genres=seed_genres, limit=50)
+    Returns:
+        list: Up to RECOMMENDATIONS_PER_SONG tracks, closest in energy first.
+    """
+    if pool is not None:
+        return pool.query(target_tempo, target_energy, target_time_signature)
 
-    filtered_tracks = []
+    seed_genres = ([seed_genre] if seed_genre else []) + POPULAR_GENRES[:4]
+    recommendations = get_spotify_client().recommendations(
+        target_tempo=target_tempo, target_energy=target_energy, seed_genres=seed_genres, limit=SONG_RECOMMENDATIONS_LIMIT,
+    )
+    # Fetch every candidate's features in one batch and reuse them for filtering and sorting
+    features_by_id = get_audio_features([track['id'] for track in recommendations['tracks']])
 
+    filtered_tracks = []
     for track in recommendations['tracks']:
-        track_id = track['id']
-        audio_features = sp.audio_features(track_id)[0]
+        audio_features = features_by_id[track['id']]
+        if not audio_features:
+            continue
+        if (audio_features['time_signature'] == target_time_signature
+                and abs(audio_features['energy'] - target_energy) <= ENERGY_TOLERANCE
+                and target_tempo - TEMPO_TOLERANCE <= audio_features['tempo'] <= target_tempo + TEMPO_TOLERANCE):
+            filtered_tracks.append(track)
 
-        # Check time signature
-        if audio_features['time_signature'] == target_time_signature:
-            # Check energy
-            if abs(audio_features['energy'] - target_energy) <= 1.3:
-                # Check BPM
-                if target_tempo - 30 <= audio_features['tempo'] <= target_tempo + 30:
-                    filtered_tracks.append(track)
-  
-    # Sort the tracks based on BPM closeness
-    sorted_tracks = sorted(filtered_tracks, key=lambda x: abs(sp.audio_features(x['id'])[0]['energy'] - target_energy))
-    return sorted_tracks[:3],   # Return top 3 tracks
+    # Closest in energy first; ties keep the order Spotify returned them in
+    sorted_tracks = sorted(filtered_tracks, key=lambda track: abs(features_by_id[track['id']]['energy'] - target_energy))
+    return sorted_tracks[:RECOMMENDATIONS_PER_SONG]
 
 
-# Generate 10 songs worth of parameters
+#bulk generation
+BULK_RENDER_CHUNK_SIZE = 1000  # MIDI files rendered and written per pass
 
 
+@instrumentation.stage('sampling')
+def generate_bulk(sampler, n, seed=None, joint=False):
+    """
+    Sample the parameters and chord progressions of n songs at once.
 
+    Every column is drawn with one vectorized call on a seedable NumPy
+    generator, so the same sampler and seed always produce the same manifest.
+    No network access is needed once the sampler exists.
 
-if __name__ == '__main__':
-    playlist_id = input(f'Enter Spotify playlist link: ')
-    playlist_type, playlist_id = parse_spotify_link(playlist_id)
-    if playlist_type != 'playlist':
-        raise ValueError("Only Spotify playlist links are supported.")
-    playlist_name = sp.playlist(playlist_id)['name']
-    print(f"Fetching songs from playlist {playlist_name}...")
-    gather_data()
-    for i in range(10):
-        song_key = random.choice(all_keys)
-        song_mode = random.choice(all_modes)
-        song_tempo = random.choice(all_bpms)
-        song_time_signature = random.choice(all_time_signatures)
-        song_energy = random.choice(all_energies)
-        song_genre = random.choice(all_genres)
+    Args:
+        sampler (ParameterSampler): The playlist's parameter sampler.
+        n (int): Number of songs.
+        seed (int): Seed of the random generator.
+        joint (bool): Draw key, mode, tempo, time signature and energy together from real tracks.
+
+    Returns:
+        dict: The manifest, with one integer or float array per parameter holding
+            codes into the vocabulary arrays stored alongside them.
+    """
+    rng = np.random.default_rng(seed)
+    if joint:
+        if sampler.track_parameters is None:
+            raise ValueError("Joint sampling needs the parameter combinations of real tracks.")
+        combinations = sampler.track_parameters.values
+        rows = sampler.track_parameters.sample_indices(n, rng)
+        key_names = sorted({combination[0] for combination in combinations})
+        mode_names = sorted({combination[1] for combination in combinations})
+        key_codes = np.array([key_names.index(combination[0]) for combination in combinations])[rows]
+        mode_codes = np.array([mode_names.index(combination[1]) for combination in combinations])[rows]
+        tempos = np.array([combination[2] for combination in combinations])[rows]
+        time_signatures = np.array([combination[3] for combination in combinations])[rows]
+        energies = np.array([combination[4] for combination in combinations])[rows]
+    else:
+        key_names = sampler.keys.values
+        mode_names = sampler.modes.values
+        key_codes = sampler.keys.sample_indices(n, rng)
+        mode_codes = sampler.modes.sample_indices(n, rng)
+        tempos = np.array(sampler.bpms.values)[sampler.bpms.sample_indices(n, rng)]
+        time_signatures = np.array(sampler.time_signatures.values)[sampler.time_signatures.sample_indices(n, rng)]
+        energies = np.array(sampler.energies.values)[sampler.energies.sample_indices(n, rng)]
+    genre_names = sampler.genres.values if sampler.genres else []
+    genre_codes = sampler.genres.sample_indices(n, rng) if sampler.genres else np.full(n, -1)
+
+    # Progressions are drawn for every song from both lists, then picked by the song's mode
+    is_major = np.array([name == 'Major' for name in mode_names], dtype=bool)[mode_codes] if n else np.zeros(0, dtype=bool)
+    major_cum_weights = np.cumsum(major_weights)
+    minor_cum_weights = np.cumsum(minor_weights)
+    major_ids = np.searchsorted(major_cum_weights, rng.random(n) * major_cum_weights[-1], side='right')
+    minor_ids = np.searchsorted(minor_cum_weights, rng.random(n) * minor_cum_weights[-1], side='right')
+
+    return {
+        'key': key_codes.astype(np.uint8),
+        'mode': mode_codes.astype(np.uint8),
+        'tempo': tempos.astype(np.uint16),
+        'time_signature': time_signatures.astype(np.uint8),
+        'energy': energies.astype(np.float64),  # Sampled energies exactly as the profile counted them
+        'genre': genre_codes.astype(np.int32),
+        'progression': np.where(is_major, major_ids, minor_ids).astype(np.uint8),
+        'key_names': np.array(key_names, dtype=str),
+        'mode_names': np.array(mode_names, dtype=str),
+        'genre_names': np.array(genre_names, dtype=str),
+        'major_progressions': np.array([' '.join(progression) for progression in major_chord_progressions]),
+        'minor_progressions': np.array([' '.join(progression) for progression in minor_chord_progressions]),
+    }
+
+
+def save_manifest(manifest, path):
+    """Write a bulk generation manifest as a compressed .npz file."""
+    np.savez_compressed(path, **manifest)
+
+
+def load_manifest(path):
+    """Read a manifest written by save_manifest()."""
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def iter_manifest_songs(manifest):
+    """Yield every song of a manifest as a dictionary with its progression resolved to MIDI notes."""
+    progressions = {
+        'Major': [progression.split() for progression in manifest['major_progressions']],
+        'Minor': [progression.split() for progression in manifest['minor_progressions']],
+    }
+    # At most 12 keys x 2 modes x a few dozen progressions, so each is resolved once
+    resolved = {}
+    for i in range(len(manifest['key'])):
+        key_name = str(manifest['key_names'][manifest['key'][i]])
+        mode_name = str(manifest['mode_names'][manifest['mode'][i]])
+        progression_id = int(manifest['progression'][i])
+        cache_key = (key_name, mode_name, progression_id)
+        if cache_key not in resolved:
+            resolved[cache_key] = resolve_progression(key_name, progressions[mode_name][progression_id], mode_name)
+        yield {
+            'key_name': key_name,
+            'mode_name': mode_name,
+            'tempo': int(manifest['tempo'][i]),
+            'time_signature': int(manifest['time_signature'][i]),
+            'energy': float(manifest['energy'][i]),
+            'progression': progressions[mode_name][progression_id],
+            'notes': resolved[cache_key],
+            'filename': f"generated_song_{i + 1}.mid",
+        }
+
+
+def render_manifest(manifest, output_dir):
+    """Render every song of a manifest to its own MIDI file, BULK_RENDER_CHUNK_SIZE files per pass."""
+    songs = iter_manifest_songs(manifest)
+    written = 0
+    while True:
+        chunk = list(itertools.islice(songs, BULK_RENDER_CHUNK_SIZE))
+        if not chunk:
+            return written
+        written += len(write_midi_files(chunk, output_dir))
+
+
+#song generation
+def generate_songs(run, n=10, rng=random, joint=False):
+    """
+    Generate song ideas from a playlist run's parameter sampler.
+
+    Nothing but rng is shared between calls, so concurrent calls on the same
+    run do not affect each other.
+
+    Args:
+        run (PlaylistRun): The playlist's run.
+        n (int): Number of songs.
+        rng (random.Random): Source of randomness, e.g. a seeded random.Random.
+        joint (bool): Draw key, mode, tempo, time signature and energy from real track combinations.
+
+    Returns:
+        list: One dictionary per song with its parameters, chord progression, notes and MIDI filename.
+    """
+    key_indices = {note: index for index, note in key_dict.items()}
+    generated_songs = []
+    for parameters in run.parameter_sampler.sample(n, joint, rng):
+        song_key = parameters['key']
+        song_mode = parameters['mode']
         selected_progression = []
         if song_mode.endswith('Major'):
-            selected_progression = random.choices(major_chord_progressions, weights=major_weights, k=1)[0]
+            selected_progression = rng.choices(major_chord_progressions, weights=major_weights, k=1)[0]
         elif song_mode.endswith('Minor'):
-            selected_progression = random.choices(minor_chord_progressions, weights=minor_weights, k=1)[0]
-        
-        # Define the generated_song dictionary
-        generated_song = {
-            'tempo': song_tempo,
-            'energy': song_energy
-            # Add more parameters as needed
-        }
+            selected_progression = rng.choices(minor_chord_progressions, weights=minor_weights, k=1)[0]
+        generated_songs.append({
+            'tempo': parameters['tempo'],
+            'energy': parameters['energy'],
+            'key': key_indices[song_key],
+            'mode': 1 if song_mode == 'Major' else 0,
+            'time_signature': parameters['time_signature'],
+            'key_name': song_key,
+            'mode_name': song_mode,
+            'genre': parameters['genre'],
+            'progression': selected_progression,
+            'notes': resolve_progression(song_key, selected_progression, song_mode),
+            'filename': f"generated_song_{len(generated_songs) + 1}.mid",
+        })
+    return generated_songs
+
+
+#batch mode
+def read_playlist_links(path):
+    """Read playlist links from a file, one per line, skipping blank lines and # comments."""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def run_batch(playlist_links, workers=4, output_dir='profiles'):
+    """
+    Profile many playlists concurrently on a pool of worker threads.
 
-        access_token = get_access_token()
-        tracks = fetch_songs(access_token)
+    Every playlist gets its own PlaylistRun; the workers share only the token,
+    response cache, request scheduler and Spotify client, so the batch is
+    limited by the API's rate limit rather than by running one playlist at a
+    time. Each profile is written to <output_dir>/<playlist_id>.json as it
+    completes, and the merged profile of every successful run to
+    <output_dir>/merged.json.
 
-        differences = []
-        for track in tracks:
-            audio_features = sp.audio_features(track['id'])[0]
-            diff = calculate_difference(audio_features, generated_song)
-            differences.append((track, diff))
+    Args:
+        playlist_links (list): Spotify playlist links.
+        workers (int): Number of playlists processed at once.
+        output_dir (str): Directory the profiles are written to.
 
-        # Sort the songs by difference
-        sorted_songs = sorted(differences, key=lambda x: x[1])
-        recommended_tracks = get_recommendations(song_tempo, song_energy, song_time_signature)
+    Returns:
+        tuple: (runs, merged_profile), the successful PlaylistRuns and their merged profile.
+    """
+    playlist_ids = []
+    for link in playlist_links:
+        try:
+            playlist_type, playlist_id = parse_spotify_link(link)
+        except ValueError:
+            print(f"Skipping invalid Spotify link: {link}")
+            continue
+        if playlist_type != 'playlist':
+            print(f"Skipping Spotify link that is not a playlist: {link}")
+            continue
+        playlist_ids.append(playlist_id)
+
+    os.makedirs(output_dir, exist_ok=True)
+    runs = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(gather_data, playlist_id, verbose=False): playlist_id
+            for playlist_id in dict.fromkeys(playlist_ids)
+        }
+        for future in as_completed(futures):
+            playlist_id = futures[future]
+            try:
+                run = future.result()
+            except Exception as e:
+                # One bad playlist must not cost the batch its other profiles
+                print(f"Failed to profile playlist {playlist_id}: {e!r}")
+                continue
+            runs.append(run)
+            with open(os.path.join(output_dir, f'{playlist_id}.json'), 'w', encoding='utf-8') as f:
+                json.dump(run.to_profile(), f, indent=2)
+            print(f"Profiled playlist {playlist_id} ({run.total_songs} songs)")
+
+    merged_profile = merge_runs(runs)
+    with open(os.path.join(output_dir, 'merged.json'), 'w', encoding='utf-8') as f:
+        json.dump(merged_profile, f, indent=2)
+    print(f"Merged profile of {len(runs)} playlists written to {output_dir}")
+    return runs, merged_profile
+
+
+#generation service
+SERVICE_HOST = os.environ.get('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.environ.get('SERVICE_PORT', '8750'))
+SERVICE_MAX_PLAYLISTS = int(os.environ.get('SERVICE_MAX_PLAYLISTS', '32'))  # Warm playlists kept, least recently used dropped first
+SERVICE_PLAYLIST_TTL = float(os.environ.get('SERVICE_PLAYLIST_TTL', '3600'))  # Seconds before a warm playlist is reloaded
+SERVICE_MAX_SONGS = 1000  # Songs one request may generate
+SONGS_ROUTE = '/playlists/{playlist_id}/songs'
+
+
+class WarmPlaylist:
+    """A playlist the service keeps in memory: its run, its scoring engine and when it was loaded."""
+
+    __slots__ = ('run', 'scoring_engine', 'offline', 'loaded_at')
+
+    def __init__(self, run, offline=False):
+        self.run = run
+        self.scoring_engine = ScoringEngine(run.snapshot)
+        self.offline = offline
+        self.loaded_at = time.monotonic()
+
+
+class GenerationService:
+    """
+    Resident song generator that keeps playlists warm between requests.
+
+    A playlist is loaded once, from <profile_dir>/<playlist_id>.npz when such
+    a profile exists and with gather_data() otherwise, and then answered from
+    memory together with its scoring engine and candidate pool; the token,
+    the response cache and the chord table are process-wide already.
+    Concurrent requests for a playlist that is still loading wait for the
+    same load. Each request samples with a random.Random of its own and
+    builds its own result, so requests never see each other's state.
+
+    Playlists are held by the event loop's thread only; loading, sampling
+    and scoring run on worker threads so the loop keeps serving.
+    """
 
+    def __init__(self, profile_dir=None, max_playlists=SERVICE_MAX_PLAYLISTS, playlist_ttl=SERVICE_PLAYLIST_TTL):
+        self.profile_dir = profile_dir
+        self.max_playlists = max_playlists
+        self.playlist_ttl = playlist_ttl
+        self._playlists = OrderedDict()
+        self._loading = {}
+        self.playlist_hits = 0
+        self.playlist_loads = 0
+        # Route -> LatencyHistogram of the requests it answered
+        self.latency = {}
+
+    def _load(self, playlist_id):
+        if self.profile_dir:
+            path = os.path.join(self.profile_dir, f'{playlist_id}.npz')
+            if os.path.exists(path):
+                return WarmPlaylist(load_profile(path), offline=True)
+        return WarmPlaylist(gather_data(playlist_id, verbose=False))
+
+    async def _fetch(self, playlist_id):
+        try:
+            playlist = await asyncio.to_thread(self._load, playlist_id)
+        finally:
+            del self._loading[playlist_id]
+        self._playlists[playlist_id] = playlist
+        while len(self._playlists) > self.max_playlists:
+            self._playlists.popitem(last=False)
+        return playlist
+
+    async def playlist(self, playlist_id):
+        """
+        Return a warm playlist, loading it first if it is not in memory or has expired.
+
+        Returns:
+            WarmPlaylist: The playlist's run and scoring engine.
+        """
+        playlist = self._playlists.get(playlist_id)
+        if playlist is not None and time.monotonic() - playlist.loaded_at < self.playlist_ttl:
+            self._playlists.move_to_end(playlist_id)
+            self.playlist_hits += 1
+            return playlist
+        task = self._loading.get(playlist_id)
+        if task is None:
+            self.playlist_loads += 1
+            task = self._loading[playlist_id] = asyncio.ensure_future(self._fetch(playlist_id))
+        # A client that goes away must not cancel a load other requests wait for
+        return await asyncio.shield(task)
+
+    def _generate(self, playlist, n, seed, joint, recommendations):
+        rng = random.Random(seed)
+        songs = generate_songs(playlist.run, n, rng, joint)
+        # Playlists loaded from a profile are served without the API
+        fetch_recommendations = recommendations and not playlist.offline
+        if fetch_recommendations:
+            playlist.run.candidate_pool.fill(songs)
+        closest_indices, _ = playlist.scoring_engine.top_k(songs, k=3)
+        results = []
+        for song, indices in zip(songs, closest_indices):
+            result = {
+                'key': song['key_name'],
+                'mode': song['mode_name'],
+                'tempo': song['tempo'],
+                'time_signature': song['time_signature'],
+                'energy': song['energy'],
+                'genre': song['genre'],
+                'progression': song['progression'],
+                'notes': song['notes'],
+                'closest': [
+                    {'name': track['name'], 'artist': track['artist']}
+                    for track in (playlist.scoring_engine.songs[index] for index in indices)
+                ],
+            }
+            if fetch_recommendations:
+                tracks = get_recommendations(
+                    song['tempo'], song['energy'], song['time_signature'],
+                    playlist.run.most_common_genre, playlist.run.candidate_pool,
+                )
+                result['recommendations'] = [
+                    {'id': track['id'], 'name': track['name'], 'artist': track['artists'][0]['name']} for track in tracks
+                ]
+            results.append(result)
+        return results
+
+    async def generate(self, playlist_id, n=10, seed=None, joint=False, recommendations=False):
+        """
+        Generate song ideas for a playlist.
+
+        Args:
+            playlist_id (str): The playlist's ID.
+            n (int): Number of songs.
+            seed (int): Random seed, for repeatable results.
+            joint (bool): Draw key, mode, tempo, time signature and energy from real track combinations.
+            recommendations (bool): Also find drum references among Spotify's recommendations.
+
+        Returns:
+            list: One JSON-serializable dictionary per song.
+        """
+        playlist = await self.playlist(playlist_id)
+        return await asyncio.to_thread(self._generate, playlist, n, seed, joint, recommendations)
+
+    def metrics(self):
+        """
+        Summarize the service's request latencies, warm playlists and outbound calls.
+
+        Returns:
+            dict: Latency per route, playlist cache counters and the instrumentation report.
+        """
+        return {
+            'requests': {route: histogram.to_dict() for route, histogram in sorted(self.latency.items())},
+            'playlists': {
+                'warm': len(self._playlists),
+                'loading': len(self._loading),
+                'hits': self.playlist_hits,
+                'loads': self.playlist_loads,
+            },
+            **instrumentation.report(),
+        }
 
+    def web_app(self):
+        """Build the aiohttp application that serves the service's routes."""
+
+        @web.middleware
+        async def timed(request, handler):
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                resource = request.match_info.route.resource
+                route = f'{request.method} {resource.canonical}' if resource is not None else 'unmatched'
+                histogram = self.latency.get(route)
+                if histogram is None:
+                    histogram = self.latency[route] = LatencyHistogram()
+                histogram.add(time.perf_counter() - start)
+
+        def flag(request, name):
+            return request.query.get(name, '').lower() in ('1', 'true', 'yes')
+
+        async def songs(request):
+            try:
+                n = int(request.query.get('n', 10))
+                seed = int(request.query['seed']) if 'seed' in request.query else None
+            except ValueError:
+                return web.json_response({'error': "n and seed must be integers"}, status=400)
+            if not 1 <= n <= SERVICE_MAX_SONGS:
+                return web.json_response({'error': f"n must be between 1 and {SERVICE_MAX_SONGS}"}, status=400)
+            playlist_id = request.match_info['playlist_id']
+            try:
+                results = await self.generate(playlist_id, n, seed, flag(request, 'joint'), flag(request, 'recommendations'))
+            except ValueError as e:
+                return web.json_response({'error': str(e)}, status=400)
+            except KeyError as e:
+                # Without credentials only playlists with a saved profile can be served
+                return web.json_response(
+                    {'error': f"Playlist {playlist_id} has no saved profile and Spotify credentials are not set ({e})"},
+                    status=503,
+                )
+            except requests.exceptions.RequestException as e:
+                return web.json_response({'error': f"Could not load playlist {playlist_id}: {e}"}, status=502)
+            return web.json_response({'playlist_id': playlist_id, 'songs': results})
+
+        async def metrics(request):
+            return web.json_response(self.metrics())
+
+        application = web.Application(middlewares=[timed])
+        application.router.add_get(SONGS_ROUTE, songs)
+        application.router.add_get('/metrics', metrics)
+        return application
+
+    async def start(self, host=SERVICE_HOST, port=SERVICE_PORT, socket_path=None):
+        """
+        Start serving on a TCP port, or on a Unix socket if socket_path is given.
+
+        Returns:
+            aiohttp.web.AppRunner: The runner; its `addresses` are where the service listens,
+                and cleanup() stops it.
+        """
+        runner = web.AppRunner(self.web_app(), access_log=None)
+        await runner.setup()
+        site = web.UnixSite(runner, socket_path) if socket_path else web.TCPSite(runner, host, port)
+        await site.start()
+        return runner
+
+
+async def _serve(service, host, port, socket_path, warm_playlists):
+    runner = await service.start(host, port, socket_path)
+    try:
+        print(f"Serving song generation on {', '.join(map(str, runner.addresses))}")
+        for playlist_id, outcome in zip(warm_playlists, await asyncio.gather(
+            *(service.playlist(playlist_id) for playlist_id in warm_playlists), return_exceptions=True,
+        )):
+            if isinstance(outcome, Exception):
+                print(f"Could not warm playlist {playlist_id}: {outcome}")
+            else:
+                print(f"Warmed playlist {playlist_id} ({outcome.run.total_songs} songs)")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, socket_path=None, profile_dir=None, warm_links=()):
+    """
+    Run the generation service until interrupted.
 
+    Clients ask for songs with GET /playlists/<playlist_id>/songs?n=10, optionally
+    with seed, joint=1 and recommendations=1, and read latency metrics from GET /metrics.
 
+    Args:
+        host (str): Interface to listen on.
+        port (int): TCP port to listen on.
+        socket_path (str): Listen on this Unix socket instead of a TCP port.
+        profile_dir (str): Directory of saved profiles (<playlist_id>.npz) to serve playlists from.
+        warm_links (list): Spotify playlist links to load before the first request.
+    """
+    # Everything a request needs is imported and authenticated up front, not on the first request
+    preload_modules()
+    try:
+        get_token_provider().get_token()
+    except (KeyError, requests.exceptions.RequestException) as e:
+        print(f"No Spotify token ({e!r}); only saved profiles can be served until one is available.")
+    warm_playlists = [parse_spotify_link(link)[1] for link in warm_links]
+    asyncio.run(_serve(GenerationService(profile_dir), host, port, socket_path, warm_playlists))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate song ideas from the profile of a Spotify playlist.")
+    parser.add_argument('--batch', metavar='FILE', help="profile every playlist link in FILE (one per line) instead of prompting for one")
+    parser.add_argument('--workers', type=int, default=4, help="playlists processed at once in batch mode (default: 4)")
+    parser.add_argument('--output-dir', default='profiles', help="directory for batch profiles (default: profiles)")
+    parser.add_argument('--playlist', metavar='LINK', help="Spotify playlist link, instead of prompting for one")
+    parser.add_argument('--bulk', type=int, metavar='N', help="sample N songs at once and write them to a manifest")
+    parser.add_argument('--seed', type=int, help="random seed for bulk generation")
+    parser.add_argument('--joint', action='store_true', help="sample key, mode, tempo, time signature and energy together from real tracks")
+    parser.add_argument('--manifest', default='manifest.npz', help="manifest path for bulk generation (default: manifest.npz)")
+    parser.add_argument('--render-dir', metavar='DIR', help="also render every bulk-generated song to a MIDI file in DIR")
+    parser.add_argument('--save-profile', metavar='FILE', help="save the playlist's profile to FILE (.npz) for offline generation")
+    parser.add_argument('--load-profile', metavar='FILE', help="generate from a profile saved with --save-profile, without network access")
+    parser.add_argument('--drums', action='store_true', help="download a drum reference from YouTube for every generated song")
+    parser.add_argument('--serve', action='store_true', help="run the generation service instead of generating once")
+    parser.add_argument('--host', default=SERVICE_HOST, help=f"interface the service listens on (default: {SERVICE_HOST})")
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help=f"port the service listens on (default: {SERVICE_PORT})")
+    parser.add_argument('--socket', metavar='PATH', help="serve on a Unix socket at PATH instead of a TCP port")
+    parser.add_argument('--profile-dir', metavar='DIR', help="serve playlists from profiles saved as DIR/<playlist_id>.npz when present")
+    parser.add_argument('--warm', metavar='LINK', action='append', default=[], help="playlist link the service loads at startup; repeatable")
+    parser.add_argument('--trace', metavar='FILE', help="write the run's call and stage timings to FILE as a JSON trace")
+    parser.add_argument('--profiler', choices=['cprofile', 'sampling'], help="profile the run with cProfile or the sampling profiler")
+    parser.add_argument('--profiler-output', metavar='FILE', help="write the profiler's results to FILE instead of stderr")
+    args = parser.parse_args()
+
+    try:
+        with profiling(args.profiler, args.profiler_output):
+            run(args)
+    finally:
+        if args.trace:
+            instrumentation.write_trace(args.trace)
+            print(f"Trace written to {args.trace}", file=sys.stderr)
+
+
+def run(args):
+    """Run the command line's service, batch, bulk or interactive mode."""
+    if args.serve:
+        serve(args.host, args.port, args.socket, args.profile_dir, args.warm)
+        return
+
+    if args.batch:
+        run_batch(read_playlist_links(args.batch), args.workers, args.output_dir)
+        return
+
+    if args.load_profile:
+        # Everything below runs from the saved profile; only recommendations need the API
+        playlist_run = load_profile(args.load_profile)
+        print(f"Loaded the profile of {playlist_run.total_songs} songs from {args.load_profile}")
+    else:
+        playlist_id = args.playlist or input(f'Enter Spotify playlist link: ')
+        playlist_type, playlist_id = parse_spotify_link(playlist_id)
+        if playlist_type != 'playlist':
+            raise ValueError("Only Spotify playlist links are supported.")
+        if args.bulk is None:
+            playlist_name = get_spotify().playlist(playlist_id)['name']
+            print(f"Fetching songs from playlist {playlist_name}...")
+        playlist_run = gather_data(playlist_id, verbose=args.bulk is None)
+        if args.save_profile:
+            save_profile(playlist_run, args.save_profile)
+            print(f"Profile of {playlist_run.total_songs} songs written to {args.save_profile}")
+
+    if args.bulk is not None:
+        manifest = generate_bulk(playlist_run.parameter_sampler, args.bulk, args.seed, args.joint)
+        save_manifest(manifest, args.manifest)
+        print(f"Manifest of {args.bulk} songs written to {args.manifest}")
+        if args.render_dir:
+            print(f"{render_manifest(manifest, args.render_dir)} MIDI files written to {args.render_dir}")
+        return
+
+    scoring_engine = ScoringEngine(playlist_run.snapshot)
+    generated_songs = generate_songs(playlist_run, 10)
+    if not args.load_profile:
+        # Fetch the recommendation candidates of every song up front; each song is then answered locally
+        playlist_run.candidate_pool.fill(generated_songs)
+
+    # Score every generated song against the playlist's audio features in one call
+    closest_indices, _ = scoring_engine.top_k(generated_songs, k=3)
+    # Render and write every song's MIDI file in one pass
+    write_midi_files(generated_songs)
+    drum_paths = {}
+    drum_analyses = {}
+    if args.drums:
+        drum_paths = get_drum_downloader().download_all([drum_query(song) for song in generated_songs])
+        # Tempo and meter come from the audio itself, so matching references to songs needs no API calls
+        drum_analyses = get_drum_analyzer().analyze_all([path for path in drum_paths.values() if path])
+
+    for i, generated_song in enumerate(generated_songs):
+        song_key = generated_song['key_name']
+        song_mode = generated_song['mode_name']
+        song_tempo = generated_song['tempo']
+        song_time_signature = generated_song['time_signature']
+        song_energy = generated_song['energy']
+        song_genre = generated_song['genre']
+        selected_progression = generated_song['progression']
+        if args.load_profile:
+            recommended_tracks = None  # Recommendations come from the API, which offline runs do not use
+        else:
+            recommended_tracks = get_recommendations(
+                song_tempo, song_energy, song_time_signature, playlist_run.most_common_genre, playlist_run.candidate_pool,
+            )
 
         print(f'Song {i+1}:')
         print(f'Key: {song_key} {song_mode}')
@@ -770,13 +3890,28 @@ if __name__ == '__main__':
         print(f'Energy: {song_energy}')
         print(f'Genre: {song_genre}')
         print(f'Chord Progression: {selected_progression}')
-        midi_filename = f"generated_song_{i+1}.mid"
-        generate_midi_file(song_key, selected_progression, midi_filename)
-        print(f"MIDI file generated: {midi_filename}")
+        print(f"MIDI file generated: {generated_song['filename']}")
+        if args.drums:
+            print(f"Drum reference: {drum_paths[drum_query(generated_song)] or 'none found'}")
+            ranked = rank_drum_references(drum_analyses, song_tempo, song_time_signature)
+            if ranked:
+                print(f"Closest drum references by tempo and meter:")
+                for j, (path, analysis) in enumerate(ranked[:3]):
+                    print(f"{j+1}. {path} ({analysis['tempo']:.1f} BPM, {analysis['time_signature']}/4)")
+        print(f"Closest songs in the playlist:")
+        for j, index in enumerate(closest_indices[i]):
+            track = scoring_engine.songs[index]
+            print(f"{j+1}. {track['name']} by {track['artist']}")
         print(f"Top songs to consider for drum inspiration from Spotify's library:")
         
-        if recommended_tracks:
+        if recommended_tracks is None:
+            print("Skipped: recommendations need the Spotify API.")
+        elif recommended_tracks:
             for j, track in enumerate(recommended_tracks):
                 print(f"{j+1}. {track['name']} by {track['artists'][0]['name']}")
         else:
             print("No recommendations found for this song.")
+
+
+if __name__ == '__main__':
+    main()
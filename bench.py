@@ -0,0 +1,671 @@
+"""
+Benchmarks for the app's pipeline against a local stand-in for the Spotify API.
+
+A stub server replays Spotify-shaped responses for synthetic playlists of 50,
+1k and 10k tracks, and stands in for YouTube search and audio downloads. For each playlist every stage of the pipeline is measured
+for wall time, peak Python memory and the number of HTTP calls per endpoint.
+`import app` is timed in fresh interpreters against an import-time budget, and
+the generation service's median warm request against a latency budget.
+Results can be saved as a baseline and later runs checked against it. HTTP
+call counts are deterministic and must not grow at all, and peak memory
+may only grow within a tolerance. Wall times are compared after dividing
+by a CPU calibration loop timed on the same machine, and only for stages
+slow enough to time reliably:
+
+    python bench.py --save-baseline
+    python bench.py --check
+"""
+import argparse
+import hashlib
+import json
+import os
+import py_compile
+import random
+import subprocess
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PLAYLIST_SIZES = [50, 1000, 10000]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+TIME_TOLERANCE = 2.0  # A stage regresses when its calibrated time is this many times its baseline's
+TIME_FLOOR = 0.1  # Seconds; stages faster than this in the (calibrated) baseline are too noisy to gate on time
+MEMORY_TOLERANCE = 1.25  # A stage regresses when its peak memory grows past this many times its baseline's
+MEMORY_SLACK = 1024 * 1024  # Bytes of peak memory growth that never count as a regression
+CALIBRATION_RUNS = 5  # Runs of the calibration loop; the fastest is used
+GENERATED_SONGS = 1000  # Generated songs scored against the playlist
+RENDERED_SONGS = 200  # Songs rendered to MIDI
+RECOMMENDATION_QUERIES = 10  # get_recommendations() calls, one per generated song
+DRUM_QUERIES = 20  # Generated songs whose drum references are downloaded
+DRUM_VIDEOS = 8  # Distinct videos the YouTube stand-in serves
+DRUM_VIDEO_SIZE = 2 * 1024 * 1024
+DRUM_CLICK_TRACKS = 6  # Synthetic drum recordings analyzed for tempo and meter
+DRUM_CLICK_SECONDS = 60
+IMPORT_TIME_BUDGET = 0.1  # Seconds `import app` may take in a fresh interpreter
+SERVICE_REQUESTS = 200  # Requests sent to the generation service once the playlist is warm
+SERVICE_CONCURRENCY = 8  # Requests in flight at once
+SERVICE_SONGS = 10  # Songs generated per request
+SERVICE_P50_BUDGET = 0.1  # Seconds the median warm request may take, end to end
+IMPORT_RUNS = 5  # Fresh interpreters timed; the fastest run is reported
+
+GENRES = ['pop', 'rock', 'rap', 'country', 'indie', 'jazz', 'edm', 'r&b', 'metal', 'folk']
+
+
+#fixtures
+def build_fixture(playlist_id, n_tracks, seed=0):
+    """
+    Build the Spotify responses of a synthetic playlist.
+
+    Returns:
+        dict: Track objects, artist objects and audio features, keyed like the API's responses.
+    """
+    rng = random.Random(f'{seed}-{playlist_id}')
+    n_artists = max(1, n_tracks // 5)  # Artists repeat, as in real playlists
+    artists = {
+        f'{playlist_id}a{i}': {'id': f'{playlist_id}a{i}', 'name': f'Artist {i}', 'genres': rng.sample(GENRES, rng.randint(0, 3))}
+        for i in range(n_artists)
+    }
+    artist_ids = list(artists)
+    tracks = []
+    features = {}
+    for i in range(n_tracks):
+        track_id = f'{playlist_id}t{i}'
+        artist_id = rng.choice(artist_ids)
+        tracks.append({
+            'id': track_id,
+            'name': f'Track {i}',
+            'artists': [{'id': artist_id, 'name': artists[artist_id]['name']}],
+            'album': {'name': f'Album {i // 10}', 'release_date': '2020-01-01'},
+            'popularity': rng.randint(0, 100),
+            'duration_ms': rng.randint(120000, 360000),
+        })
+        features[track_id] = {
+            'id': track_id,
+            'tempo': rng.uniform(60, 180),
+            'energy': round(rng.random(), 3),
+            'danceability': round(rng.random(), 3),
+            'valence': round(rng.random(), 3),
+            'loudness': rng.uniform(-20, 0),
+            'key': rng.randrange(12),
+            'mode': rng.randrange(2),
+            'time_signature': rng.choice([3, 4, 4, 4, 5]),
+            'duration_ms': tracks[-1]['duration_ms'],
+            'type': 'audio_features',
+            'uri': f'spotify:track:{track_id}',
+        }
+    return {'tracks': tracks, 'artists': artists, 'features': features}
+
+
+def write_click_track(path, tempo, beats_per_bar, seconds=DRUM_CLICK_SECONDS, sample_rate=44100):
+    """Write a stereo 16-bit WAV of clicks at tempo, with every bar's first click accented."""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 0.02, int(seconds * sample_rate))
+    t = np.arange(2000)
+    click = np.exp(-t / 200) * np.sin(2 * np.pi * 1000 * t / sample_rate)
+    for beat, start in enumerate(np.arange(0, seconds - 0.1, 60 / tempo)):
+        first = int(start * sample_rate)
+        audio[first:first + len(click)] += (1.0 if beat % beats_per_bar == 0 else 0.45) * click
+    pcm = (np.clip(audio, -1, 1) * 32000).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.repeat(pcm[:, None], 2, axis=1).tobytes())
+
+
+#stub server
+class StubSpotify:
+    """
+    Local HTTP stand-in for the accounts, Web API and YouTube endpoints the app uses.
+
+    It serves the fixtures of every registered playlist, counts the requests
+    it receives per endpoint and logs each request. API replies carry an
+    ETag and conditional requests for an unchanged body are answered with
+    304. Failures can be queued with fail(), so tests can exercise error
+    handling.
+    """
+
+    def __init__(self):
+        self.playlists = {}
+        self.artists = {}
+        self.features = {}
+        self.videos = {}
+        self.video_delay = 0.0  # Seconds each video download waits before answering, so downloads overlap
+        self.calls = Counter()
+        self.log = []  # (method, path, query, headers) of every request
+        self.failures = []  # (path prefix, status, headers) answered in order by matching requests
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_videos(self, n_videos, size):
+        """Serve n_videos synthetic audio files of size bytes; every search resolves to one of them."""
+        for i in range(n_videos):
+            video_id = f'drum{i:07d}'
+            self.videos[video_id] = random.Random(video_id).randbytes(size)
+
+    def add_playlist(self, playlist_id, fixture):
+        self.playlists[playlist_id] = fixture['tracks']
+        self.artists.update(fixture['artists'])
+        self.features.update(fixture['features'])
+
+    def count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def snapshot_calls(self):
+        with self._lock:
+            return Counter(self.calls)
+
+    def fail(self, path_prefix, status, times=1, headers=None):
+        """Answer the next `times` requests whose path starts with path_prefix with status instead."""
+        with self._lock:
+            self.failures.extend([(path_prefix, status, headers or {})] * times)
+
+    def take_failure(self, path):
+        """Return (status, headers) of the first queued failure matching path, removing it, or None."""
+        with self._lock:
+            for index, (prefix, status, headers) in enumerate(self.failures):
+                if path.startswith(prefix):
+                    del self.failures[index]
+                    return status, headers
+        return None
+
+    def requests_to(self, path_prefix):
+        """Return the logged (method, path, query, headers) of every request whose path starts with path_prefix."""
+        with self._lock:
+            return [entry for entry in self.log if entry[1].startswith(path_prefix)]
+
+    def respond(self, method, path, query):
+        """Return (status, body) for a request."""
+        parts = path.strip('/').split('/')
+        if method == 'POST' and parts == ['api', 'token']:
+            self.count('token')
+            return 200, {'access_token': 'stub-token', 'token_type': 'Bearer', 'expires_in': 3600}
+        if method != 'GET' or parts[0] != 'v1' or len(parts) < 2:
+            return 404, {'error': {'status': 404, 'message': 'Not found'}}
+
+        endpoint = parts[1]
+        self.count(endpoint)
+        ids = query.get('ids', [''])[0].split(',')
+        if endpoint == 'playlists' and len(parts) == 4 and parts[3] == 'tracks':
+            tracks = self.playlists.get(parts[2])
+            if tracks is None:
+                return 404, {'error': {'status': 404, 'message': 'Playlist not found'}}
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['100'])[0])
+            items = [{'track': track} for track in tracks[offset:offset + limit]]
+            return 200, {'items': items, 'total': len(tracks), 'offset': offset, 'limit': limit, 'next': None}
+        if endpoint == 'playlists' and len(parts) == 3:
+            return 200, {'id': parts[2], 'name': f'Playlist {parts[2]}'}
+        if endpoint == 'artists':
+            return 200, {'artists': [self.artists.get(artist_id) for artist_id in ids]}
+        if endpoint == 'audio-features':
+            return 200, {'audio_features': [self.features.get(track_id) for track_id in ids]}
+        if endpoint == 'recommendations':
+            limit = int(query.get('limit', ['20'])[0])
+            rng = random.Random(json.dumps(query, sort_keys=True))
+            track_ids = rng.sample(sorted(self.features), min(limit, len(self.features)))
+            return 200, {'tracks': [{'id': track_id, 'name': track_id, 'artists': [{'name': 'Stub'}]} for track_id in track_ids]}
+        return 404, {'error': {'status': 404, 'message': 'Not found'}}
+
+    def respond_youtube(self, path, query, headers):
+        """Return (status, content type, body, headers) for a YouTube request, or None for other paths."""
+        parts = path.strip('/').split('/')
+        if parts == ['results']:
+            self.count('youtube-search')
+            search = query.get('search_query', [''])[0]
+            video_ids = sorted(self.videos)
+            # Searches map to a few videos, so several songs share a download
+            video_id = video_ids[int(hashlib.md5(search.encode()).hexdigest(), 16) % len(video_ids)]
+            html = f'<html><body><a href="/watch?v={video_id}">{search}</a></body></html>'
+            return 200, 'text/html', html.encode(), {}
+        if len(parts) == 2 and parts[0] == 'videoplayback':
+            self.count('videoplayback')
+            if self.video_delay:
+                time.sleep(self.video_delay)
+            data = self.videos.get(parts[1])
+            if data is None:
+                return 404, 'text/plain', b'', {}
+            start = 0
+            if headers.get('Range', '').startswith('bytes='):
+                start = int(headers['Range'][len('bytes='):].split('-')[0])
+                if start >= len(data):
+                    return 416, 'text/plain', b'', {'Content-Range': f'bytes */{len(data)}'}
+                return 206, 'audio/webm', data[start:], {'Content-Range': f'bytes {start}-{len(data) - 1}/{len(data)}'}
+            return 200, 'audio/webm', data, {}
+        return None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                parts = urlsplit(self.path)
+                query = parse_qs(parts.query)
+                with stub._lock:
+                    stub.log.append((method, parts.path, query, dict(self.headers)))
+                failure = stub.take_failure(parts.path)
+                if failure is not None:
+                    status, headers = failure
+                    reply = status, 'application/json', json.dumps({'error': {'status': status}}).encode(), headers
+                else:
+                    reply = stub.respond_youtube(parts.path, query, self.headers)
+                if reply is None:
+                    status, body = stub.respond(method, parts.path, query)
+                    data = json.dumps(body).encode()
+                    headers = {}
+                    if status == 200:
+                        # Like the playlists endpoint, answer If-None-Match with 304 while the body is unchanged
+                        headers['ETag'] = f'"{hashlib.md5(data).hexdigest()}"'
+                        if self.headers.get('If-None-Match') == headers['ETag']:
+                            status, data = 304, b''
+                    reply = status, 'application/json', data, headers
+                status, content_type, data, headers = reply
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply('GET')
+
+            def do_POST(self):
+                self._reply('POST')
+
+        return Handler
+
+
+#generation service
+class ServiceThread:
+    """The app's GenerationService on an event loop of its own, listening on an ephemeral port."""
+
+    def __init__(self, app):
+        import asyncio
+        self.service = app.GenerationService()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._runner = None
+
+    def start(self):
+        import asyncio
+        self._thread.start()
+        self._runner = asyncio.run_coroutine_threadsafe(self.service.start('127.0.0.1', 0), self.loop).result()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+        return self
+
+    def stop(self):
+        import asyncio
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def request_songs(url, n_requests, concurrency):
+    """
+    Send n_requests generation requests, concurrency at a time.
+
+    Returns:
+        list: The end-to-end latency of every request, in seconds.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    local = threading.local()
+
+    def send(seed):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.get(url, params={'n': SERVICE_SONGS, 'seed': seed})
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, range(n_requests)))
+
+
+#measurement
+IMPORT_PROBE = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+'''
+
+
+def measure_import(deferred_modules, runs=IMPORT_RUNS):
+    """
+    Time `import app` in fresh interpreters without credentials, from an empty directory.
+
+    Returns:
+        dict: The fastest import time, the deferred modules it loaded and the files it created.
+    """
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    # Time loading the cached bytecode, not compiling a freshly edited app.py
+    py_compile.compile(os.path.join(app_dir, 'app.py'), doraise=True)
+    env = {name: value for name, value in os.environ.items() if not name.startswith('SPOTIFY_')}
+    timings = []
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', IMPORT_PROBE, app_dir, *deferred_modules],
+                cwd=cwd, env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            timings.append(json.loads(output))
+        created = sorted(os.listdir(cwd))
+    fastest = min(timings, key=lambda timing: timing['seconds'])
+    return {'seconds': round(fastest['seconds'], 4), 'loaded': fastest['loaded'], 'created': created}
+
+
+def measure(stub, stage, function):
+    """
+    Run one stage and record its wall time, peak traced memory and HTTP calls.
+
+    Returns:
+        tuple: (result of function, measurement dict).
+    """
+    calls_before = stub.snapshot_calls()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    calls = stub.snapshot_calls()
+    calls.subtract(calls_before)
+    return result, {
+        'stage': stage,
+        'seconds': round(elapsed, 4),
+        'peak_memory_bytes': peak,
+        'calls': {endpoint: count for endpoint, count in sorted(calls.items()) if count},
+    }
+
+
+def bench_playlist(app, stub, n_tracks, output_dir):
+    """Benchmark every pipeline stage against a playlist of n_tracks tracks."""
+    playlist_id = f'bench{n_tracks}'
+    stub.add_playlist(playlist_id, build_fixture(playlist_id, n_tracks))
+    # Start cold: nothing from earlier playlists may be served from the in-process caches
+    app.artist_genre_cache.clear()
+    app.audio_features_cache.clear()
+
+    results = []
+    run, result = measure(stub, 'gather_data', lambda: app.gather_data(playlist_id, verbose=False))
+    results.append(result)
+    # A second run is served by the response cache and should make almost no calls
+    _, result = measure(stub, 'gather_data_warm', lambda: app.gather_data(playlist_id, verbose=False))
+    results.append(result)
+
+    rng = random.Random(n_tracks)
+    samples = run.parameter_sampler.sample(GENERATED_SONGS, rng=rng)
+    key_indices = {note: index for index, note in app.key_dict.items()}
+    generated_songs = [
+        dict(parameters, key=key_indices[parameters['key']], mode=1 if parameters['mode'] == 'Major' else 0)
+        for parameters in samples
+    ]
+
+    def recommend():
+        songs = generated_songs[:RECOMMENDATION_QUERIES]
+        run.candidate_pool.fill(songs)
+        return [
+            app.get_recommendations(song['tempo'], song['energy'], song['time_signature'], run.most_common_genre, run.candidate_pool)
+            for song in songs
+        ]
+
+    _, result = measure(stub, 'get_recommendations', recommend)
+    results.append(result)
+
+    def score():
+        return app.ScoringEngine(run.snapshot).top_k(generated_songs, k=3)
+
+    _, result = measure(stub, 'scoring', score)
+    results.append(result)
+
+    def render():
+        songs = []
+        for i, parameters in enumerate(samples[:RENDERED_SONGS]):
+            mode = parameters['mode']
+            progressions = app.major_chord_progressions if mode.endswith('Major') else app.minor_chord_progressions
+            songs.append({
+                'notes': app.resolve_progression(parameters['key'], progressions[i % len(progressions)], mode),
+                'tempo': parameters['tempo'],
+                'time_signature': parameters['time_signature'],
+                'filename': f'bench_{i + 1}.mid',
+            })
+        return app.write_midi_files(songs, output_dir)
+
+    _, result = measure(stub, 'midi_render', render)
+    results.append(result)
+
+    drum_cache = os.path.join(output_dir, 'drums')
+    queries = [app.drum_query(song) for song in generated_songs[:DRUM_QUERIES]]
+
+    def download_drums():
+        downloader = app.DrumDownloader(
+            drum_cache, search_url=f'{stub.url}/results',
+            resolve_stream=lambda video_id: (f'{stub.url}/videoplayback/{video_id}', '.webm'),
+        )
+        return downloader.download_all(queries)
+
+    _, result = measure(stub, 'drum_downloads', download_drums)
+    results.append(result)
+    # A new downloader over the same cache only searches again
+    _, result = measure(stub, 'drum_downloads_warm', download_drums)
+    results.append(result)
+
+    click_dir = os.path.join(output_dir, 'clicks')
+    os.makedirs(click_dir, exist_ok=True)
+    click_paths = []
+    for i, song in enumerate(generated_songs[:DRUM_CLICK_TRACKS]):
+        beats_per_bar = 3 if song['time_signature'] == 3 else 4
+        click_paths.append(os.path.join(click_dir, f'click_{i}.wav'))
+        write_click_track(click_paths[-1], song['tempo'], beats_per_bar)
+
+    def analyze_drums():
+        return app.DrumAnalyzer(os.path.join(output_dir, 'analysis')).analyze_all(click_paths)
+
+    _, result = measure(stub, 'drum_analysis', analyze_drums)
+    results.append(result)
+    # A new analyzer over the same cache reads the stored results
+    _, result = measure(stub, 'drum_analysis_warm', analyze_drums)
+    results.append(result)
+
+    service = ServiceThread(app).start()
+    try:
+        songs_url = f'{service.url}/playlists/{playlist_id}/songs'
+        # The first request loads the playlist, from the response cache after gather_data above
+        _, result = measure(stub, 'service_load', lambda: request_songs(songs_url, 1, 1))
+        results.append(result)
+        _, result = measure(
+            stub, 'service_generate', lambda: request_songs(songs_url, SERVICE_REQUESTS, SERVICE_CONCURRENCY),
+        )
+        # Latencies are taken again outside measure(), whose memory tracing slows every request down
+        result['p50_seconds'] = round(statistics.median(request_songs(songs_url, SERVICE_REQUESTS, SERVICE_CONCURRENCY)), 4)
+        results.append(result)
+    finally:
+        service.stop()
+    return results
+
+
+def calibrate(runs=CALIBRATION_RUNS):
+    """
+    Time a fixed CPU-bound workload, the fastest of several runs.
+
+    Stage times are compared with the baseline in units of this time, so a
+    slower or busier machine does not look like a regression.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        rng = random.Random(0)
+        values = sorted(rng.random() for _ in range(200000))
+        json.loads(json.dumps(values[:50000]))
+        hashlib.sha256(bytes(8 * 1024 * 1024)).digest()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def compare(results, baseline, tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE, calibration=None):
+    """
+    Return a description of every stage that regressed against the baseline.
+
+    Args:
+        results (dict): Stage measurements per playlist size, as returned by bench_playlist().
+        baseline (dict): A saved baseline: its 'calibration_seconds' and its 'results'.
+        tolerance (float): Allowed slowdown factor of calibrated wall times.
+        memory_tolerance (float): Allowed growth factor of peak memory.
+        calibration (float): calibrate() on this machine; without it, times are compared as measured.
+    """
+    scale = calibration / baseline['calibration_seconds'] if calibration else 1.0
+    regressions = []
+    for size, stages in results.items():
+        baseline_stages = {stage['stage']: stage for stage in baseline['results'].get(size, [])}
+        for stage in stages:
+            expected = baseline_stages.get(stage['stage'])
+            if expected is None:
+                continue
+            name = f"{size} tracks, {stage['stage']}"
+            for endpoint, count in stage['calls'].items():
+                if count > expected['calls'].get(endpoint, 0):
+                    regressions.append(f"{name}: {count} {endpoint} calls, baseline {expected['calls'].get(endpoint, 0)}")
+            memory_limit = expected['peak_memory_bytes'] * memory_tolerance + MEMORY_SLACK
+            if stage['peak_memory_bytes'] > memory_limit:
+                regressions.append(
+                    f"{name}: peak {stage['peak_memory_bytes'] / 2 ** 20:.1f} MiB, "
+                    f"baseline {expected['peak_memory_bytes'] / 2 ** 20:.1f} MiB"
+                )
+            expected_seconds = expected['seconds'] * scale
+            if expected_seconds >= TIME_FLOOR and stage['seconds'] > expected_seconds * tolerance:
+                regressions.append(
+                    f"{name}: {stage['seconds']:.3f}s, baseline {expected['seconds']:.3f}s "
+                    f"({expected_seconds:.3f}s calibrated to this machine)"
+                )
+    return regressions
+
+
+def print_results(results):
+    print(f"{'tracks':>7}  {'stage':<20} {'seconds':>9} {'peak MiB':>9}  calls")
+    for size, stages in results.items():
+        for stage in stages:
+            calls = ', '.join(f'{endpoint}={count}' for endpoint, count in stage['calls'].items()) or '-'
+            print(f"{size:>7}  {stage['stage']:<20} {stage['seconds']:>9.3f} {stage['peak_memory_bytes'] / 2 ** 20:>9.1f}  {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against a local Spotify stand-in.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=PLAYLIST_SIZES, help="playlist sizes (default: 50 1000 10000)")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file (default: bench_baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--check', action='store_true', help="exit with status 1 if any stage regressed against the baseline")
+    parser.add_argument('--tolerance', type=float, default=TIME_TOLERANCE, help="allowed slowdown factor of calibrated times (default: 2.0)")
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE, help="allowed peak memory growth factor (default: 1.25)")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--import-budget', type=float, default=IMPORT_TIME_BUDGET, help="seconds `import app` may take (default: 0.1)")
+    parser.add_argument('--service-budget', type=float, default=SERVICE_P50_BUDGET, help="seconds the median warm service request may take (default: 0.1)")
+    args = parser.parse_args()
+
+    stub = StubSpotify().start()
+    stub.add_videos(DRUM_VIDEOS, DRUM_VIDEO_SIZE)
+    workdir = tempfile.TemporaryDirectory()
+    # Point the app at the stub before importing it, with a fresh cache and no pacing
+    os.environ.update({
+        'SPOTIFY_CLIENT_ID': 'bench',
+        'SPOTIFY_CLIENT_SECRET': 'bench',
+        'SPOTIFY_TOKEN_URL': f'{stub.url}/api/token',
+        'SPOTIFY_API_BASE_URL': f'{stub.url}/v1',
+        'SPOTIFY_CACHE_PATH': os.path.join(workdir.name, 'cache.sqlite'),
+        'SPOTIFY_CHECKPOINT_DIR': os.path.join(workdir.name, 'checkpoints'),
+        'SPOTIFY_RATE_LIMIT': '1000000',
+        'SPOTIFY_RATE_BURST': '1000000',
+    })
+    import app
+
+    import_result = measure_import(app.DEFERRED_MODULES)
+    print(f"import app: {import_result['seconds'] * 1000:.1f} ms (budget {args.import_budget * 1000:.0f} ms)")
+    budget_problems = []
+    if import_result['seconds'] > args.import_budget:
+        budget_problems.append(f"import app took {import_result['seconds']:.3f}s, budget {args.import_budget:.3f}s")
+    if import_result['loaded']:
+        budget_problems.append(f"import app loaded {', '.join(import_result['loaded'])}")
+    if import_result['created']:
+        budget_problems.append(f"import app created {', '.join(import_result['created'])}")
+
+    # Stages measure the pipeline, not the one-time import of its dependencies
+    app.preload_modules()
+    calibration = calibrate()
+    print(f"calibration: {calibration * 1000:.1f} ms")
+
+    try:
+        results = {
+            str(size): bench_playlist(app, stub, size, os.path.join(workdir.name, f'midi{size}'))
+            for size in args.sizes
+        }
+    finally:
+        stub.stop()
+        workdir.cleanup()
+
+    print_results(results)
+    for size, stages in results.items():
+        for stage in stages:
+            if 'p50_seconds' not in stage:
+                continue
+            print(f"{size} tracks, {stage['stage']}: p50 {stage['p50_seconds'] * 1000:.1f} ms (budget {args.service_budget * 1000:.0f} ms)")
+            if stage['p50_seconds'] > args.service_budget:
+                budget_problems.append(f"{size} tracks, {stage['stage']}: p50 {stage['p50_seconds']:.3f}s, budget {args.service_budget:.3f}s")
+    report = {'calibration_seconds': round(calibration, 4), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    if args.check:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = budget_problems + compare(results, baseline, args.tolerance, args.memory_tolerance, calibration)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
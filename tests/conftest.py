@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+# app.py and bench.py live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import StubSpotify, build_fixture  # noqa: E402
+
+
+class FakeTokens:
+    """Token source standing in for TokenProvider; every invalidation issues a new token."""
+
+    def __init__(self, token='test-token'):
+        self.token = token
+        self.invalidated = []
+
+    def get_token(self):
+        return self.token
+
+    def invalidate(self, token=None):
+        self.invalidated.append(token)
+        self.token = f'test-token-{len(self.invalidated)}'
+
+
+@pytest.fixture
+def stub():
+    """A running StubSpotify serving a 250-track playlist 'p250'."""
+    server = StubSpotify().start()
+    server.add_playlist('p250', build_fixture('p250', 250))
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def tokens():
+    return FakeTokens()
@@ -0,0 +1,37 @@
+import json
+
+import app
+
+
+def profiled_run(playlist_id):
+    profile = app.PlaylistProfile([playlist_id])
+    profile.add({
+        'key': 0, 'mode': 1, 'tempo': 120.0, 'energy': 0.5, 'duration_ms': 200000, 'time_signature': 4, 'genre': ['pop'],
+    })
+    return app.PlaylistRun(playlist_id, app.PlaylistSnapshot(playlist_id, app.TrackStore()), profile)
+
+
+def test_a_failing_playlist_does_not_abort_the_batch(monkeypatch, tmp_path, capsys):
+    def gather_data(playlist_id, verbose=True):
+        if playlist_id == 'broken':
+            raise KeyError('SPOTIFY_CLIENT_ID')
+        return profiled_run(playlist_id)
+
+    monkeypatch.setattr(app, 'gather_data', gather_data)
+    links = [
+        'https://open.spotify.com/playlist/first',
+        'https://open.spotify.com/playlist/broken',
+        'https://open.spotify.com/album/not-a-playlist',
+        'https://open.spotify.com/playlist/second?si=abc',
+    ]
+
+    runs, merged = app.run_batch(links, workers=2, output_dir=str(tmp_path))
+
+    assert sorted(run.playlist_id for run in runs) == ['first', 'second']
+    assert merged['songs'] == 2
+    with open(tmp_path / 'merged.json', encoding='utf-8') as f:
+        assert json.load(f)['songs'] == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['first.json', 'merged.json', 'second.json']
+    output = capsys.readouterr().out
+    assert "Failed to profile playlist broken" in output
+    assert "not-a-playlist" in output
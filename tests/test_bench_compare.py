@@ -0,0 +1,39 @@
+import bench
+
+
+def stage(name, seconds, memory=10 * 2 ** 20, **calls):
+    return {'stage': name, 'seconds': seconds, 'peak_memory_bytes': memory, 'calls': calls}
+
+
+BASELINE = {
+    'calibration_seconds': 0.2,
+    'results': {'50': [stage('gather_data', 0.5, playlists=1), stage('scoring', 0.01)]},
+}
+
+
+def test_matching_results_pass():
+    assert bench.compare({'50': [stage('gather_data', 0.5, playlists=1), stage('scoring', 0.01)]}, BASELINE) == []
+
+
+def test_extra_calls_always_regress():
+    regressions = bench.compare({'50': [stage('gather_data', 0.5, playlists=2)]}, BASELINE)
+
+    assert regressions == ["50 tracks, gather_data: 2 playlists calls, baseline 1"]
+
+
+def test_peak_memory_growth_regresses():
+    regressions = bench.compare({'50': [stage('scoring', 0.01, memory=20 * 2 ** 20)]}, BASELINE)
+
+    assert len(regressions) == 1 and 'peak 20.0 MiB' in regressions[0]
+
+
+def test_times_are_compared_after_calibration():
+    slower = {'50': [stage('gather_data', 1.5, playlists=1)]}
+
+    assert bench.compare(slower, BASELINE, calibration=0.2)
+    # The same stage on a machine three times slower is not a regression
+    assert bench.compare(slower, BASELINE, calibration=0.6) == []
+
+
+def test_stages_below_the_time_floor_are_not_timed():
+    assert bench.compare({'50': [stage('scoring', 0.05)]}, BASELINE, calibration=0.2) == []
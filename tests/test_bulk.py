@@ -0,0 +1,58 @@
+import sys
+
+import pytest
+
+import app
+from test_profile import random_songs
+
+
+def offline_failure(*args, **kwargs):
+    raise AssertionError("bulk generation from a saved profile must not use the network")
+
+
+@pytest.fixture
+def saved_profile(tmp_path):
+    songs = random_songs(500)
+    for i, song in enumerate(songs):
+        song.update(id=f't{i}', name=f'Track {i}', artist='Artist', position=i)
+    profile = app.PlaylistProfile(['p'])
+    for song in songs:
+        profile.add(song)
+    run = app.PlaylistRun('p', app.PlaylistSnapshot('p', app.TrackStore.from_songs(songs)), profile)
+    path = str(tmp_path / 'profile.npz')
+    app.save_profile(run, path)
+    return path
+
+
+def test_bulk_energies_are_the_profiles_values(saved_profile):
+    sampler = app.load_profile(saved_profile).parameter_sampler
+
+    for joint in (False, True):
+        manifest = app.generate_bulk(sampler, 2000, seed=3, joint=joint)
+        assert manifest['energy'].dtype == 'float64'
+        assert set(manifest['energy'].tolist()) <= set(sampler.energies.values)
+
+
+def test_bulk_is_repeatable_with_a_seed(saved_profile):
+    sampler = app.load_profile(saved_profile).parameter_sampler
+
+    first = app.generate_bulk(sampler, 100, seed=7)
+    second = app.generate_bulk(sampler, 100, seed=7)
+
+    assert all((first[name] == second[name]).all() for name in first)
+
+
+def test_bulk_mode_runs_offline_from_a_saved_profile(saved_profile, tmp_path, monkeypatch):
+    for name in ('gather_data', 'get_token_provider', 'get_spotify_client', 'get_spotify'):
+        monkeypatch.setattr(app, name, offline_failure)
+    manifest_path = str(tmp_path / 'manifest.npz')
+    monkeypatch.setattr(sys, 'argv', [
+        'app.py', '--load-profile', saved_profile, '--bulk', '50', '--seed', '1', '--manifest', manifest_path,
+        '--render-dir', str(tmp_path / 'midi'),
+    ])
+
+    app.main()
+
+    manifest = app.load_manifest(manifest_path)
+    assert len(manifest['key']) == 50
+    assert len(list((tmp_path / 'midi').iterdir())) == 50
@@ -0,0 +1,85 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('numeral, mode, notes', [
+    ('I', 'Major', (60, 64, 67)),
+    ('i', 'Minor', (60, 63, 67)),
+    # Unaltered numerals follow the mode's scale: VI is A in C major but Ab in C minor
+    ('VI', 'Major', (69, 73, 76)),
+    ('VI', 'Minor', (68, 72, 75)),
+    ('III', 'Minor', (63, 67, 70)),
+    ('V7', 'Major', (67, 71, 74, 77)),
+    ('vii°', 'Major', (71, 74, 77)),
+])
+def test_numerals_follow_the_mode(numeral, mode, notes):
+    assert app.chord_notes('C', numeral, mode) == notes
+
+
+@pytest.mark.parametrize('mode', app.MODES)
+def test_flat_numerals_are_relative_to_the_major_scale(mode):
+    assert app.chord_notes('C', 'bVII', mode) == (70, 74, 77)
+    assert app.chord_notes('C', 'bVI', mode) == (68, 72, 75)
+    assert app.chord_notes('C', 'bIII', mode) == (63, 67, 70)
+    assert app.chord_notes('C', '#iv°', mode) == (66, 69, 72)
+
+
+def test_keys_transpose_the_chord():
+    assert app.chord_notes('Eb', 'I') == (63, 67, 70)
+    assert app.chord_notes('C♯/D♭', 'I') == (61, 65, 68)
+
+
+@pytest.mark.parametrize('alias, canonical', [
+    ('ii˚', 'ii°'),
+    ('iio', 'ii°'),
+    ('ii˚7', 'ii°7'),
+    ('iiø', 'iiø7'),
+    ('iiø7', 'iiø7'),
+])
+def test_aliases_are_normalized(alias, canonical):
+    assert app.normalize_numeral(alias) == canonical
+    assert app.chord_notes('C', alias, 'Minor') == app.chord_notes('C', canonical, 'Minor')
+
+
+def test_diminished_aliases_are_not_silent():
+    assert app.chord_notes('C', 'ii˚', 'Minor') == (62, 65, 68)
+    assert app.chord_notes('C', 'iiø', 'Minor') == (62, 65, 68, 72)
+
+
+@pytest.mark.parametrize('numeral', ['VIII', 'Isus4', 'x', 'IIm', ''])
+def test_unknown_numerals_raise(numeral):
+    with pytest.raises(ValueError):
+        app.chord_notes('C', numeral)
+
+
+def test_unknown_key_raises():
+    with pytest.raises(ValueError):
+        app.chord_notes('H', 'I')
+
+
+def test_progression_fails_on_the_first_unknown_numeral():
+    with pytest.raises(ValueError, match="'IX'"):
+        app.resolve_progression('C', ['I', 'IX', 'V'])
+
+
+@pytest.mark.parametrize('inversion, notes', [
+    (0, (60, 64, 67)),
+    (1, (64, 67, 72)),
+    (2, (67, 72, 76)),
+    (3, (60, 64, 67)),
+])
+def test_inversions_move_the_lowest_notes_up_an_octave(inversion, notes):
+    assert app.voice_chord((60, 64, 67), inversion) == notes
+    assert app.chord_notes('C', 'I', inversion=inversion) == notes
+
+
+def test_open_voicing_drops_the_second_highest_note():
+    assert app.voice_chord((60, 64, 67), voicing='open') == (52, 60, 67)
+    assert app.voice_chord((60, 64, 67, 71), voicing='open') == (55, 60, 64, 71)
+    assert app.chord_notes('C', 'I', inversion=1, voicing='open') == (55, 64, 72)
+
+
+def test_unknown_voicing_raises():
+    with pytest.raises(ValueError):
+        app.voice_chord((60, 64, 67), voicing='spread')
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def downloader(stub, tmp_path):
+    stub.add_videos(2, 64 * 1024)
+    return app.DrumDownloader(
+        str(tmp_path), search_url=f'{stub.url}/results',
+        resolve_stream=lambda video_id: (f'{stub.url}/videoplayback/{video_id}', '.webm'),
+    )
+
+
+def write_partial(downloader, video_id, data):
+    os.makedirs(os.path.join(downloader.cache_dir, 'partial'), exist_ok=True)
+    with open(os.path.join(downloader.cache_dir, 'partial', f'{video_id}.part'), 'wb') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_partial_download_resumes_with_range(stub, downloader):
+    video_id = 'drum0000000'
+    data = stub.videos[video_id]
+    write_partial(downloader, video_id, data[:20000])
+
+    path = downloader.fetch(video_id)
+
+    (_, _, _, headers), = stub.requests_to(f'/videoplayback/{video_id}')
+    assert headers['Range'] == 'bytes=20000-'
+    assert read(path) == data
+    assert os.path.basename(path) == hashlib.sha256(data).hexdigest() + '.webm'
+    assert downloader.cached_path(video_id) == path
+
+
+def test_range_not_satisfiable_means_the_partial_file_is_complete(stub, downloader):
+    video_id = 'drum0000001'
+    data = stub.videos[video_id]
+    write_partial(downloader, video_id, data)
+
+    path = downloader.fetch(video_id)
+
+    (_, _, _, headers), = stub.requests_to(f'/videoplayback/{video_id}')
+    assert headers['Range'] == f'bytes={len(data)}-'
+    assert read(path) == data
+    assert os.path.basename(path) == hashlib.sha256(data).hexdigest() + '.webm'
+
+
+def test_concurrent_fetches_of_one_video_share_a_download(stub, downloader):
+    stub.video_delay = 0.2
+    video_id = 'drum0000000'
+    barrier = threading.Barrier(4)
+    paths = []
+
+    def fetch():
+        barrier.wait()
+        paths.append(downloader.fetch(video_id))
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(paths) == 4 and len(set(paths)) == 1
+    assert read(paths[0]) == stub.videos[video_id]
+    assert stub.snapshot_calls()['videoplayback'] == 1
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import app
+
+
+def test_gather_data_times_fetching_and_aggregation_apart(stub, tokens, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app.get_spotify_client, 'instance', app.SpotifyClient(tokens, api_base=f'{stub.url}/v1'))
+    monkeypatch.setattr(app, 'get_access_token', tokens.get_token)
+    app.instrumentation.reset()
+
+    run = app.gather_data('p250', verbose=False)
+
+    assert run.total_songs == 250
+    stages = app.instrumentation.report()['stages']
+    assert stages['gather']['count'] == 1
+    assert stages['aggregation']['count'] == 1
+
+
+@pytest.fixture
+def gather_client(stub, tokens, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    client = app.SpotifyClient(tokens, api_base=f'{stub.url}/v1')
+    monkeypatch.setattr(app.get_spotify_client, 'instance', client)
+    monkeypatch.setattr(app, 'get_access_token', tokens.get_token)
+    monkeypatch.setattr(app, 'artist_genre_cache', app.LRUCache(1000))
+    monkeypatch.setattr(app, 'audio_features_cache', app.LRUCache(1000))
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    yield client
+    client.close()
+
+
+def test_failed_attempt_resumes_from_the_checkpoint(stub, gather_client, capsys):
+    stub.fail('/v1/audio-features', 400)
+
+    run = app.gather_data('p250', verbose=False)
+
+    assert 'Retrying' in capsys.readouterr().out
+    positions = run.snapshot.songs.column('position').tolist()
+    assert positions == list(range(1, 251))
+    assert run.total_songs == 250
+    assert sum(run.profile.key_counts.values()) == 250
+    # Only the first page is requested again, to check the playlist's size
+    offsets = [query.get('offset', ['0'])[0] for _, _, query, _ in stub.requests_to('/v1/playlists/p250/tracks')]
+    assert sorted(offsets) == ['0', '0', '100', '200']
+    assert not os.path.exists(os.path.join('.checkpoints', 'p250.jsonl'))
+
+
+def test_torn_checkpoint_line_does_not_hide_later_records(tmp_path):
+    checkpoint = app.PlaylistCheckpoint('p', str(tmp_path))
+    checkpoint.start(300)
+    checkpoint.page_done(0, [{'id': 't0'}])
+    with open(checkpoint.path, 'a', encoding='utf-8') as f:
+        f.write('{"page": 100, "son')  # A crash in the middle of a write
+
+    resumed = app.PlaylistCheckpoint('p', str(tmp_path))
+    resumed.start(300)
+    resumed.page_done(100, [{'id': 't100'}])
+    resumed.page_done(200, [{'id': 't200'}])
+
+    assert sorted(app.PlaylistCheckpoint('p', str(tmp_path)).pages) == [0, 100, 200]
+
+
+def test_memoized_metadata_stays_bounded_and_trimmed(stub, gather_client, monkeypatch):
+    monkeypatch.setattr(app, 'artist_genre_cache', app.LRUCache(20))
+    monkeypatch.setattr(app, 'audio_features_cache', app.LRUCache(120))
+
+    run = app.gather_data('p250', verbose=False)
+
+    assert run.total_songs == 250
+    assert len(app.artist_genre_cache) <= 20
+    assert len(app.audio_features_cache) == 120
+    features = app.audio_features_cache.get_many(['p250t249'])['p250t249']
+    assert set(features) <= set(app.AUDIO_FEATURE_FIELDS)
+
+
+def test_lru_cache_drops_the_least_recently_used_entry():
+    cache = app.LRUCache(2)
+    cache.update({'a': 1, 'b': 2})
+    cache.get_many(['a'])
+    cache.update({'c': 3})
+
+    assert cache.get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
@@ -0,0 +1,54 @@
+import sys
+import threading
+import time
+
+import app
+
+
+def test_lazy_singleton_creates_one_instance_for_concurrent_callers():
+    created = []
+
+    @app.LazySingleton
+    def get_thing():
+        """Return the thing."""
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_thing())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(result is created[0] for result in results)
+    assert get_thing.__doc__ == "Return the thing."
+
+
+def test_lazy_singleton_retries_after_a_failed_creation():
+    attempts = []
+
+    @app.LazySingleton
+    def get_thing():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise KeyError('SPOTIFY_CLIENT_ID')
+        return 'thing'
+
+    try:
+        get_thing()
+    except KeyError:
+        pass
+    assert get_thing() == 'thing'
+    assert get_thing.instance == 'thing'
+
+
+def test_lazy_module_imports_on_first_attribute_access(monkeypatch):
+    monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+    colorsys = app.LazyModule('colorsys')
+    assert 'colorsys' not in sys.modules
+
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert 'colorsys' in sys.modules
@@ -0,0 +1,47 @@
+import io
+
+import mido
+import pytest
+
+import app
+
+NOTES = [[60, 64, 67], [65, 69, 72]]
+
+
+def meta_messages(data):
+    (track,) = mido.MidiFile(file=io.BytesIO(data)).tracks
+    return {message.type: message for message in track if message.is_meta}
+
+
+def test_tempo_and_time_signature_are_written():
+    messages = meta_messages(app.render_midi(NOTES, tempo=90, time_signature=3))
+
+    assert messages['set_tempo'].tempo == mido.bpm2tempo(90)
+    assert messages['time_signature'].numerator == 3
+    assert messages['time_signature'].denominator == 4
+
+
+@pytest.mark.parametrize('tempo', [0, 0.0, -5, float('nan')])
+def test_missing_tempo_falls_back_to_the_default(tempo):
+    messages = meta_messages(app.render_midi(NOTES, tempo=tempo))
+
+    assert messages['set_tempo'].tempo == mido.bpm2tempo(app.DEFAULT_TEMPO)
+
+
+def test_very_slow_tempo_is_clamped():
+    messages = meta_messages(app.render_midi(NOTES, tempo=1))
+
+    assert messages['set_tempo'].tempo == app.MAX_MIDI_TEMPO
+
+
+def test_one_song_without_tempo_does_not_abort_the_pass(tmp_path):
+    songs = [
+        {'notes': NOTES, 'tempo': tempo, 'time_signature': 4, 'filename': f'song{i}.mid'}
+        for i, tempo in enumerate([120, 0.0, 95])
+    ]
+
+    paths = app.write_midi_files(songs, str(tmp_path))
+
+    assert len(paths) == 3
+    with open(paths[2], 'rb') as f:
+        assert meta_messages(f.read())['set_tempo'].tempo == mido.bpm2tempo(95)
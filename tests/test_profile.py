@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+import app
+
+
+def random_songs(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            'key': rng.randrange(12), 'mode': rng.randrange(2), 'tempo': rng.uniform(60, 180),
+            # Spotify reports energies to three decimals
+            'energy': round(rng.random(), 3),
+            'duration_ms': rng.randint(120000, 360000), 'time_signature': rng.choice([3, 4]),
+            'genre': rng.sample(['pop', 'rock', 'jazz'], rng.randint(0, 2)),
+        }
+        for _ in range(n)
+    ]
+
+
+def test_energies_are_counted_as_reported():
+    songs = random_songs(20000)
+    profile = app.PlaylistProfile(['p'])
+    for song in songs:
+        profile.add(song)
+
+    # Spotify reports energies to three decimals, which bounds the histogram by itself
+    assert len(profile.energy_counts) <= 1001
+    assert set(profile.energy_counts) == {song['energy'] for song in songs}
+    assert {key[4] for key in profile.track_parameter_counts} == {song['energy'] for song in songs}
+    assert profile.energy.mean == pytest.approx(sum(song['energy'] for song in songs) / len(songs))
+
+
+def test_sampled_energies_are_real_track_energies():
+    songs = random_songs(500, seed=3)
+    profile = app.PlaylistProfile(['p'])
+    for song in songs:
+        profile.add(song)
+
+    energies = {song['energy'] for song in songs}
+    samples = profile.sampler().sample(200, rng=random.Random(0))
+
+    assert all(sample['energy'] in energies for sample in samples)
+
+
+def test_merged_shards_match_one_pass():
+    songs = random_songs(3000, seed=1)
+    whole = app.PlaylistProfile(['p'])
+    shards = [app.PlaylistProfile(['p']) for _ in range(3)]
+    for i, song in enumerate(songs):
+        whole.add(song)
+        shards[i % 3].add(song)
+
+    merged = shards[0].merge(shards[1]).merge(shards[2])
+
+    assert merged.energy_counts == whole.energy_counts
+    assert merged.track_parameter_counts == whole.track_parameter_counts
+    assert merged.tempo.mean == pytest.approx(whole.tempo.mean)
+    assert merged.tempo.variance == pytest.approx(whole.tempo.variance)
+
+
+def test_add_store_matches_adding_each_song():
+    songs = random_songs(5000, seed=2)
+    by_row = app.PlaylistProfile(['p'])
+    for song in songs:
+        by_row.add(song)
+
+    by_column = app.PlaylistProfile(['p'])
+    by_column.add_store(app.TrackStore.from_songs(songs))
+
+    for name in ('key_counts', 'mode_counts', 'time_signature_counts', 'bpm_counts', 'energy_counts',
+                 'genre_counts', 'track_parameter_counts'):
+        assert list(getattr(by_column, name).items()) == list(getattr(by_row, name).items()), name
+    for name in ('tempo', 'energy', 'duration_ms'):
+        assert getattr(by_column, name).count == getattr(by_row, name).count
+        assert getattr(by_column, name).mean == pytest.approx(getattr(by_row, name).mean)
+        assert getattr(by_column, name).variance == pytest.approx(getattr(by_row, name).variance)
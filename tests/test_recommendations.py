@@ -0,0 +1,41 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def spotify(stub, tokens, monkeypatch):
+    client = app.SpotifyClient(tokens, api_base=f'{stub.url}/v1')
+    monkeypatch.setattr(app.get_spotify_client, 'instance', client)
+    monkeypatch.setattr(app, 'get_access_token', tokens.get_token)
+    monkeypatch.setattr(app, 'audio_features_cache', app.LRUCache(1000))
+    yield client
+    client.close()
+
+
+def test_recommendations_without_a_pool_make_one_request_per_song(stub, spotify):
+    tracks = app.get_recommendations(120.0, 0.5, 4, 'pop')
+
+    (_, _, query, _), = stub.requests_to('/v1/recommendations')
+    assert query['limit'] == ['50']
+    assert 'target_time_signature' not in query
+    assert query['seed_genres'] == ['pop,pop,rap,rock,country']
+    energies = [abs(stub.features[track['id']]['energy'] - 0.5) for track in tracks]
+    assert energies == sorted(energies)
+    assert all(stub.features[track['id']]['time_signature'] == 4 for track in tracks)
+
+
+def test_pool_is_filled_before_songs_are_answered(stub, spotify):
+    songs = [
+        {'tempo': 90.0 + i, 'energy': 0.5, 'time_signature': time_signature}
+        for i, time_signature in enumerate([4, 4, 3, 4, 3])
+    ]
+    pool = app.CandidatePool('pop')
+
+    requests_made = pool.fill(songs)
+
+    assert requests_made == stub.snapshot_calls()['recommendations'] > 0
+    for song in songs:
+        app.get_recommendations(song['tempo'], song['energy'], song['time_signature'], 'pop', pool)
+    assert stub.snapshot_calls()['recommendations'] == requests_made
+    assert pool.fill(songs) == 0
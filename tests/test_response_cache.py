@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+import app
+
+TRACK_IDS = ['p250t0', 'p250t1']
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return app.ResponseCache(str(tmp_path / 'cache.sqlite'))
+
+
+@pytest.fixture
+def short_ttl(monkeypatch):
+    monkeypatch.setattr(app, 'CACHE_TTLS', [('/v1/audio-features', 0.2)])
+
+
+@pytest.fixture
+def client(stub, tokens, cache):
+    spotify = app.SpotifyClient(tokens, cache, api_base=f'{stub.url}/v1')
+    yield spotify
+    spotify.close()
+
+
+def sent_etags(stub):
+    return [headers.get('If-None-Match') for _, _, _, headers in stub.requests_to('/v1/audio-features')]
+
+
+def test_expired_entries_are_revalidated_and_a_304_serves_the_stored_body(stub, client, short_ttl):
+    first = client.audio_features(TRACK_IDS)
+    time.sleep(0.3)
+
+    second = client.audio_features(TRACK_IDS)
+
+    assert second == first
+    etag = sent_etags(stub)[1]
+    assert etag is not None and sent_etags(stub) == [None, etag]
+    # The 304 restarted the entry's TTL, so the next call is answered locally
+    assert client.audio_features(TRACK_IDS) == first
+    assert len(sent_etags(stub)) == 2
+
+
+def test_expired_entries_are_replaced_when_the_body_changed(stub, client, short_ttl):
+    client.audio_features(TRACK_IDS)
+    stub.features['p250t0'] = dict(stub.features['p250t0'], energy=0.123)
+    time.sleep(0.3)
+
+    features = client.audio_features(TRACK_IDS)
+
+    assert features[0]['energy'] == 0.123
+    assert client.audio_features(TRACK_IDS)[0]['energy'] == 0.123
+    assert len(sent_etags(stub)) == 2
+
+
+def test_fresh_entries_skip_the_network_until_they_expire(stub, client, short_ttl):
+    client.audio_features(TRACK_IDS)
+    client.audio_features(TRACK_IDS)
+    assert len(sent_etags(stub)) == 1
+
+    time.sleep(0.3)
+    client.audio_features(TRACK_IDS)
+    assert len(sent_etags(stub)) == 2
+
+
+def test_cached_session_revalidates_with_if_none_match(stub, cache, short_ttl):
+    session = app.cached_session(cache)
+    url = f'{stub.url}/v1/audio-features'
+    try:
+        first = session.get(url, params={'ids': 'p250t0'})
+        time.sleep(0.3)
+        second = session.get(url, params={'ids': 'p250t0'})
+    finally:
+        session.close()
+
+    assert second.json() == first.json()
+    assert second.from_cache
+    assert sent_etags(stub) == [None, first.headers['ETag']]
+
+
+def test_least_recently_used_entries_are_evicted_past_max_bytes(tmp_path):
+    cache = app.ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=250)
+    for key in ('a', 'b', 'c'):
+        cache.store(key, b'x' * 100)
+        time.sleep(0.01)  # Distinct access times
+    assert cache.lookup('a') is None  # 300 bytes did not fit
+    cache.lookup('b')
+    time.sleep(0.01)
+
+    cache.store('d', b'x' * 100)
+
+    assert cache.lookup('c') is None
+    assert cache.lookup('b') is not None
+    assert cache.lookup('d') is not None
+
+
+def test_cache_size_survives_reopening(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    app.ResponseCache(path, max_bytes=250).store('a', b'x' * 200)
+
+    reopened = app.ResponseCache(path, max_bytes=250)
+    reopened.store('b', b'x' * 100)
+
+    assert reopened.lookup('a') is None
+    assert reopened.lookup('b') is not None
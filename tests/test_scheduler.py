@@ -0,0 +1,83 @@
+import threading
+import time
+
+import app
+
+
+def test_retry_after_is_honored_exactly():
+    scheduler = app.RequestScheduler(rate=1000, burst=1000)
+
+    assert scheduler.retry_delay(0, '2') == 2.0
+    assert scheduler.retry_delay(0, 'not a date') < app.BACKOFF_BASE + 1e-9
+    assert scheduler.retry_delay(app.MAX_ATTEMPTS - 1) is None
+
+
+def test_concurrent_retry_after_keeps_the_latest_deadline():
+    scheduler = app.RequestScheduler(rate=1000, burst=1000)
+    barrier = threading.Barrier(8)
+
+    def rate_limited(seconds):
+        barrier.wait()
+        scheduler.retry_delay(0, str(seconds))
+
+    threads = [threading.Thread(target=rate_limited, args=(seconds,)) for seconds in (1, 9, 2, 3, 4, 5, 6, 7)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert scheduler.delay('artists') > 8.5
+
+
+def test_rate_limited_requests_wait_for_retry_after(stub, tokens):
+    stub.fail('/v1/artists', 429, headers={'Retry-After': '0.3'})
+    scheduler = app.RequestScheduler(rate=1000, burst=1000)
+    spotify = app.SpotifyClient(tokens, api_base=f'{stub.url}/v1', scheduler=scheduler)
+    try:
+        start = time.monotonic()
+        artists = spotify.artists(['p250a0'])
+        elapsed = time.monotonic() - start
+    finally:
+        spotify.close()
+
+    assert artists[0]['id'] == 'p250a0'
+    assert elapsed >= 0.3
+    assert len(stub.requests_to('/v1/artists')) == 2
+
+
+def test_unauthorized_requests_retry_with_a_new_token(stub, tokens):
+    stub.fail('/v1/artists', 401)
+    spotify = app.SpotifyClient(tokens, api_base=f'{stub.url}/v1', scheduler=app.RequestScheduler(rate=1000, burst=1000))
+    try:
+        artists = spotify.artists(['p250a0'])
+    finally:
+        spotify.close()
+
+    assert artists[0]['id'] == 'p250a0'
+    assert tokens.invalidated == ['test-token']
+    sent = [headers['Authorization'] for _, _, _, headers in stub.requests_to('/v1/artists')]
+    assert sent == ['Bearer test-token', 'Bearer test-token-1']
+
+
+def test_rejected_explicit_token_is_not_sent_again(stub, tokens):
+    stub.fail('/v1/artists', 401)
+    spotify = app.SpotifyClient(tokens, api_base=f'{stub.url}/v1')
+    try:
+        # Callers such as gather_data() keep passing the token they fetched at the start
+        for artist_id in ('p250a0', 'p250a1', 'p250a2'):
+            spotify.artists([artist_id], 'stale-token')
+    finally:
+        spotify.close()
+
+    sent = [headers['Authorization'] for _, _, _, headers in stub.requests_to('/v1/artists')]
+    assert sent == ['Bearer stale-token', 'Bearer test-token-1', 'Bearer test-token-1', 'Bearer test-token-1']
+
+
+def test_token_provider_invalidates_only_the_rejected_token():
+    provider = app.TokenProvider('id', 'secret')
+    provider._token, provider._expires_at = 'new', time.monotonic() + 3600
+
+    provider.invalidate('old')
+    assert provider.get_token() == 'new'
+    provider.invalidate('new')
+    assert provider._token is None
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import app
+from test_profile import random_songs
+
+
+def targets(n, seed):
+    return [
+        {key: song[key] for key in ('tempo', 'energy', 'key', 'mode', 'time_signature')}
+        for song in random_songs(n, seed)
+    ]
+
+
+def test_top_k_matches_a_brute_force_ranking():
+    playlist = random_songs(400, seed=4)
+    generated = targets(20, seed=5)
+    engine = app.ScoringEngine(playlist)
+    # Undo the z-score scaling, so the engine's distance is calculate_difference()'s
+    weights = {'tempo': engine.scale[0], 'energy': engine.scale[1] / 2}
+
+    indices, distances = engine.top_k(generated, k=5, weights=weights)
+
+    for song, found, found_distances in zip(generated, indices, distances):
+        expected = sorted(range(len(playlist)), key=lambda i: app.calculate_difference(playlist[i], song))[:5]
+        assert found.tolist() == expected
+        assert found_distances == pytest.approx([app.calculate_difference(playlist[i], song) for i in expected])
+
+
+def test_chunks_give_the_same_result_as_one_block(monkeypatch):
+    engine = app.ScoringEngine(random_songs(300, seed=6))
+    generated = targets(app.SCORING_CHUNK_SIZE + 50, seed=7)
+    weights = {'tempo': 1, 'energy': 1, 'key': 0.5, 'mode': 0.5}
+
+    whole = np.argsort(engine.score(generated, weights), axis=1, kind='stable')[:, :3]
+    indices, _ = engine.top_k(generated, k=3, weights=weights)
+    assert indices.tolist() == whole.tolist()
+
+    monkeypatch.setattr(app, 'SCORING_CHUNK_SIZE', 7)
+    assert engine.top_k(generated, k=3, weights=weights)[0].tolist() == whole.tolist()
+
+
+@pytest.mark.parametrize('key, distance', [
+    (0, 0),  # C
+    (7, 1 / 6),  # G, one fifth away
+    (5, 1 / 6),  # F, one fifth the other way
+    (2, 2 / 6),  # D
+    (11, 5 / 6),  # B
+    (6, 1),  # F#, the far side of the circle
+])
+def test_keys_are_compared_around_the_circle_of_fifths(key, distance):
+    engine = app.ScoringEngine([dict(song, key=key) for song in random_songs(1)])
+
+    assert engine.score([{'key': 0}], {'key': 1})[0, 0] == pytest.approx(distance)
+
+
+def test_mode_and_time_signature_mismatches_add_their_weights():
+    playlist = [dict(song, mode=mode, time_signature=time_signature)
+                for song, mode, time_signature in zip(random_songs(4), [1, 1, 0, 0], [4, 3, 4, 3])]
+    engine = app.ScoringEngine(playlist)
+
+    distances = engine.score([{'mode': 1, 'time_signature': 4}], {'mode': 2, 'time_signature': 0.5})
+
+    assert distances[0].tolist() == pytest.approx([0, 0.5, 2, 2.5])
+    # Features a generated song leaves out do not count
+    assert engine.score([{}], {'mode': 2, 'time_signature': 0.5})[0].tolist() == [0, 0, 0, 0]
+
+
+def test_unweighted_features_are_ignored():
+    engine = app.ScoringEngine(random_songs(50, seed=8))
+    song = targets(1, seed=9)[0]
+
+    tempo_only = engine.score([song], {'tempo': 1})
+    with_zero_weights = engine.score([song], {'tempo': 1, 'energy': 0, 'key': 0, 'mode': 0})
+
+    assert with_zero_weights.tolist() == tempo_only.tolist()
@@ -0,0 +1,30 @@
+import asyncio
+
+import aiohttp
+
+import app
+
+
+def get_songs(service, playlist_id):
+    async def request():
+        runner = await service.start('127.0.0.1', 0)
+        try:
+            host, port = runner.addresses[0][:2]
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://{host}:{port}/playlists/{playlist_id}/songs') as response:
+                    return response.status, await response.json()
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(request())
+
+
+def test_playlist_without_profile_or_credentials_gets_a_json_error(monkeypatch, tmp_path):
+    monkeypatch.delenv('SPOTIFY_CLIENT_ID', raising=False)
+    monkeypatch.delenv('SPOTIFY_CLIENT_SECRET', raising=False)
+    monkeypatch.setattr(app.get_token_provider, 'instance', None)
+
+    status, body = get_songs(app.GenerationService(str(tmp_path)), 'unknown')
+
+    assert status == 503
+    assert 'no saved profile' in body['error']
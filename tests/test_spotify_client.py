@@ -0,0 +1,123 @@
+import asyncio
+import socket
+
+import pytest
+import requests
+
+import app
+from bench import build_fixture
+
+
+@pytest.fixture
+def client(stub, tokens):
+    spotify = app.SpotifyClient(tokens, max_concurrency=2, api_base=f'{stub.url}/v1')
+    yield spotify
+    spotify.close()
+
+
+def test_playlist_pages_arrive_in_order(stub, client):
+    pages = list(client.iter_playlist_pages('p250'))
+
+    assert [offset for offset, _ in pages] == [0, 100, 200]
+    names = [item['track']['name'] for _, page in pages for item in page['items']]
+    assert names == [f'Track {i}' for i in range(250)]
+    assert stub.snapshot_calls()['playlists'] == 3
+
+
+def test_playlist_pages_in_skip_are_not_requested(stub, client):
+    first_page = client.playlist_page('p250')
+    pages = dict(client.iter_playlist_pages('p250', first_page=first_page, skip={100}))
+
+    assert pages[100] is None
+    assert pages[200]['offset'] == 200
+    assert sorted(int(query['offset'][0]) for _, _, query, _ in stub.requests_to('/v1/playlists')) == [0, 200]
+
+
+def test_requests_carry_the_bearer_token(stub, client):
+    client.playlist_page('p250')
+
+    (_, _, _, headers), = stub.requests_to('/v1/playlists')
+    assert headers['Authorization'] == 'Bearer test-token'
+
+
+def test_artists_are_fetched_in_batches(stub, client):
+    stub.add_playlist('p1000', build_fixture('p1000', 1000))
+    artist_ids = sorted(stub.artists)[:120]
+
+    artists = client.artists(artist_ids)
+
+    assert [artist['id'] for artist in artists] == artist_ids
+    batches = [query['ids'][0].split(',') for _, _, query, _ in stub.requests_to('/v1/artists')]
+    assert sorted(map(len, batches)) == [20, 50, 50]
+
+
+def test_audio_features_are_fetched_in_batches(stub, client):
+    track_ids = sorted(stub.features)
+
+    features = client.audio_features(track_ids)
+
+    assert [feature['id'] for feature in features] == track_ids
+    assert stub.snapshot_calls()['audio-features'] == 3
+
+
+def test_recommendations_join_list_parameters(stub, client):
+    response = client.recommendations(seed_genres=['pop', 'rock'], target_tempo=120, limit=5)
+
+    assert len(response['tracks']) == 5
+    (_, _, query, _), = stub.requests_to('/v1/recommendations')
+    assert query['seed_genres'] == ['pop,rock']
+    assert query['target_tempo'] == ['120']
+
+
+def test_http_errors_are_raised_as_requests_exceptions(stub, client):
+    with pytest.raises(requests.exceptions.HTTPError) as excinfo:
+        client.playlist_page('missing')
+    assert excinfo.value.response.status_code == 404
+
+    stub.fail('/v1/artists', 500)
+    with pytest.raises(requests.exceptions.RequestException):
+        client.artists(['a'])
+
+
+def test_connection_errors_are_raised_as_requests_exceptions(tokens):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    spotify = app.SpotifyClient(tokens, api_base=f'http://127.0.0.1:{port}/v1')
+    try:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            spotify.playlist_page('p250')
+    finally:
+        spotify.close()
+
+
+def test_cached_responses_skip_the_network(stub, tokens, tmp_path):
+    cache = app.ResponseCache(str(tmp_path / 'cache.sqlite'))
+    spotify = app.SpotifyClient(tokens, cache, api_base=f'{stub.url}/v1')
+    try:
+        first = spotify.audio_features(['p250t0', 'p250t1'])
+        second = spotify.audio_features(['p250t0', 'p250t1'])
+    finally:
+        spotify.close()
+
+    assert first == second
+    assert stub.snapshot_calls()['audio-features'] == 1
+
+
+def test_async_client_runs_requests_concurrently(stub, tokens):
+    async def fetch():
+        async with app.AsyncSpotifyClient(tokens, max_concurrency=4, api_base=f'{stub.url}/v1') as spotify:
+            return await asyncio.gather(*(spotify.playlist_page('p250', offset) for offset in (0, 100, 200)))
+
+    pages = asyncio.run(fetch())
+
+    assert [len(page['items']) for page in pages] == [100, 100, 50]
+
+
+def test_token_provider_fetches_one_token_for_many_callers(stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'TOKEN_URL', f'{stub.url}/api/token')
+    monkeypatch.setattr(app.get_session, 'instance', app.cached_session(app.ResponseCache(str(tmp_path / 'cache.sqlite'))))
+    provider = app.TokenProvider('id', 'secret')
+
+    assert [provider.get_token() for _ in range(3)] == ['stub-token'] * 3
+    assert stub.snapshot_calls()['token'] == 1